@@ -1,77 +1,121 @@
+from collections import Counter
 from datetime import date, datetime
 from models import Student, Instructor, Staff, User
-from models import Course, Request
-from models import RequestForCourse
+from models import Course, Letter, Request
+from models import CourseEnrollment, CourseMentorship
+from models import RequestForCourse, RequestSummary
 from models import Message
 from models import STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED, STATUS_FULFILLED
-from passlib.hash import pbkdf2_sha256
-from mongoengine import ValidationError, DoesNotExist
+from mongoengine import ValidationError, DoesNotExist, NotUniqueError, OperationError
+from bson import ObjectId
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from transitions import transition, EVENT_FULFILL, EVENT_UNFULFILL
+from search import accessible_course_ids
+from letters import upload_letter, discard_letter
+from archive import find_archived
+from eventlog import record, record_many, record_each
+from eventlog import EVENT_SIGNUP, EVENT_QUOTA_SET, EVENT_ACCESS_GRANTED, EVENT_ACCESS_REVOKED
+from eventlog import EVENT_REQUEST_MADE, EVENT_REQUEST_WITHDRAWN, EVENT_REQUEST_FULFILLED, EVENT_REQUEST_UNFULFILLED
+from eventlog import EVENT_MESSAGE_SENT, EVENT_MENTOR_ASSIGNED, EVENT_MENTOR_WITHDRAWN
+from routing import routed, ALIAS_SECONDARY
+from tenancy import tenant_filter
+from versioning import bump, touch
+from profiling import profiled
+from idempotency import idempotent
+from messaging import recipient_counters, message_event, UNREAD_FIELDS
 from err import ActionError
 
 USER_ROLLS = [Student, Instructor, Staff]
 
 
-def signup(role, email, password, first_name, last_name, gender=None):
+def _hasher():
+    # passlib loads its registry of hashing backends on import, which only sign-up and sign-in need
+    from passlib.hash import pbkdf2_sha256
+    return pbkdf2_sha256
+
+
+def hash_password(password):
+    return _hasher().hash(password)
+
+
+@profiled
+@idempotent('email', ignore=('password',))
+def signup(role, email, password, first_name, last_name, gender=None, hashed=False):
+    # with `hashed`, `password` was hashed already by `hash_password`, e.g. before being queued in a job
     if role not in USER_ROLLS:
         raise RuntimeError(f"Unknown roll: {role}")
     # check for existing `email` in database
     if role.objects(email=email).count() > 0:
         raise ActionError(f"User {email} already exists")
     # hash `password`
-    pwd_hash = pbkdf2_sha256.hash(password)
+    pwd_hash = password if hashed else hash_password(password)
     # save to database
     user = role(email=email, password=pwd_hash, first_name=first_name, last_name=last_name)
     if gender:
         user.gender = gender
-    return user.save()
+    user.save()
+    record(EVENT_SIGNUP, user.id, role=role.__name__)
+    return user
 
 
+@profiled
 def signin(role, email, pwd_submitted):
     # verify `email` against `password`; return the user on success
     accounts = role.objects(email=email)
     if accounts.count() == 0:
         raise ActionError(f"Incorrect username or password")
     user = accounts.first()
-    if not pbkdf2_sha256.verify(pwd_submitted, user.password):
+    if not _hasher().verify(pwd_submitted, user.password):
         raise ActionError(f"Incorrect username or password")
     return user
 
 
+@profiled
 def change_password(role, user_email, old_password, password):
     # verify old password
     hashed_password = role.objects(email=user_email).get().password
-    if not pbkdf2_sha256.verify(old_password, hashed_password):
+    if not _hasher().verify(old_password, hashed_password):
         raise ActionError(f"Incorrect password")
     # update password
-    role.objects(email=user_email).update(set__password=pbkdf2_sha256.hash(password))
+    role.objects(email=user_email).update(set__password=_hasher().hash(password))
 
 
+@profiled
 def new_course(code, start_date, course_name, professor):
     course = Course(code=code, start_date=start_date, course_name=course_name, professor=professor).save()
     professor.update(add_to_set__courses=course)
     return course
 
 
+@profiled
 def set_letter_quota(student, recommender, course, quota, reset=False):
     if quota < 0:
         raise ValidationError(f"quota={quota} is too small.")
+    if not Student.objects(id=student.id).count():
+        raise DoesNotExist(f"Student {student} doesn't exist")
     # register `student` to `course` if necessary
-    course.update(add_to_set__students=student)
-
-    # register `course` to `student` if necessary. Check out the following documentation
-    # 1) https://stackoverflow.com/a/50658375
-    # 2) https://docs.mongoengine.org/apireference.html#mongoengine.base.datastructures.EmbeddedDocumentList
-    req_for_course = student.req_for_courses.filter(course=course, recommender=recommender)
-    if req_for_course.count() == 0:
-        student.req_for_courses.create(course=course, recommender=recommender, requests_quota=quota)
-    elif reset:
-        req_for_course.update(requests_quota=quota)
-    else:
-        raise ActionError(f"Letter quota already assigned to {recommender} for {course} exists")
-
-    return student.save()
+    if _link(CourseEnrollment, course=course, student=student):
+        touch(Course, [course.id])
+
+    # register `course` to `student` if necessary. Both writes are conditional on the quota being absent or present,
+    # so that concurrent calls neither add a second quota for the same course and recommender nor overwrite the
+    # requests sent meanwhile
+    r4c = {"course": course.id, "recommender": recommender.id}
+    created = Student.objects(__raw__={"_id": student.id, "req_for_courses": {"$not": {"$elemMatch": r4c}}}).update(
+        push__req_for_courses=RequestForCourse(course=course, recommender=recommender, requests_quota=quota)
+    )
+    if not created:
+        if not reset:
+            raise ActionError(f"Letter quota already assigned to {recommender} for {course} exists")
+        if not Student.objects(__raw__={"_id": student.id, "req_for_courses": {"$elemMatch": r4c}}).update(
+                __raw__={"$set": {"req_for_courses.$.requests_quota": quota}}):
+            raise DoesNotExist(f"Student {student} doesn't exist")
+    record(EVENT_QUOTA_SET, student.id, course=course.id, recommender=recommender.id, quota=quota)
+    return student.reload()
 
 
+@profiled
 def reset_course_professor(course, professor, revoke_access=True):
     # revoke access to course from original professor
     if revoke_access:
@@ -81,127 +125,404 @@ def reset_course_professor(course, professor, revoke_access=True):
     return course
 
 
+@profiled
 def set_course_coordinator(course, coordinator, revoke_access=True):
-    # revoke access to course from original coordinator
-    if revoke_access and course.coordinator is not None:
-        course.coordinator.update(pull__accessible_courses=course)
-    # set `course.coordinator` as `staff`
-    course.update(set__coordinator=coordinator)
-    coordinator.update(add_to_set__accessible_courses=course)
-    return course
-
-
+    return _single(set_course_coordinators([(course, coordinator)], revoke_access=revoke_access))
+
+
+@profiled
+def set_course_coordinators(pairs, revoke_access=True):
+    # set each `(course, coordinator)` of `pairs`, with one bulk write on `Course` and one on `Staff`; the result
+    # lists, for each pair in order, either the course or the exception that rejected it. A course given twice is
+    # rejected each time, since which of its coordinators would win the unordered write is undefined
+    counts = Counter(course.id for course, _ in pairs)
+    results = [
+        course if counts[course.id] == 1 else ActionError(f"{course} is given more than one coordinator")
+        for course, _ in pairs
+    ]
+    previous = {
+        raw['_id']: raw.get('coordinator')
+        for raw in Course.objects(id__in=[course.id for course, _ in pairs]).only('coordinator').as_pymongo()
+    }
+    _bulk(Course, results, [
+        (i, UpdateOne({'_id': course.id, **tenant_filter()}, bump(Course, {'$set': {'coordinator': coordinator.id}})))
+        for i, (course, coordinator) in enumerate(pairs) if not isinstance(results[i], Exception)
+    ])
+    staff_ops = []
+    revoked = []
+    for i, (course, coordinator) in enumerate(pairs):
+        if isinstance(results[i], Exception):
+            continue
+        # revoke access to course from original coordinator
+        old = previous.get(course.id)
+        if revoke_access and old is not None and old != coordinator.id:
+            staff_ops.append(
+                (i, UpdateOne({'_id': old, **tenant_filter()}, {'$pull': {'accessible_courses': course.id}}))
+            )
+            revoked.append((i, old, course.id))
+        staff_ops.append(
+            (i, UpdateOne({'_id': coordinator.id, **tenant_filter()}, {'$addToSet': {'accessible_courses': course.id}}))
+        )
+    _bulk(Staff, results, staff_ops)
+    record_each(EVENT_ACCESS_REVOKED, [
+        (old, {'course': course_id}) for i, old, course_id in revoked if not isinstance(results[i], Exception)
+    ])
+    record_each(EVENT_ACCESS_GRANTED, [
+        (coordinator.id, {'course': course.id})
+        for (course, coordinator), result in zip(pairs, results) if not isinstance(result, Exception)
+    ])
+    return results
+
+
+@profiled
 def assign_course_mentor(course, mentor):
-    course.update(add_to_set__mentors=mentor)
-    mentor.update(add_to_set__courses=course)
-    return course
-
-
+    return _single(assign_course_mentors([(course, mentor)]))
+
+
+@profiled
+def assign_course_mentors(pairs):
+    # link each `(course, mentor)` of `pairs`, with one bulk write on `CourseMentorship` and one on `Instructor`;
+    # the result lists, for each pair in order, either the course or the exception that rejected it
+    results = [course for course, _ in pairs]
+    now = datetime.utcnow()
+    _bulk(CourseMentorship, results, [
+        (i, UpdateOne({**tenant_filter(), 'course': course.id, 'mentor': mentor.id},
+                      {'$setOnInsert': {'date_created': now}}, upsert=True))
+        for i, (course, mentor) in enumerate(pairs)
+    ])
+    _bulk(Instructor, results, [
+        (i, UpdateOne({'_id': mentor.id, **tenant_filter()}, {'$addToSet': {'courses': course.id}}))
+        for i, (course, mentor) in enumerate(pairs) if not isinstance(results[i], Exception)
+    ])
+    # the mentors are part of the course
+    touch(Course, {course.id for course, result in zip(pairs, results) if not isinstance(result, Exception)})
+    record_each(EVENT_MENTOR_ASSIGNED, [
+        (course.id, {'mentor': mentor.id})
+        for (course, mentor), result in zip(pairs, results) if not isinstance(result, Exception)
+    ])
+    return results
+
+
+@profiled
 def withdraw_course_mentor(course, mentor, revoke_access=True):
-    course.update(pull__mentors=mentor)
+    return _single(withdraw_course_mentors([(course, mentor)], revoke_access=revoke_access))
+
+
+@profiled
+def withdraw_course_mentors(pairs, revoke_access=True):
+    # unlink each `(course, mentor)` of `pairs`, with one bulk write on `CourseMentorship` and, when `revoke_access`,
+    # one on `Instructor`; the result lists, for each pair in order, either the course or the exception
+    results = [course for course, _ in pairs]
+    _bulk(CourseMentorship, results, [
+        (i, DeleteOne({**tenant_filter(), 'course': course.id, 'mentor': mentor.id}))
+        for i, (course, mentor) in enumerate(pairs)
+    ])
     if revoke_access:
-        mentor.update(pull__courses=course)
-    return course
-
-
+        _bulk(Instructor, results, [
+            (i, UpdateOne({'_id': mentor.id, **tenant_filter()}, {'$pull': {'courses': course.id}}))
+            for i, (course, mentor) in enumerate(pairs) if not isinstance(results[i], Exception)
+        ])
+    touch(Course, {course.id for course, result in zip(pairs, results) if not isinstance(result, Exception)})
+    record_each(EVENT_MENTOR_WITHDRAWN, [
+        (course.id, {'mentor': mentor.id})
+        for (course, mentor), result in zip(pairs, results) if not isinstance(result, Exception)
+    ])
+    return results
+
+
+def _link(link, **fields):
+    # idempotently insert the `link` document relating `fields`; whether it was missing
+    result = link.objects(**fields).update_one(upsert=True, full_result=True,
+                                               set_on_insert__date_created=datetime.utcnow())
+    return result.upserted_id is not None
+
+
+@profiled
 def grant_access(staff, course):
     # grant to `staff` the access to `course`
-    staff.update(add_to_set__accessible_courses=course)
-    return staff
+    return _single(grant_accesses([(staff, course)]))
 
 
-def revoke_access(staff, course):
-    # revoke access to `course` from `staff
-    staff.update(pull__accessible_courses=course)
-    return staff
+@profiled
+def grant_accesses(pairs):
+    # grant each `(staff, course)` of `pairs`, with one bulk write on `Staff`; the result lists, for each pair in
+    # order, either the staff or the exception that rejected it
+    return _set_access(pairs, '$addToSet', EVENT_ACCESS_GRANTED)
 
 
+@profiled
+def revoke_access(staff, course):
+    # revoke access to `course` from `staff
+    return _single(revoke_accesses([(staff, course)]))
+
+
+@profiled
+def revoke_accesses(pairs):
+    return _set_access(pairs, '$pull', EVENT_ACCESS_REVOKED)
+
+
+def _set_access(pairs, operator, event):
+    results = [staff for staff, _ in pairs]
+    _bulk(Staff, results, [
+        (i, UpdateOne({'_id': staff.id, **tenant_filter()}, {operator: {'accessible_courses': course.id}}))
+        for i, (staff, course) in enumerate(pairs)
+    ])
+    record_each(event, [
+        (staff.id, {'course': course.id})
+        for (staff, course), result in zip(pairs, results) if not isinstance(result, Exception)
+    ])
+    return results
+
+
+def _bulk(document, results, ops):
+    # run the `(pair index, operation)` of `ops` in one unordered bulk write; a failed operation replaces the result
+    # of its pair by an exception
+    if not ops:
+        return
+    try:
+        document._get_collection().bulk_write([op for _, op in ops], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details["writeErrors"]:
+            exc_class = NotUniqueError if write_error["code"] == 11000 else OperationError
+            results[ops[write_error["index"]][0]] = exc_class(write_error["errmsg"])
+
+
+def _single(results):
+    # unwrap the only result of a batch action
+    result, = results
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+@profiled
+@idempotent('student')
 def make_request(student, instructor, course, school_applied, program_applied, deadline, date_created=None,
                  date_updated=None, status=STATUS_REQUESTED):
-    # make a request
-    req = Request(
-        student=student,
-        instructor=instructor,
-        course=course,
-        school_applied=school_applied,
-        program_applied=program_applied,
-        deadline=deadline,
-        date_created=date_created if date_created else date.today(),
-        date_updated=date_updated if date_updated else date.today(),
-        status=status,
-    ).save()
-    # register request to student
+    # make a single request
+    return _single(make_requests(student, instructor, course, [(school_applied, program_applied, deadline)],
+                                 date_created=date_created, date_updated=date_updated, status=status))
+
+
+@profiled
+def make_requests(student, instructor, course, applications, date_created=None, date_updated=None,
+                  status=STATUS_REQUESTED):
+    # make one request per `(school_applied, program_applied, deadline)` in `applications`; the result lists, for
+    # each application in order, either the saved `Request` or the exception that rejected it
+    results = []
+    reqs = []
+    # build each request under a pre-allocated id and validate it before any write is issued
+    for school_applied, program_applied, deadline in applications:
+        req = Request(
+            id=ObjectId(),
+            student=student,
+            instructor=instructor,
+            course=course,
+            school_applied=school_applied,
+            program_applied=program_applied,
+            deadline=deadline,
+            date_created=date_created if date_created else date.today(),
+            date_updated=date_updated if date_updated else date.today(),
+            status=status,
+        )
+        try:
+            req.validate()
+        except ValidationError as e:
+            results.append(e)
+            continue
+        results.append(req)
+        reqs.append(req)
+    if not reqs:
+        return results
+    summaries = [_summarize(req) for req in reqs]
+
+    # reserve quota for all valid requests and register them to student, before the requests are inserted
     # TODO use mongoengine syntax once this issue is resolved:
     # https://github.com/MongoEngine/mongoengine/issues/2339
-
     success = Student.objects(
         __raw__={
-            "email": student.email,
+            "_id": student.id,
             "req_for_courses": {
                 "$elemMatch": {
                     "course": course.id,
                     "recommender": instructor.id,
-                    "requests_quota": {"$gt": 0},
+                    "requests_quota": {"$gte": len(reqs)},
                 }
             }
         }
     ).update(
         __raw__={
-            "$inc": {"req_for_courses.$.requests_quota": -1},
-            "$push": {"req_for_courses.$.requests_sent": req.id}
+            "$inc": {"req_for_courses.$.requests_quota": -len(reqs)},
+            "$push": {
+                "req_for_courses.$.requests_sent": {"$each": [req.id for req in reqs]},
+                "request_summaries": {"$each": [summary.to_mongo() for summary in summaries]},
+            }
         }
     )
     if not success:
-        raise DoesNotExist(f"Student {student} has no remaining quota for course {course}")
+        err = DoesNotExist(f"Student {student} has less than {len(reqs)} remaining quota for course {course}")
+        return [err if isinstance(result, Request) else result for result in results]
+
+    # commit the requests; give the reserved quota back for every insert that fails
+    errors = {}
+    try:
+        Request._get_collection().insert_many([req.to_mongo() for req in reqs], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details["writeErrors"]:
+            exc_class = NotUniqueError if write_error["code"] == 11000 else OperationError
+            errors[reqs[write_error["index"]].id] = exc_class(write_error["errmsg"])
+    except Exception:
+        _release_quota(student.id, course.id, instructor.id, [req.id for req in reqs])
+        raise
+    if errors:
+        _release_quota(student.id, course.id, instructor.id, list(errors))
+        results = [errors.get(result.id, result) if isinstance(result, Request) else result for result in results]
+        reqs = [req for req in reqs if req.id not in errors]
+    for req in reqs:
+        req._created = False
+        req._clear_changed_fields()
+
+    # register `requests` to `instructor`
+    if reqs:
+        summaries = [summary for summary in summaries if summary.request.id not in errors]
+        instructor.update(push_all__request_summaries=summaries)
+        record_many(EVENT_REQUEST_MADE, [req.id for req in reqs], student=student.id, instructor=instructor.id,
+                    course=course.id, status=status)
+
+    return results
+
+
+def _summarize(req):
+    return RequestSummary(
+        request=req,
+        course_code=req.course.code,
+        school_applied=req.school_applied,
+        program_applied=req.program_applied,
+        deadline=req.deadline,
+        status=req.status,
+        student_name=req.student.first_name + ' ' + req.student.last_name,
+        instructor_name=req.instructor.first_name + ' ' + req.instructor.last_name,
+    )
 
-    # register `request` to `instructor`
-    instructor.update(push__requests_received=req)
 
-    return req
+def _release_quota(student_id, course_id, instructor_id, request_ids):
+    # unregister `request_ids` from the student and give their quota back, compensating a reservation made by
+    # `make_requests` or withdrawing them
+    return Student.objects(
+        __raw__={
+            "_id": student_id,
+            "req_for_courses": {
+                "$elemMatch": {
+                    "course": course_id,
+                    "recommender": instructor_id,
+                    "requests_sent": {"$all": request_ids},
+                }
+            }
+        }
+    ).update(
+        __raw__={
+            "$inc": {"req_for_courses.$.requests_quota": len(request_ids)},
+            "$pull": {
+                "req_for_courses.$.requests_sent": {"$in": request_ids},
+                "request_summaries": {"request": {"$in": request_ids}},
+            }
+        }
+    )
 
 
+@profiled
 def withdraw_request(student, request):
-    r4c = student.req_for_courses.filter(course=request.course, recommender=request.instructor).get()
-    if request in r4c.requests_sent:
-        if request.status == STATUS_FULFILLED:
+    # delete the request unless it is fulfilled, then give its quota back, each in one atomic write: of concurrent
+    # withdrawals only the one deleting the request releases its quota
+    raw = Request._get_collection().find_one_and_delete(
+        {"_id": request.id, "student": student.id, "status": {"$ne": STATUS_FULFILLED}, **tenant_filter()},
+        projection={"course": 1, "instructor": 1, "letter": 1},
+    )
+    if raw is None:
+        if Request.objects(id=request.id, student=student, status=STATUS_FULFILLED).count():
             raise ActionError("This request has been fulfilled")
-        r4c.requests_sent.remove(request)
-        r4c.requests_quota += 1
-        student.save()
-        request.delete()
-    else:
         raise DoesNotExist(f"Request {request} doesn't exist")
+    _release_quota(student.id, raw["course"], raw["instructor"], [request.id])
+    Instructor.objects(id=raw["instructor"]).update(
+        __raw__={"$pull": {"request_summaries": {"request": {"$in": [request.id]}}}}
+    )
+    if raw.get("letter") is not None:
+        discard_letter(Letter(id=raw["letter"]))
+    record(EVENT_REQUEST_WITHDRAWN, request.id, student=student.id)
 
 
-def send_msg(sender, content, request, time=None):
+@profiled
+@idempotent('sender', ignore=('buffer',))
+def send_msg(sender, content, request, time=None, buffer=None):
     # construct a `Message` document
     if time is None:
         time = datetime.utcnow()
     msg = Message(sender=sender, content=content, time=time)
-    # append to `request` Document
-    request.update(push__messages=msg)
+    msg.validate()
+    if buffer is not None:
+        # write-behind: queue to the `msgbuffer.MessageBuffer`, which pushes to `request` and logs the message when
+        # flushed
+        buffer.append(request, msg)
+        return msg
+    # append to `request` Document, counting it as unread by its recipients
+    request.update(push__messages=msg, **{f'inc__{counter}': 1 for counter in recipient_counters(msg)})
+    record(EVENT_MESSAGE_SENT, request.id, **message_event(msg))
     return msg
 
 
-def fulfill_request(instructor, request, when=None):
-    if request not in instructor.requests_received:
+@profiled
+def mark_read(user, request):
+    # mark the messages of `request` read by `user`, its student or instructor; a request without unread messages is
+    # left untouched, so that its version does not change
+    if type(user) not in UNREAD_FIELDS:
+        raise RuntimeError(f"Unknown roll: {type(user)}")
+    participant, counter = UNREAD_FIELDS[type(user)]
+    requests = Request.objects(id=request.id, **{participant: user})
+    if not requests.filter(**{f'{counter}__gt': 0}).update_one(**{f'set__{counter}': 0}) and not requests.count():
+        raise DoesNotExist(f"{user} has not sent or received {request}")
+
+
+@profiled
+def fulfill_request(instructor, request, when=None, letter=None, content_type='application/pdf'):
+    # mark `request.status` as `STATUS_FULFILLED`, attaching the letter read from the binary file-like `letter`
+    if letter is None:
+        transition(request, EVENT_FULFILL, instructor=instructor, when=when)
+        record(EVENT_REQUEST_FULFILLED, request.id, instructor=instructor.id, status=STATUS_FULFILLED)
+        return request
+    # refuse before streaming the upload
+    if not Request.objects(id=request.id, instructor=instructor).count():
         raise DoesNotExist(f'{request} has not been received by {instructor} or has been revoked')
-    if request.status == STATUS_FULFILLED:
-        raise ActionError(f'{request} already fulfilled')
-    # mark `request.status` as `STATUS_FULFILLED`
-    request.update(set__status=STATUS_FULFILLED, set__date_fulfilled=when or date.today())
+    stored = upload_letter(letter, content_type=content_type)
+    try:
+        transition(request, EVENT_FULFILL, instructor=instructor, when=when, letter=stored)
+    except (DoesNotExist, ActionError):
+        # unless other requests share it
+        discard_letter(stored)
+        raise
+    record(EVENT_REQUEST_FULFILLED, request.id, instructor=instructor.id, status=STATUS_FULFILLED, letter=stored.id)
     return request
 
 
+@profiled
 def unfulfill_request(instructor, request):
-    if request not in instructor.requests_received:
-        raise DoesNotExist(f'{request} has not been received by {instructor} or has been revoked')
-    if request.status != STATUS_FULFILLED:
-        raise ActionError(f'{request} not yet fulfilled')
-    request.update(set__status=STATUS_UNFULFILLED, unset__date_fulfilled=True)
+    transition(request, EVENT_UNFULFILL, instructor=instructor)
+    record(EVENT_REQUEST_UNFULFILLED, request.id, instructor=instructor.id, status=STATUS_UNFULFILLED)
     return request
 
 
-def view_requests(staff, by=None, vals=None):
-    # TODO get all `requests` satisfying a criterion
-    pass
+@profiled
+def view_requests(staff, by=None, vals=None, alias=ALIAS_SECONDARY, include_archive=False):
+    # get all `requests` whose field `by` takes one of `vals`, among the courses accessible to `staff`. Read-only,
+    # so served by secondaries when routes are configured. With `include_archive`, archived requests are included,
+    # and a list is returned instead of a queryset
+    queryset = Request.objects
+    course_ids = accessible_course_ids(staff)
+    if course_ids is not None:
+        queryset = queryset.filter(course__in=course_ids)
+    if by is not None:
+        queryset = queryset.filter(**{f'{by}__in': vals})
+    queryset = routed(queryset.order_by('deadline', 'date_created'), alias)
+    if not include_archive:
+        return queryset
+    archived = [Request._from_son(raw) for raw in find_archived(queryset, alias)]
+    return sorted(list(queryset) + archived, key=lambda req: (req.deadline, req.date_created))
@@ -1,4 +1,14 @@
-from flask import Flask
+from bson import ObjectId, json_util
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
+from mongoengine import DoesNotExist, ValidationError
+from models import Student, Instructor, Staff, Request, Job
+from actions import signin, fulfill_request
+from letters import open_letter, iter_letter
+from archive import get_raw_request
+from messaging import resolve_senders
+from err import ActionError
+import jobs
+import profiling
 
 app = Flask(__name__)
 
@@ -8,5 +18,141 @@ def hello_world():
     return 'Hello World!'
 
 
+@app.route('/requests/<request_id>')
+def show_request(request_id):
+    # the request as JSON to its student or instructor, archived or not, tagged with its version; revalidating an
+    # unchanged request reads its version alone and answers 304 without loading or serializing the document
+    user = _authenticate(Student, Instructor)
+    raw = get_raw_request(_request(request_id).id, 'student', 'instructor', 'version')
+    if raw is None:
+        abort(404)
+    if user.id not in (raw['student'], raw['instructor']):
+        abort(403)
+    etag = str(raw.get('version', 0))
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    raw = get_raw_request(raw['_id'])
+    if raw is None:
+        abort(404)
+    raw.pop('search_keys', None)
+    # messages are stored in the order they were written, not sent
+    raw['messages'] = sorted(resolve_senders(raw.get('messages', [])), key=lambda msg: msg['time'])
+    response = Response(json_util.dumps(raw), mimetype='application/json')
+    response.set_etag(str(raw.get('version', 0)))
+    return response
+
+
+@app.route('/requests/<request_id>/letter', methods=['PUT'])
+def upload_letter(request_id):
+    # fulfill the request with the letter in the body, streamed into GridFS as it arrives
+    instructor = _authenticate(Instructor)
+    try:
+        fulfill_request(instructor, _request(request_id), letter=request.stream,
+                        content_type=request.mimetype or 'application/pdf')
+    except DoesNotExist:
+        abort(404)
+    except ActionError:
+        abort(409)
+    except ValidationError:
+        abort(413)
+    return '', 204
+
+
+@app.route('/requests/<request_id>/letter')
+def download_letter(request_id):
+    # stream the letter of the request to its student or instructor, one GridFS chunk at a time
+    user = _authenticate(Student, Instructor)
+    try:
+        letter, stream = open_letter(user, _request(request_id))
+    except DoesNotExist:
+        abort(404)
+    except ActionError:
+        abort(403)
+    if request.if_none_match.contains(letter.sha256):
+        stream.close()
+        return Response(status=304, headers={'ETag': f'"{letter.sha256}"'})
+    headers = {'Content-Length': str(letter.length), 'ETag': f'"{letter.sha256}"'}
+    return Response(stream_with_context(iter_letter(stream)), mimetype=letter.content_type, headers=headers)
+
+
+@app.route('/jobs/<job_id>')
+def show_job(job_id):
+    # the status, progress and ETA of a background job, to staff with full access
+    _full_access_staff()
+    job = _job(job_id)
+    eta = job.eta
+    return jsonify({
+        'id': str(job.id),
+        'name': job.name,
+        'status': job.status,
+        'done': job.done,
+        'total': job.total,
+        'eta_seconds': eta.total_seconds() if eta is not None else None,
+        'attempts': job.attempts,
+        'error': job.error,
+    })
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    _full_access_staff()
+    if not jobs.cancel_job(_job(job_id)):
+        abort(409)
+    return '', 202
+
+
+def _full_access_staff():
+    staff = _authenticate(Staff)
+    if not staff.full_access:
+        abort(403)
+    return staff
+
+
+def _job(job_id):
+    if not ObjectId.is_valid(job_id):
+        abort(404)
+    job = Job.objects(id=job_id).first()
+    if job is None:
+        abort(404)
+    return job
+
+
+def _authenticate(*roles):
+    # the user signing in through HTTP basic auth, with their email as the username
+    auth = request.authorization
+    if auth is None:
+        abort(401)
+    for role in roles:
+        try:
+            return signin(role, auth.username, auth.password)
+        except ActionError:
+            pass
+    abort(401)
+
+
+def _request(request_id):
+    if not ObjectId.is_valid(request_id):
+        abort(404)
+    return Request(id=ObjectId(request_id))
+
+
+@app.route('/debug/profile')
+def profile_stacks():
+    # collapsed stacks of the profiled actions, to staff with full access, e.g.
+    # `curl -u <email> .../debug/profile | flamegraph.pl > actions.svg`
+    _full_access_staff()
+    if not profiling.is_enabled():
+        abort(404)
+    return Response(profiling.collapsed_stacks(), mimetype='text/plain')
+
+
+@app.route('/debug/profile/stats')
+def profile_stats():
+    _full_access_staff()
+    if not profiling.is_enabled():
+        abort(404)
+    return jsonify(profiling.action_stats())
+
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,102 @@
+from datetime import date, datetime, time
+from models import Student, Instructor
+from models import Request
+from models import STATUS_UNFULFILLED, STATUS_FULFILLED
+from bson import ObjectId
+from mongoengine import DoesNotExist
+from pymongo import ReplaceOne, DeleteOne
+from tenancy import tenant_filter
+from routing import routed_db, ALIAS_PRIMARY
+from versioning import bump
+from eventlog import record_many, EVENT_REQUEST_ARCHIVED
+
+ARCHIVE_COLLECTION = 'request_archive'
+ARCHIVABLE_STATUSES = [STATUS_FULFILLED, STATUS_UNFULFILLED]
+
+
+def archive_requests(cutoff, batch_size=1000):
+    # move fulfilled/unfulfilled requests whose deadline is before `cutoff` to the archive collection, and unregister
+    # them from students and from the request summaries; returns the number of requests archived
+    if isinstance(cutoff, date) and not isinstance(cutoff, datetime):
+        cutoff = datetime.combine(cutoff, time())
+    hot = Request._get_collection()
+    archive = _archive()
+    query = {"status": {"$in": ARCHIVABLE_STATUSES}, "deadline": {"$lt": cutoff}, **tenant_filter()}
+    archived = 0
+    while True:
+        batch = list(hot.find(query, limit=batch_size))
+        if not batch:
+            return archived
+        # copy before deleting; upserts make a pass interrupted in between safe to re-run
+        archive.bulk_write([ReplaceOne({"_id": raw["_id"]}, raw, upsert=True) for raw in batch], ordered=False)
+        # delete only the requests unchanged since copied: a request written meanwhile stays, its copy is dropped,
+        # and it is copied again by the next pass if it is still archivable
+        hot.bulk_write([
+            DeleteOne({"_id": raw["_id"], "version": raw.get("version"), "status": raw["status"]}) for raw in batch
+        ], ordered=False)
+        changed = {raw["_id"] for raw in hot.find({"_id": {"$in": [raw["_id"] for raw in batch]}}, {"_id": 1})}
+        if changed:
+            archive.delete_many({"_id": {"$in": list(changed)}})
+        ids = [raw["_id"] for raw in batch if raw["_id"] not in changed]
+        if not ids:
+            continue
+        # prune the reference lists and summaries of the whole batch in one update per collection
+        Student._get_collection().update_many(
+            {"$or": [{"req_for_courses.requests_sent": {"$in": ids}}, {"request_summaries.request": {"$in": ids}}],
+             **tenant_filter()},
+            bump(Student, {"$pull": {"req_for_courses.$[].requests_sent": {"$in": ids},
+                                     "request_summaries": {"request": {"$in": ids}}}}),
+        )
+        Instructor._get_collection().update_many(
+            {"request_summaries.request": {"$in": ids}, **tenant_filter()},
+            bump(Instructor, {"$pull": {"request_summaries": {"request": {"$in": ids}}}}),
+        )
+        record_many(EVENT_REQUEST_ARCHIVED, ids)
+        archived += len(ids)
+
+
+def get_request(request_id):
+    # read-through lookup: the hot collection first, then the archive
+    raw = get_raw_request(request_id)
+    if raw is None:
+        raise DoesNotExist(f"Request {request_id} doesn't exist")
+    return Request._from_son(raw)
+
+
+def get_raw_request(request_id, *fields):
+    # read-through lookup of the raw request, or of only its `fields`; None if it is neither hot nor archived
+    queryset = Request.objects(id=request_id)
+    if fields:
+        queryset = queryset.only(*fields)
+    raw = queryset.as_pymongo().first()
+    if raw is None:
+        raw = _archive().find_one({"_id": ObjectId(request_id), **tenant_filter()}, dict.fromkeys(fields, 1) or None)
+    return raw
+
+
+def get_requests(request_ids):
+    # read-through lookup of many requests, in the order of `request_ids`; missing requests are left out
+    # `in_bulk` would bypass the tenant scope of the queryset
+    found = {req.id: req for req in Request.objects(id__in=request_ids)}
+    missing = [ObjectId(request_id) for request_id in request_ids if request_id not in found]
+    if missing:
+        found.update(
+            (raw["_id"], Request._from_son(raw))
+            for raw in _archive().find({"_id": {"$in": missing}, **tenant_filter()})
+        )
+    return [found[request_id] for request_id in request_ids if request_id in found]
+
+
+def find_archived(queryset, alias=ALIAS_PRIMARY, **kwargs):
+    # a cursor over the raw archived requests matching the filters of the `Request` queryset, read through `alias`
+    return _archive(alias).find(queryset._query, **kwargs)
+
+
+def count_archived(queryset, alias=ALIAS_PRIMARY):
+    return _archive(alias).count_documents(queryset._query)
+
+
+def _archive(alias=ALIAS_PRIMARY):
+    # the archive collection, queried directly: `switch_collection` would swap the collection of `Request` for every
+    # thread while in use
+    return routed_db(alias)[ARCHIVE_COLLECTION]
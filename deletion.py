@@ -0,0 +1,62 @@
+from mongoengine import CASCADE, DENY, PULL, NULLIFY
+from mongoengine import OperationError
+from tenancy import tenant_filter
+
+
+def plan_delete(document, ids, _visited=None):
+    # compute, once for the whole set of `ids`, what deleting them implies under `document`'s reverse delete rules:
+    # the referencing documents counted per (document, field) for DENY/NULLIFY/PULL, and a nested plan per CASCADE
+    ids = [getattr(_id, 'id', _id) for _id in ids]
+    visited = set() if _visited is None else _visited
+    visited.update((document, _id) for _id in ids)
+    plan = {'document': document, 'ids': ids, 'deny': [], 'nullify': [], 'pull': [], 'cascade': []}
+    if not ids:
+        return plan
+    for (ref_document, field), rule in (document._meta.get('delete_rules') or {}).items():
+        if ref_document._meta.get('abstract'):
+            continue
+        refs = ref_document.objects(**{f'{field}__in': ids})
+        if rule == CASCADE:
+            ref_ids = [raw['_id'] for raw in refs.only('id').as_pymongo()]
+            ref_ids = [_id for _id in ref_ids if (ref_document, _id) not in visited]
+            plan['cascade'].append(plan_delete(ref_document, ref_ids, _visited=visited))
+        elif rule == DENY:
+            plan['deny'].append((ref_document, field, refs.count()))
+        elif rule == NULLIFY:
+            plan['nullify'].append((ref_document, field, refs.count()))
+        elif rule == PULL:
+            plan['pull'].append((ref_document, field, refs.count()))
+    return plan
+
+
+def bulk_delete(document, ids, dry_run=False):
+    # delete every `document` in `ids` honoring the reverse delete rules, with one query per rule rather than one
+    # per rule and document; returns the plan, which is all that happens when `dry_run`
+    plan = plan_delete(document, ids)
+    if dry_run:
+        return plan
+    for ref_document, field, count in _violations(plan):
+        raise OperationError(f"Could not delete documents ({ref_document.__name__}.{field} refers to {count} of them)")
+    _execute(plan)
+    return plan
+
+
+def _violations(plan):
+    for ref_document, field, count in plan['deny']:
+        if count:
+            yield ref_document, field, count
+    for sub_plan in plan['cascade']:
+        yield from _violations(sub_plan)
+
+
+def _execute(plan):
+    document, ids = plan['document'], plan['ids']
+    if not ids:
+        return
+    for sub_plan in plan['cascade']:
+        _execute(sub_plan)
+    for ref_document, field, _ in plan['nullify']:
+        ref_document.objects(**{f'{field}__in': ids}).update(**{f'unset__{field}': 1})
+    for ref_document, field, _ in plan['pull']:
+        ref_document.objects(**{f'{field}__in': ids}).update(**{f'pull_all__{field}': ids})
+    document._get_collection().delete_many({'_id': {'$in': ids}, **tenant_filter()})
@@ -0,0 +1,180 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from pymongo import UpdateOne, ReturnDocument
+from models import Event, Counter, ProjectionCheckpoint, ProjectionEntry
+from tenancy import current_tenant
+
+# every state change made by an action is appended to the `Event` log right after it is written. Projections fold
+# the log into read models; they are rebuilt from scratch by replaying it, in checkpointed batches
+
+EVENT_SIGNUP = 'signup'
+EVENT_QUOTA_SET = 'quota_set'
+EVENT_REQUEST_MADE = 'request_made'
+EVENT_REQUEST_WITHDRAWN = 'request_withdrawn'
+EVENT_REQUEST_EMAILED = 'request_emailed'
+EVENT_REQUEST_FULFILLED = 'request_fulfilled'
+EVENT_REQUEST_UNFULFILLED = 'request_unfulfilled'
+EVENT_REQUEST_ARCHIVED = 'request_archived'
+EVENT_MESSAGE_SENT = 'message_sent'
+EVENT_ACCESS_GRANTED = 'access_granted'
+EVENT_ACCESS_REVOKED = 'access_revoked'
+EVENT_MENTOR_ASSIGNED = 'mentor_assigned'
+EVENT_MENTOR_WITHDRAWN = 'mentor_withdrawn'
+EVENT_COURSE_ROLLED_OVER = 'course_rolled_over'
+
+# events are consumed in `seq` order. Positions are allocated by the server from one counter, each with the server's
+# time, so that they do not depend on the clocks of the writing processes; an event may still be inserted after one
+# with a larger position, so projections only read events allocated this long ago, which inserts have settled by
+SETTLE_TIME = timedelta(seconds=5)
+EVENT_SEQUENCE = 'events'
+
+# `fold(state, events)` returns `state` updated with a batch of raw events in log order, and `merge(a, b)` combines
+# the states of two consecutive spans of the log. Both are module-level functions, so that batches can be folded in
+# worker processes. The state of a `keyed` projection maps string keys to values, a later value replacing an earlier
+# one; it is stored as one `ProjectionEntry` per key rather than in the checkpoint, so that it can grow unbounded
+Projection = namedtuple('Projection', ['name', 'fold', 'merge', 'keyed'], defaults=[False])
+
+
+def record(type, subject, **data):
+    # append an event about the document with id `subject`
+    seq, logged = _allocate(1)
+    return Event(type=type, subject=subject, data=data, seq=seq, date_logged=logged).save(force_insert=True)
+
+
+def record_many(type, subjects, **data):
+    # append one event per id in `subjects`, with one insert
+    record_each(type, [(subject, data) for subject in subjects])
+
+
+def record_each(type, entries):
+    # append one event per `(subject, data)` in `entries`, with one insert
+    if entries:
+        first, logged = _allocate(len(entries))
+        Event.objects.insert([
+            Event(type=type, subject=subject, data=data, seq=first + i, date_logged=logged)
+            for i, (subject, data) in enumerate(entries)
+        ], load_bulk=False)
+
+
+def _allocate(count):
+    # reserve `count` consecutive positions in the log; returns the first and the server's time
+    raw = Counter._get_collection().find_one_and_update(
+        {'_id': EVENT_SEQUENCE},
+        [{'$set': {'value': {'$add': [{'$ifNull': ['$value', 0]}, count]}, 'time': '$$NOW'}}],
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    return raw['value'] - count + 1, raw['time']
+
+
+def _server_time():
+    return Event._get_db().command('hello')['localTime']
+
+
+def run_projection(projection, batch_size=10000, workers=None, until=None):
+    # consume the events logged since the last checkpoint of `projection` and return its state. Batches are folded
+    # `workers` at a time in a process pool, or in this process if `workers` is None; the checkpoint is saved after
+    # each round, so an interrupted run resumes where it stopped. A round's entries of a keyed projection are written
+    # before its checkpoint, and writing them again when the round is replayed changes nothing
+    name = _checkpoint_name(projection)
+    checkpoint = ProjectionCheckpoint.objects(name=name).first() or ProjectionCheckpoint(name=name, state={})
+    if until is None:
+        until = _server_time() - SETTLE_TIME
+    query = {'date_logged__lt': until}
+    if checkpoint.last_seq is not None:
+        query['seq__gt'] = checkpoint.last_seq
+    cursor = Event.objects(**query).order_by('seq').as_pymongo().no_cache().batch_size(batch_size)
+    # a queryset iterated anew starts over; a generator over it does not
+    events = (raw for raw in cursor)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        while True:
+            batches = [batch for batch in (list(islice(events, batch_size)) for _ in range(workers or 1)) if batch]
+            if not batches:
+                return _load_entries(name) if projection.keyed else checkpoint.state
+            if pool is None:
+                states = [projection.fold({}, batches[0])]
+            else:
+                states = list(pool.map(projection.fold, [{}] * len(batches), batches))
+            if projection.keyed:
+                changes = {}
+                for state in states:
+                    changes = projection.merge(changes, state)
+                _save_entries(name, changes)
+            else:
+                for state in states:
+                    checkpoint.state = projection.merge(checkpoint.state, state)
+            checkpoint.last_seq = batches[-1][-1]['seq']
+            checkpoint.date_updated = datetime.utcnow()
+            checkpoint.save()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def rebuild_projection(projection, batch_size=10000, workers=None, until=None):
+    # drop the checkpoint of `projection` and replay the whole log
+    ProjectionCheckpoint.objects(name=_checkpoint_name(projection)).delete()
+    ProjectionEntry.objects(projection=_checkpoint_name(projection)).delete()
+    return run_projection(projection, batch_size=batch_size, workers=workers, until=until)
+
+
+def _checkpoint_name(projection):
+    # projections run in a tenant scope only see that tenant's events, so they keep their own checkpoint
+    tenant = current_tenant()
+    return projection.name if tenant is None else f'{projection.name}:{tenant}'
+
+
+def _save_entries(name, changes):
+    if changes:
+        ProjectionEntry._get_collection().bulk_write([
+            UpdateOne({'projection': name, 'key': key}, {'$set': {'value': value}}, upsert=True)
+            for key, value in changes.items()
+        ], ordered=False)
+
+
+def _load_entries(name):
+    return {raw['key']: raw.get('value') for raw in ProjectionEntry.objects(projection=name).as_pymongo()}
+
+
+def _fold_stats(state, events):
+    # number of events per type, and of requests made per course
+    for event in events:
+        counts = state.setdefault('events', {})
+        counts[event['type']] = counts.get(event['type'], 0) + 1
+        if event['type'] == EVENT_REQUEST_MADE:
+            courses = state.setdefault('requests_by_course', {})
+            course = str(event['data']['course'])
+            courses[course] = courses.get(course, 0) + 1
+    return state
+
+
+def _merge_stats(a, b):
+    merged = {}
+    for key in a.keys() | b.keys():
+        merged[key] = dict(a.get(key, {}))
+        for k, n in b.get(key, {}).items():
+            merged[key][k] = merged[key].get(k, 0) + n
+    return merged
+
+
+_STATUS_EVENTS = frozenset([EVENT_REQUEST_MADE, EVENT_REQUEST_WITHDRAWN, EVENT_REQUEST_EMAILED,
+                            EVENT_REQUEST_FULFILLED, EVENT_REQUEST_UNFULFILLED])
+
+
+def _fold_statuses(state, events):
+    # the latest status of each request by id, or None once withdrawn
+    for event in events:
+        if event['type'] in _STATUS_EVENTS:
+            state[str(event['subject'])] = event['data'].get('status')
+    return state
+
+
+def _merge_statuses(a, b):
+    # `b` follows `a` in the log
+    return dict(a, **b)
+
+
+REQUEST_STATS = Projection('request_stats', _fold_stats, _merge_stats)
+REQUEST_STATUSES = Projection('request_statuses', _fold_statuses, _merge_statuses, keyed=True)
@@ -0,0 +1,168 @@
+import csv
+import json
+from itertools import chain
+from models import Student, Instructor
+from models import Course, Request
+from routing import routed, ALIAS_ANALYTICS
+from messaging import resolve_senders
+from archive import find_archived, count_archived
+from err import ActionError
+
+EXPORT_NDJSON = 'ndjson'
+EXPORT_CSV = 'csv'
+EXPORT_PARQUET = 'parquet'
+
+EXPORT_COLUMNS = [
+    'id',
+    'student_email',
+    'student_name',
+    'instructor_email',
+    'instructor_name',
+    'course_code',
+    'school_applied',
+    'program_applied',
+    'deadline',
+    'date_created',
+    'date_updated',
+    'date_fulfilled',
+    'status',
+    'messages',
+]
+
+
+def export_requests(fp, fmt=EXPORT_NDJSON, since=None, until=None, batch_size=1000, alias=ALIAS_ANALYTICS,
+                    progress=None, include_archive=False):
+    # stream every request created in [since, until) with its messages to `fp`; returns the number of rows written.
+    # `fp` is a text file for ndjson/csv, and a path or binary file for parquet. `progress(rows, total)` is called
+    # after each batch. With `include_archive`, archived requests are exported too
+    writer = _WRITERS.get(fmt)
+    if writer is None:
+        raise RuntimeError(f"Unknown export format: {fmt}")
+    query = {}
+    if since is not None:
+        query['date_created__gte'] = since
+    if until is not None:
+        query['date_created__lt'] = until
+    batches = iter_request_batches(batch_size=batch_size, alias=alias, include_archive=include_archive, **query)
+    if progress is not None:
+        total = routed(Request.objects(**query), alias).count()
+        if include_archive:
+            total += count_archived(Request.objects(**query), alias)
+        batches = _reporting(batches, progress, total)
+    return writer(fp, batches)
+
+
+def iter_request_batches(batch_size=1000, alias=ALIAS_ANALYTICS, include_archive=False, **query):
+    # yield lists of at most `batch_size` flat request records; only one batch is held in memory at a time. With
+    # `include_archive`, the archived requests follow the others
+    cursor = routed(Request.objects(**query), alias).exclude('search_keys').order_by('id').as_pymongo().no_cache()
+    cursors = [cursor.batch_size(batch_size)]
+    if include_archive:
+        cursors.append(find_archived(Request.objects(**query), alias, projection={'search_keys': 0}, sort=[('_id', 1)],
+                                     batch_size=batch_size))
+    batch = []
+    for raw in chain.from_iterable(cursors):
+        batch.append(raw)
+        if len(batch) == batch_size:
+            yield _resolve(batch, alias)
+            batch = []
+    if batch:
+        yield _resolve(batch, alias)
+
+
+def _resolve(batch, alias):
+    # resolve the references of a batch of raw requests with one `$in` lookup per referenced collection
+    students = _lookup(Student, {raw['student'] for raw in batch}, alias, 'email', 'first_name', 'last_name')
+    instructors = _lookup(Instructor, {raw['instructor'] for raw in batch}, alias, 'email', 'first_name', 'last_name')
+    courses = _lookup(Course, {raw['course'] for raw in batch}, alias, 'code')
+    resolve_senders([msg for raw in batch for msg in raw.get('messages', [])], alias=alias)
+    records = []
+    for raw in batch:
+        student = students.get(raw['student'], {})
+        instructor = instructors.get(raw['instructor'], {})
+        records.append({
+            'id': str(raw['_id']),
+            'student_email': student.get('email'),
+            'student_name': _full_name(student),
+            'instructor_email': instructor.get('email'),
+            'instructor_name': _full_name(instructor),
+            'course_code': courses.get(raw['course'], {}).get('code'),
+            'school_applied': raw['school_applied'],
+            'program_applied': raw['program_applied'],
+            'deadline': _iso_date(raw.get('deadline')),
+            'date_created': _iso_date(raw.get('date_created')),
+            'date_updated': _iso_date(raw.get('date_updated')),
+            'date_fulfilled': _iso_date(raw.get('date_fulfilled')),
+            'status': raw['status'],
+            'messages': [
+                {'sender': msg.get('sender'), 'content': msg['content'], 'time': msg['time'].isoformat()}
+                for msg in sorted(raw.get('messages', []), key=lambda msg: msg['time'])
+            ],
+        })
+    return records
+
+
+def _reporting(batches, progress, total):
+    rows = 0
+    for records in batches:
+        yield records
+        rows += len(records)
+        progress(rows, total)
+
+
+def _lookup(document, ids, alias, *fields):
+    return {raw['_id']: raw for raw in routed(document.objects(id__in=list(ids)), alias).only(*fields).as_pymongo()}
+
+
+def _full_name(user):
+    if not user:
+        return None
+    return user['first_name'] + ' ' + user['last_name']
+
+
+def _iso_date(value):
+    return value.date().isoformat() if value is not None else None
+
+
+def _write_ndjson(fp, batches):
+    count = 0
+    for records in batches:
+        fp.writelines(json.dumps(record) + '\n' for record in records)
+        count += len(records)
+    return count
+
+
+def _write_csv(fp, batches):
+    writer = csv.DictWriter(fp, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for records in batches:
+        writer.writerows(dict(record, messages=json.dumps(record['messages'])) for record in records)
+        count += len(records)
+    return count
+
+
+def _write_parquet(fp, batches):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ActionError("Parquet export requires `pyarrow` to be installed")
+    message = pyarrow.struct([('sender', pyarrow.string()), ('content', pyarrow.string()), ('time', pyarrow.string())])
+    schema = pyarrow.schema(
+        [(column, pyarrow.int64() if column == 'status' else pyarrow.string()) for column in EXPORT_COLUMNS[:-1]]
+        + [('messages', pyarrow.list_(message))]
+    )
+    count = 0
+    with pyarrow.parquet.ParquetWriter(fp, schema) as writer:
+        for records in batches:
+            writer.write_table(pyarrow.Table.from_pylist(records, schema=schema))
+            count += len(records)
+    return count
+
+
+_WRITERS = {
+    EXPORT_NDJSON: _write_ndjson,
+    EXPORT_CSV: _write_csv,
+    EXPORT_PARQUET: _write_parquet,
+}
@@ -0,0 +1,96 @@
+import hashlib
+import inspect
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+from uuid import uuid4
+from mongoengine import Document, NotUniqueError
+from mongoengine.base import get_document
+from models import IdempotencyKey
+from models import IDEMPOTENCY_CLAIM_TIMEOUT
+from err import ActionError
+
+
+def idempotent(principal, ignore=()):
+    # let callers pass `idempotency_key=...`, scoped to the action and to the caller passed as the `principal`
+    # argument: the first call under a key claims it with a unique insert and stores its result, a document by
+    # reference or an embedded document; replays return that result from one indexed lookup, without running the
+    # action again, and are refused if their arguments differ from the first call's. Arguments in `ignore`, such as
+    # secrets, are not compared. A call that raises releases its key, so that it can be retried, and a retry takes
+    # over the key of a call that died holding it once `IDEMPOTENCY_CLAIM_TIMEOUT` has passed
+    def decorator(func):
+        action = func.__name__
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, idempotency_key=None, **kwargs):
+            if idempotency_key is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            scope = dict(action=action, key=idempotency_key, principal=_principal(arguments.get(principal)))
+            fingerprint = _fingerprint({name: value for name, value in arguments.items() if name not in ignore})
+            owner = uuid4().hex
+            while True:
+                now = datetime.utcnow()
+                claim = IdempotencyKey(owner=owner, date_claimed=now, fingerprint=fingerprint, **scope)
+                try:
+                    claim.save(force_insert=True)
+                    break
+                except NotUniqueError:
+                    pass
+                raw = IdempotencyKey.objects(**scope).only(
+                    'done', 'result', 'fingerprint', 'owner', 'date_claimed', 'date_created').as_pymongo().first()
+                if raw is None:
+                    # released by a failed call meanwhile; claim it again
+                    continue
+                if raw.get('fingerprint', fingerprint) != fingerprint:
+                    raise ActionError(f"{action} under key {idempotency_key} was called with other arguments")
+                if raw['done']:
+                    return _load(raw['result'])
+                if raw.get('date_claimed', raw['date_created']) > now - timedelta(seconds=IDEMPOTENCY_CLAIM_TIMEOUT):
+                    raise ActionError(f"{action} under key {idempotency_key} is in progress")
+                # the call holding the key presumably died: take it over, unless another retry did first
+                if IdempotencyKey.objects(id=raw['_id'], done=False, owner=raw.get('owner')).update_one(
+                        set__owner=owner, set__date_claimed=now, set__fingerprint=fingerprint):
+                    claim = IdempotencyKey(id=raw['_id'], **scope)
+                    break
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                IdempotencyKey.objects(id=claim.id, owner=owner).delete()
+                raise
+            IdempotencyKey.objects(id=claim.id, owner=owner).update_one(set__done=True, set__result=_dump(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _principal(value):
+    # users and other documents by their id, anything else, e.g. an email or a sender's name, as is
+    if isinstance(value, Document):
+        return f'{type(value).__name__}:{value.id}'
+    return '' if value is None else str(value)
+
+
+def _fingerprint(arguments):
+    # a hash of the arguments of a call, documents by id
+    def canonical(value):
+        return _principal(value) if isinstance(value, Document) else str(value)
+
+    return hashlib.sha256(json.dumps(arguments, sort_keys=True, default=canonical).encode()).hexdigest()
+
+
+def _dump(doc):
+    # documents by reference, reloaded when replayed, so that no copy of them, e.g. of a password hash, is kept
+    if isinstance(doc, Document):
+        return {'document': type(doc).__name__, 'id': doc.id}
+    return {'document': type(doc).__name__, 'son': doc.to_mongo()}
+
+
+def _load(result):
+    document = get_document(result['document'])
+    if 'id' in result:
+        return document.objects(id=result['id']).get()
+    return document._from_son(result['son'])
@@ -0,0 +1,30 @@
+from models import Request
+from models import STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED
+from routing import routed, ALIAS_SECONDARY
+
+INBOX_STATUSES = [STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED]
+INBOX_FIELDS = ('course', 'student', 'school_applied', 'program_applied', 'deadline', 'date_created', 'status')
+
+
+def instructor_inbox(instructor, page=1, per_page=20, course=None, alias=ALIAS_SECONDARY):
+    # one page of the pending (not fulfilled) requests received by `instructor`, optionally of one `course`, ordered
+    # by `deadline` and then `date_created`, as raw projections of `INBOX_FIELDS`; returns the page, the number of
+    # matching requests, and the number of pending requests per course id
+    if page < 1 or per_page < 1:
+        raise ValueError(f"Illegal page={page} or per_page={per_page}")
+    # requests share the tenant of their instructor; naming it keeps the inbox index usable outside a tenant scope.
+    # `status__in` rather than `status__ne`, so that the index is scanned as one sorted range per status and merged,
+    # without an in-memory sort
+    pending = Request.objects(tenant=instructor.tenant, instructor=instructor, status__in=INBOX_STATUSES)
+    counts = {
+        raw['_id']: raw['count']
+        for raw in routed(pending, alias).aggregate([{'$group': {'_id': '$course', 'count': {'$sum': 1}}}])
+    }
+    if course is not None:
+        pending = pending.filter(course=course)
+    total = counts.get(course.id, 0) if course is not None else sum(counts.values())
+    requests = list(
+        routed(pending, alias).order_by('deadline', 'date_created').only(*INBOX_FIELDS).as_pymongo()
+        .skip((page - 1) * per_page).limit(per_page)
+    )
+    return requests, total, counts
@@ -0,0 +1,337 @@
+import argparse
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+from multiprocessing import get_context
+from uuid import uuid4
+from mongoengine import Document, Q, register_connection, disconnect
+from mongoengine.base import get_document
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from bson.errors import InvalidDocument
+from pymongo import UpdateOne
+from models import Student, Course, CourseEnrollment, Job
+from models import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from deletion import bulk_delete
+from export import export_requests, EXPORT_NDJSON, EXPORT_PARQUET
+from tenancy import tenant_filter, tenant_scope
+from versioning import touch
+import actions
+
+# long-running actions run out of band: `enqueue` stores a `Job`, and worker processes started by `run_workers` claim
+# queued jobs with an atomic update that leases them for `lease` seconds, renewed while they run. A worker that dies
+# lets its lease expire, and the job is claimed again and resumes from its last checkpoint
+
+# seconds a claimed job stays leased to its worker without being renewed
+JOB_LEASE = 60
+# seconds between two progress writes of a job, unless a checkpoint is saved
+PROGRESS_INTERVAL = 1.0
+
+JOB_HANDLERS = {}
+JOB_PREPARERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLeaseLost(Exception):
+    pass
+
+
+def job_handler(name, prepare=None):
+    # register the decorated `handler(context, **args)` to run the jobs named `name`. `prepare(args)`, if given,
+    # returns the args to store when a job is queued, e.g. with its secrets hashed, since jobs are kept once finished
+    def register(handler):
+        JOB_HANDLERS[name] = handler
+        if prepare is not None:
+            JOB_PREPARERS[name] = prepare
+        return handler
+
+    return register
+
+
+def enqueue(name, max_attempts=3, **args):
+    # queue a job running the handler registered as `name` with `args`; documents among them are stored as references
+    if name not in JOB_HANDLERS:
+        raise RuntimeError(f"Unknown job: {name}")
+    if name in JOB_PREPARERS:
+        args = JOB_PREPARERS[name](args)
+    return Job(name=name, args=_encode(args), max_attempts=max_attempts).save()
+
+
+def enqueue_action(action, max_attempts=1, **kwargs):
+    # queue a call of the function `action` of `actions`, or of its name; actions cannot resume half way, so a failed
+    # call is not retried unless `max_attempts` says so
+    name = getattr(action, '__name__', action)
+    func = getattr(actions, name, None)
+    if name.startswith('_') or not callable(func) or getattr(func, '__module__', None) != actions.__name__:
+        raise RuntimeError(f"Unknown action: {name}")
+    return enqueue('action', max_attempts=max_attempts, action=name, kwargs=kwargs)
+
+
+def cancel_job(job):
+    # cancel a job not running yet at once, and ask the worker of a running one to stop at its next progress report
+    now = datetime.utcnow()
+    cancelled = Job.objects(Q(id=job.id) & (Q(status=JOB_QUEUED) | Q(status=JOB_RUNNING, lease_expires__lt=now)))
+    if cancelled.update_one(set__status=JOB_CANCELLED, set__date_finished=now, unset__lease_owner=True):
+        return True
+    return bool(Job.objects(id=job.id, status=JOB_RUNNING).update_one(set__cancel_requested=True))
+
+
+def claim_job(owner, lease=JOB_LEASE):
+    # lease the oldest queued job, or a running job whose worker let its lease expire, to `owner`
+    now = datetime.utcnow()
+    claimable = Q(status=JOB_QUEUED) | Q(status=JOB_RUNNING, lease_expires__lt=now, cancel_requested=False)
+    return Job.objects(claimable).order_by('date_created').modify(
+        new=True, set__status=JOB_RUNNING, set__lease_owner=owner, set__lease_expires=now + timedelta(seconds=lease),
+        set__date_started=now, inc__attempts=1,
+    )
+
+
+def run_job(job, owner, lease=JOB_LEASE):
+    # run a job claimed by `owner` in the tenant it was queued in, and record how it ended
+    context = JobContext(job, owner, lease)
+    with tenant_scope(job.tenant), context.heartbeat():
+        try:
+            if job.attempts > job.max_attempts:
+                context.finish(JOB_FAILED, error=job.error or "Lease expired too many times")
+                return
+            handler = JOB_HANDLERS.get(job.name)
+            if handler is None:
+                raise RuntimeError(f"Unknown job: {job.name}")
+            result = handler(context, **_decode(job.args))
+        except JobCancelled:
+            context.finish(JOB_CANCELLED)
+        except JobLeaseLost:
+            # another worker runs the job now
+            pass
+        except Exception as e:
+            status = JOB_QUEUED if job.attempts < job.max_attempts else JOB_FAILED
+            context.finish(status, error=f"{type(e).__name__}: {e}")
+        else:
+            try:
+                context.finish(JOB_DONE, result=_encode(result))
+            except InvalidDocument as e:
+                # a result that cannot be stored, e.g. a queryset, fails the job instead of leaving it running
+                context.finish(JOB_FAILED, error=f"{type(e).__name__}: {e}")
+
+
+def work(lease=JOB_LEASE, poll_interval=1.0, drain=False, owner=None):
+    # claim and run jobs one at a time, polling every `poll_interval` seconds when there is none, or returning if
+    # `drain`; returns the number of jobs run
+    owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+    count = 0
+    while True:
+        job = claim_job(owner, lease)
+        if job is None:
+            if drain:
+                return count
+            time.sleep(poll_interval)
+            continue
+        run_job(job, owner, lease)
+        count += 1
+
+
+def run_workers(db, host='mongodb://localhost:27017', workers=4, lease=JOB_LEASE, poll_interval=1.0, drain=False):
+    # run `work` in `workers` processes; returns the number of jobs they ran, when `drain` lets them stop
+    # spawned rather than forked: a forked process would share the client of this one
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        futures = [pool.submit(_work, db, host, lease, poll_interval, drain) for _ in range(workers)]
+        wait(futures)
+        return sum(future.result() for future in futures)
+
+
+class JobContext:
+    # what a handler is given to report progress: `checkpoint` is the state saved by the previous attempt, if any
+
+    def __init__(self, job, owner, lease):
+        self.job = job
+        self.checkpoint = dict(job.checkpoint or {})
+        self._owner = owner
+        self._lease = lease
+        self._total = job.total
+        self._reported = None
+        self._lost = threading.Event()
+        Job.objects(id=job.id, lease_owner=owner).update_one(set__resumed_done=job.done)
+
+    def progress(self, done, total=None, checkpoint=None):
+        # record `done` out of `total` units of work and, with `checkpoint`, the state to resume from. Raises
+        # `JobCancelled` once the job is cancelled, and `JobLeaseLost` once another worker took it over
+        if self._lost.is_set():
+            raise JobLeaseLost(f"Lease of {self.job.id} expired")
+        now = time.monotonic()
+        if checkpoint is None and self._reported is not None and now - self._reported < PROGRESS_INTERVAL:
+            return
+        update = {'set__done': done}
+        if total is not None:
+            update['set__total'] = self._total = total
+        if checkpoint is not None:
+            update['set__checkpoint'] = self.checkpoint = checkpoint
+        job = Job.objects(id=self.job.id, lease_owner=self._owner).modify(new=True, **update)
+        if job is None:
+            raise JobLeaseLost(f"Lease of {self.job.id} expired")
+        self._reported = now
+        if job.cancel_requested:
+            raise JobCancelled(f"Job {self.job.id} was cancelled")
+
+    def finish(self, status, result=None, error=None):
+        update = {'set__status': status, 'unset__lease_owner': True, 'unset__lease_expires': True}
+        if status == JOB_QUEUED:
+            update['set__error'] = error
+        else:
+            update.update(set__date_finished=datetime.utcnow(), set__result=result, set__error=error)
+        if status == JOB_DONE and self._total is not None:
+            update['set__done'] = self._total
+        Job.objects(id=self.job.id, lease_owner=self._owner).update_one(**update)
+
+    @contextmanager
+    def heartbeat(self):
+        # renew the lease every third of it in a background thread while the job runs
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self._lease / 3):
+                expires = datetime.utcnow() + timedelta(seconds=self._lease)
+                if not Job.objects(id=self.job.id, lease_owner=self._owner).update_one(set__lease_expires=expires):
+                    self._lost.set()
+                    return
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+@job_handler('action')
+def _run_action(context, action, kwargs):
+    context.progress(0, 1)
+    return getattr(actions, action)(**kwargs)
+
+
+@job_handler('course_quotas')
+def assign_course_quotas(context, course, recommender, quota, batch_size=100):
+    # set, or reset, the letter quota from `recommender` of every student enrolled in `course`, in student id order;
+    # an interrupted run resumes after the last batch completed
+    enrolled = CourseEnrollment.objects(course=course).order_by('student')
+    total = enrolled.count()
+    done = context.checkpoint.get('done', 0)
+    if 'after' in context.checkpoint:
+        enrolled = enrolled.filter(student__gt=context.checkpoint['after'])
+    # a queryset iterated anew starts over; a generator over it does not
+    student_ids = (raw['student'] for raw in enrolled.only('student').as_pymongo().no_cache())
+    while True:
+        batch = list(islice(student_ids, batch_size))
+        if not batch:
+            return done
+        for student in Student.objects(id__in=batch):
+            actions.set_letter_quota(student=student, recommender=recommender, course=course, quota=quota,
+                                     reset=True)
+        done += len(batch)
+        context.progress(done, total, checkpoint={'after': batch[-1], 'done': done})
+
+
+def _hash_passwords(args):
+    # the rows of a roster import are queued with their passwords hashed
+    rows = [dict(row, password=actions.hash_password(row['password'])) for row in args['rows']]
+    return dict(args, rows=rows)
+
+
+@job_handler('roster_import', prepare=_hash_passwords)
+def import_roster(context, course, rows, batch_size=100):
+    # enroll in `course` the students of `rows`, dicts of `signup` arguments whose passwords were hashed when queued,
+    # signing up those without an account; an interrupted run resumes at the first batch not completed
+    for start in range(context.checkpoint.get('next', 0), len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        existing = {
+            raw['email']: raw['_id']
+            for raw in Student.objects(email__in=[row['email'] for row in batch]).only('email').as_pymongo()
+        }
+        student_ids = [existing.get(row['email']) or actions.signup(Student, hashed=True, **row).id for row in batch]
+        now = datetime.utcnow()
+        result = CourseEnrollment._get_collection().bulk_write([
+            UpdateOne({**tenant_filter(), 'course': course.id, 'student': _id}, {'$setOnInsert': {'date_created': now}},
+                      upsert=True)
+            for _id in student_ids
+        ], ordered=False)
+        if result.upserted_count:
+            touch(Course, [course.id])
+        context.progress(start + len(batch), len(rows), checkpoint={'next': start + len(batch)})
+    return len(rows)
+
+
+@job_handler('export')
+def export_to_file(context, path, fmt=EXPORT_NDJSON, since=None, until=None, batch_size=1000, include_archive=False):
+    # `export.export_requests` into the file at `path`; an interrupted export starts over
+    def progress(rows, total):
+        context.progress(rows, total)
+
+    options = dict(fmt=fmt, since=since, until=until, batch_size=batch_size, progress=progress,
+                   include_archive=include_archive)
+    if fmt == EXPORT_PARQUET:
+        return export_requests(path, **options)
+    with open(path, 'w', newline='') as fp:
+        return export_requests(fp, **options)
+
+
+@job_handler('bulk_delete')
+def delete_documents(context, document, ids):
+    # `deletion.bulk_delete` of the `ids` of the document class named `document`
+    context.progress(0, len(ids))
+    bulk_delete(get_document(document), ids)
+    return len(ids)
+
+
+def _work(db, host, lease, poll_interval, drain):
+    disconnect()
+    register_connection(DEFAULT_CONNECTION_NAME, db, host=host)
+    return work(lease=lease, poll_interval=poll_interval, drain=drain)
+
+
+def _encode(value):
+    # job arguments and results as BSON: documents by reference, dates by ISO format and exceptions by message
+    if isinstance(value, Document):
+        return {'_document': type(value).__name__, '_id': value.id}
+    if isinstance(value, Exception):
+        return {'_error': type(value).__name__, 'message': str(value)}
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return {'_date': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '_document' in value:
+            return get_document(value['_document']).objects(id=value['_id']).get()
+        if '_date' in value:
+            return date.fromisoformat(value['_date'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the job workers")
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--host', default='mongodb://localhost:27017')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lease', type=int, default=JOB_LEASE)
+    parser.add_argument('--drain', action='store_true', help="stop once the queue is empty")
+    args = parser.parse_args()
+    print(run_workers(args.db, host=args.host, workers=args.workers, lease=args.lease, drain=args.drain))
+
+
+if __name__ == '__main__':
+    main()
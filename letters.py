@@ -0,0 +1,93 @@
+import hashlib
+from gridfs import GridFSBucket
+from models import Letter
+from mongoengine import DoesNotExist, NotUniqueError, ValidationError
+from tenancy import tenant_filter
+from archive import get_raw_request
+from err import ActionError
+
+# letters are streamed into and out of GridFS one chunk at a time, so a worker never holds a whole file in memory.
+# Content is deduplicated by its SHA-256: uploading a letter already stored returns the existing `Letter`. A letter
+# counts its references, taken by uploads and handed over to the request fulfilled with it, and is deleted with its
+# file when the last one is released
+LETTER_BUCKET = 'letters'
+LETTER_CHUNK_SIZE = 255 * 1024
+MAX_LETTER_SIZE = 20 * 1024 * 1024
+
+
+def upload_letter(fp, content_type='application/pdf', chunk_size=LETTER_CHUNK_SIZE):
+    # stream the binary file-like `fp` into GridFS while hashing it; returns its `Letter`, with a reference taken for
+    # the caller to attach or to release with `discard_letter`
+    bucket = _bucket()
+    sha256 = hashlib.sha256()
+    length = 0
+    stream = bucket.open_upload_stream('letter', chunk_size_bytes=chunk_size, metadata={'content_type': content_type})
+    try:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            length += len(chunk)
+            if length > MAX_LETTER_SIZE:
+                raise ValidationError(f"Letters are limited to {MAX_LETTER_SIZE} bytes")
+            sha256.update(chunk)
+            stream.write(chunk)
+    except BaseException:
+        # drop the chunks written so far
+        stream.abort()
+        raise
+    stream.close()
+    digest = sha256.hexdigest()
+    while True:
+        letter = Letter(sha256=digest, file_id=stream._id, length=length, content_type=content_type, refs=1)
+        try:
+            return letter.save()
+        except NotUniqueError:
+            pass
+        # the same content is stored already, possibly by a concurrent upload; keep that copy only, unless its last
+        # reference was released meanwhile
+        existing = Letter.objects(sha256=digest).modify(new=True, inc__refs=1)
+        if existing is not None:
+            bucket.delete(stream._id)
+            return existing
+
+
+def open_letter(user, request):
+    # check that `user` is the student or the instructor of `request`, archived or not, then open its letter for
+    # reading; returns the `Letter` and a GridFS stream to pass to `iter_letter`
+    raw = get_raw_request(request.id, 'student', 'instructor', 'letter')
+    if raw is None:
+        raise DoesNotExist(f"Request {request.id} doesn't exist")
+    if user.id not in (raw['student'], raw['instructor']):
+        raise ActionError(f"{user} has no access to the letter of request {request.id}")
+    if raw.get('letter') is None:
+        raise DoesNotExist(f"Request {request.id} has no letter")
+    letter = Letter.objects(id=raw['letter']).get()
+    return letter, _bucket().open_download_stream(letter.file_id)
+
+
+def iter_letter(stream):
+    # yield the chunks of an open GridFS stream, closing it when done
+    try:
+        while True:
+            chunk = stream.readchunk()
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        stream.close()
+
+
+def discard_letter(letter):
+    # release a reference to `letter`, deleting it and its file with the last one; whether it was deleted. The delete
+    # is conditional on no reference being left, so that it cannot race with an upload taking one
+    Letter.objects(id=letter.id, refs__gt=0).update_one(dec__refs=1)
+    raw = Letter._get_collection().find_one_and_delete({'_id': letter.id, 'refs': 0, **tenant_filter()})
+    if raw is None:
+        return False
+    _bucket().delete(raw['file_id'])
+    return True
+
+
+def _bucket():
+    return GridFSBucket(Letter._get_db(), bucket_name=LETTER_BUCKET)
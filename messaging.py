@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from models import Student, Instructor, Staff, Request, Message
+from routing import routed, ALIAS_SECONDARY
+
+# messages sent by users keep the sender's id and role; their `sender` name is looked up when they are read, through
+# a cache shared by the process, so that a renamed user shows under their new name once the cached name expires
+SENDER_CACHE_TTL = 60
+SENDER_CACHE_SIZE = 10000
+
+SENDER_ROLES = {role.__name__: role for role in (Student, Instructor, Staff)}
+
+# the counter of messages a request's participant has not read, per participant field
+UNREAD_FIELDS = {Student: ('student', 'student_unread'), Instructor: ('instructor', 'instructor_unread')}
+
+_names = OrderedDict()
+_names_lock = threading.Lock()
+
+
+def lookup_senders(keys, alias=ALIAS_SECONDARY):
+    # the names of the users identified by the (role, id) `keys`, from the cache or with one `$in` query per role
+    now = time.monotonic()
+    names = {}
+    missing = {}
+    with _names_lock:
+        for key in keys:
+            cached = _names.get(key)
+            if cached is not None and cached[1] > now:
+                names[key] = cached[0]
+            else:
+                missing.setdefault(key[0], []).append(key[1])
+    for role, ids in missing.items():
+        document = SENDER_ROLES.get(role)
+        if document is None:
+            continue
+        found = {
+            (role, raw['_id']): raw['first_name'] + ' ' + raw['last_name']
+            for raw in routed(document.objects(id__in=ids), alias).only('first_name', 'last_name').as_pymongo()
+        }
+        names.update(found)
+        with _names_lock:
+            for key, name in found.items():
+                _names[key] = (name, now + SENDER_CACHE_TTL)
+                _names.move_to_end(key)
+            while len(_names) > SENDER_CACHE_SIZE:
+                _names.popitem(last=False)
+    return names
+
+
+def resolve_senders(messages, alias=ALIAS_SECONDARY):
+    # fill in the `sender` name of the messages sent by users, `Message` documents and raw messages alike; the
+    # messages of users that no longer exist keep an empty name
+    names = lookup_senders({key for key in map(_sender_key, messages) if key is not None}, alias=alias)
+    for msg in messages:
+        name = names.get(_sender_key(msg))
+        if name is None:
+            continue
+        if isinstance(msg, dict):
+            msg['sender'] = name
+        else:
+            msg.sender = name
+    return messages
+
+
+def recipient_counters(msg):
+    # the unread counters a message increments: the other participant's, or both for a message from neither
+    if msg.sender_role == Student.__name__:
+        return [UNREAD_FIELDS[Instructor][1]]
+    if msg.sender_role == Instructor.__name__:
+        return [UNREAD_FIELDS[Student][1]]
+    return [counter for _, counter in UNREAD_FIELDS.values()]
+
+
+def message_event(msg):
+    # the data of the `eventlog.EVENT_MESSAGE_SENT` event of a message
+    return {'sender': msg.sender or None, 'sender_id': msg.sender_id, 'sender_role': msg.sender_role, 'time': msg.time}
+
+
+def clear_sender_cache():
+    with _names_lock:
+        _names.clear()
+
+
+def messages_sent_by(user, alias=ALIAS_SECONDARY):
+    # the (request id, `Message`) pairs of every message sent by `user`, newest first, matched through the
+    # `messages.sender_id` index
+    pipeline = [
+        {'$unwind': '$messages'},
+        {'$match': {'messages.sender_id': user.id}},
+        {'$sort': {'messages.time': -1}},
+        {'$project': {'messages': 1}},
+    ]
+    sent = [
+        (raw['_id'], Message._from_son(raw['messages']))
+        for raw in routed(Request.objects(tenant=user.tenant, messages__sender_id=user.id), alias).aggregate(pipeline)
+    ]
+    resolve_senders([msg for _, msg in sent], alias=alias)
+    return sent
+
+
+def unread_counts(user, alias=ALIAS_SECONDARY):
+    # the number of requests of `user` with unread messages and the number of those messages, summed from the
+    # participant's unread counters of the requests through their index
+    if type(user) not in UNREAD_FIELDS:
+        raise RuntimeError(f"Unknown roll: {type(user)}")
+    participant, counter = UNREAD_FIELDS[type(user)]
+    unread = Request.objects(tenant=user.tenant, **{participant: user, f'{counter}__gt': 0})
+    for raw in routed(unread, alias).aggregate([
+        {'$group': {'_id': None, 'requests': {'$sum': 1}, 'messages': {'$sum': f'${counter}'}}}
+    ]):
+        return raw['requests'], raw['messages']
+    return 0, 0
+
+
+def _sender_key(msg):
+    raw = msg if isinstance(msg, dict) else msg._data
+    if raw.get('sender_id') is None:
+        return None
+    return raw.get('sender_role'), raw['sender_id']
@@ -0,0 +1,62 @@
+from datetime import datetime
+from models import Instructor
+from models import Course, CourseEnrollment, CourseMentorship
+from models import Event, ProjectionCheckpoint, ProjectionEntry
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+
+
+def migrate_link_collections(batch_size=1000):
+    # move `Course.students`/`Course.mentors` arrays into their link collections and drop
+    # `Instructor.requests_received`, which is now derived from `Request.instructor`. Safe to re-run
+    courses = Course._get_collection()
+    migrated = 0
+    for raw in courses.find({"$or": [{"students": {"$exists": True}}, {"mentors": {"$exists": True}}]},
+                            {"students": 1, "mentors": 1, "tenant": 1}, batch_size=batch_size):
+        # links belong to the tenant of their course
+        tenant = raw.get("tenant")
+        _upsert_links(CourseEnrollment, raw["_id"], tenant, "student", raw.get("students", []), batch_size)
+        _upsert_links(CourseMentorship, raw["_id"], tenant, "mentor", raw.get("mentors", []), batch_size)
+        courses.update_one({"_id": raw["_id"]}, {"$unset": {"students": "", "mentors": ""}})
+        migrated += 1
+    Instructor._get_collection().update_many(
+        {"requests_received": {"$exists": True}},
+        {"$unset": {"requests_received": ""}},
+    )
+    return migrated
+
+
+def migrate_event_sequence(batch_size=1000):
+    # give the events logged before they carried a position negative ones, so that they precede every event logged
+    # since, numbered from the newest down so that an interrupted run carries on below the last one given; then drop
+    # the projection checkpoints, which were positions by id, and their entries, so that projections are rebuilt
+    events = Event._get_collection()
+    lowest = events.find_one({"seq": {"$lt": 0}}, {"seq": 1}, sort=[("seq", ASCENDING)])
+    seq = lowest["seq"] if lowest is not None else 0
+    migrated = 0
+    batch = []
+    for raw in events.find({"seq": {"$exists": False}}, {"_id": 1}, sort=[("_id", DESCENDING)], batch_size=batch_size):
+        seq -= 1
+        batch.append(UpdateOne(
+            {"_id": raw["_id"]},
+            {"$set": {"seq": seq, "date_logged": raw["_id"].generation_time.replace(tzinfo=None)}},
+        ))
+        if len(batch) == batch_size:
+            events.bulk_write(batch)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        events.bulk_write(batch)
+        migrated += len(batch)
+    ProjectionCheckpoint.objects.delete()
+    ProjectionEntry.objects.delete()
+    return migrated
+
+
+def _upsert_links(link, course_id, tenant, field, ids, batch_size):
+    now = datetime.utcnow()
+    for i in range(0, len(ids), batch_size):
+        link._get_collection().bulk_write([
+            UpdateOne({"tenant": tenant, "course": course_id, field: _id}, {"$setOnInsert": {"date_created": now}},
+                      upsert=True)
+            for _id in ids[i:i + batch_size]
+        ], ordered=False)
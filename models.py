@@ -1,3 +1,5 @@
+import re
+import unicodedata
 from datetime import datetime
 
 import mongoengine
@@ -15,19 +17,50 @@ from mongoengine import EmbeddedDocumentField
 from mongoengine import EmbeddedDocumentListField
 from mongoengine import IntField
 from mongoengine import BooleanField
+from mongoengine import ObjectIdField
+from mongoengine import DictField
+from mongoengine import DynamicField
 from mongoengine import StringField
 from mongoengine import ValidationError
 from mongoengine import CASCADE, DENY, PULL, DO_NOTHING, NULLIFY
+from tenancy import current_tenant, TenantQuerySet
+from versioning import VersionedQuerySet
+
+
+def normalize_search_terms(text):
+    # lower-case, accent-free tokens of `text`, e.g. 'José O\'Neil' -> ['jose', 'o', 'neil']
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.findall(r'\w+', text)
+
+
+def make_search_keys(*values):
+    # prefix-searchable keys for `values`, one per distinct token
+    return sorted({term for value in values for term in normalize_search_terms(value)})
 
 
 class User(Document):
-    email = EmailField(unique=True, required=True)
+    tenant = StringField(max_length=50, default=current_tenant)
+    email = EmailField(required=True)
     password = StringField(max_length=1000, required=True)
     first_name = StringField(max_length=100, required=True)
     last_name = StringField(max_length=100, required=True)
     gender = StringField(regex='(M|F)', max_length=1, min_length=1)
+    search_keys = ListField(StringField())
 
-    meta = {"abstract": True}
+    meta = {
+        "abstract": True,
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "email"),
+        "indexes": [
+            {"fields": ["tenant", "email"], "unique": True},
+            {"fields": ["$first_name", "$last_name", "$email"]},
+            ("tenant", "search_keys"),
+        ],
+    }
+
+    def clean(self):
+        self.search_keys = make_search_keys(self.first_name, self.last_name, self.email)
 
 
 class GenericUser(User):
@@ -41,15 +74,41 @@ class RequestForCourse(EmbeddedDocument):
     recommender = ReferenceField('Instructor', required=True)
 
 
+class RequestSummary(EmbeddedDocument):
+    # denormalized copy of a `Request`, kept in sync by the request actions so list views need no dereferencing
+    request = ReferenceField('Request', required=True)
+    course_code = StringField(max_length=15, required=True)
+    school_applied = StringField(max_length=50, required=True)
+    program_applied = StringField(max_length=50, required=True)
+    deadline = DateField(required=True)
+    status = IntField(required=True)
+    student_name = StringField(max_length=201, required=True)
+    instructor_name = StringField(max_length=201, required=True)
+    # the version of the request `status` was copied from
+    version = IntField(default=0)
+
+
 class Student(User):
     gender = StringField(regex='(M|F)', max_length=1, min_length=1, required=True)
     aka = StringField(max_length=20)
     req_for_courses = EmbeddedDocumentListField(RequestForCourse)
+    request_summaries = EmbeddedDocumentListField(RequestSummary)
+    # incremented by every write, see `versioning`
+    version = IntField(default=0, required=True)
+
+    meta = {"queryset_class": VersionedQuerySet, "indexes": ["request_summaries.request"]}
 
 
 class Instructor(User):
     courses = ListField(ReferenceField('Course'))
-    requests_received = ListField(ReferenceField('Request'))
+    request_summaries = EmbeddedDocumentListField(RequestSummary)
+
+    meta = {"indexes": ["request_summaries.request"]}
+
+    @property
+    def requests_received(self):
+        # `Request.instructor` is indexed, so the relation needs no array on the instructor
+        return Request.objects(tenant=self.tenant, instructor=self).order_by('id')
 
 
 class Staff(User):
@@ -58,23 +117,92 @@ class Staff(User):
 
 
 class Course(Document):
-    code = StringField(max_length=15, required=True, unique=True)
+    tenant = StringField(max_length=50, default=current_tenant)
+    code = StringField(max_length=15, required=True)
     course_name = StringField(max_length=1000)
     start_date = DateField(default=datetime.today, required=True)
     professor = ReferenceField(Instructor, required=True, reverse_delete_rule=DENY)
-    mentors = ListField(ReferenceField(Instructor, reverse_delete_rule=PULL))
     coordinator = ReferenceField(Staff, reverse_delete_rule=NULLIFY)
-    students = ListField(ReferenceField(Student, reverse_delete_rule=PULL))
+    # the course this one was cloned from by a rollover, see `rollover`
+    cloned_from = ReferenceField('self')
+    search_keys = ListField(StringField())
+    version = IntField(default=0, required=True)
+
+    meta = {
+        "queryset_class": VersionedQuerySet,
+        "shard_key": ("tenant", "code"),
+        "indexes": [
+            {"fields": ["tenant", "code"], "unique": True},
+            {"fields": ["$code", "$course_name"]},
+            ("tenant", "search_keys"),
+        ],
+    }
+
+    def clean(self):
+        self.search_keys = make_search_keys(self.code, self.course_name)
+
+    @property
+    def mentors(self):
+        return Instructor.objects(id__in=_linked_ids(CourseMentorship, 'mentor', course=self))
+
+    @property
+    def students(self):
+        return Student.objects(id__in=_linked_ids(CourseEnrollment, 'student', course=self))
+
+
+class CourseMentorship(Document):
+    # link between a `Course` and one of its mentors, kept out of `Course` so that the relation can grow unbounded
+    tenant = StringField(max_length=50, default=current_tenant)
+    course = ReferenceField(Course, required=True, reverse_delete_rule=CASCADE)
+    mentor = ReferenceField(Instructor, required=True, reverse_delete_rule=CASCADE)
+    date_created = DateTimeField(default=datetime.utcnow, required=True)
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "course", "mentor"),
+        "indexes": [
+            {"fields": ["tenant", "course", "mentor"], "unique": True},
+            ("tenant", "mentor"),
+        ],
+    }
+
+
+class CourseEnrollment(Document):
+    # link between a `Course` and one of its students
+    tenant = StringField(max_length=50, default=current_tenant)
+    course = ReferenceField(Course, required=True, reverse_delete_rule=CASCADE)
+    student = ReferenceField(Student, required=True, reverse_delete_rule=CASCADE)
+    date_created = DateTimeField(default=datetime.utcnow, required=True)
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "course", "student"),
+        "indexes": [
+            {"fields": ["tenant", "course", "student"], "unique": True},
+            ("tenant", "student"),
+        ],
+    }
+
+
+def _linked_ids(link, field, **query):
+    # ids referenced by `field` across the `link` documents matching `query`, without dereferencing them
+    return [raw[field] for raw in link.objects(**query).only(field).as_pymongo()]
 
 
 class Message(EmbeddedDocument):
+    # a message from a user stores their id and role, and no name: `messaging.resolve_senders` looks it up when read.
+    # Other messages, e.g. from the system, store the name of their sender
     sender = StringField(max_length=200, default='', required=True)
+    sender_id = ObjectIdField()
+    sender_role = StringField(max_length=20)
     content = StringField(max_length=500, required=True)
     time = DateTimeField(default=datetime.utcnow, required=True)
 
     def clean(self):
         if isinstance(self.sender, User):
-            self.sender = self.sender.first_name + ' ' + self.sender.last_name
+            self.sender_id = self.sender.id
+            self.sender_role = type(self.sender).__name__
+            self.sender = ''
 
 
 STATUS_REQUESTED = 1000
@@ -83,17 +211,41 @@ STATUS_UNFULFILLED = 3000
 STATUS_FULFILLED = 4000
 
 
+REQUEST_STATUSES = frozenset([
+    STATUS_REQUESTED,
+    STATUS_EMAILED,
+    STATUS_UNFULFILLED,
+    STATUS_FULFILLED,
+])
+
+
 def _validate_request_status(status):
-    if status not in [
-        STATUS_REQUESTED,
-        STATUS_EMAILED,
-        STATUS_UNFULFILLED,
-        STATUS_FULFILLED,
-    ]:
+    if status not in REQUEST_STATUSES:
         raise ValidationError(f'Illegal Status: {status}')
 
 
+class Letter(Document):
+    # a recommendation letter stored in GridFS, shared by every request fulfilled with the same content
+    tenant = StringField(max_length=50, default=current_tenant)
+    sha256 = StringField(min_length=64, max_length=64, required=True)
+    file_id = ObjectIdField(required=True)
+    length = IntField(min_value=0, required=True)
+    content_type = StringField(max_length=100, required=True)
+    # the requests referring to it, and the uploads about to
+    refs = IntField(min_value=0, default=0, required=True)
+    date_created = DateTimeField(default=datetime.utcnow, required=True)
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "sha256"),
+        "indexes": [
+            {"fields": ["tenant", "sha256"], "unique": True},
+        ],
+    }
+
+
 class Request(Document):
+    tenant = StringField(max_length=50, default=current_tenant)
     student = ReferenceField(Student, required=True, reverse_delete_rule=DENY)
     instructor = ReferenceField(Instructor, required=True, reverse_delete_rule=DENY)
     course = ReferenceField(Course, required=True, reverse_delete_rule=DENY)
@@ -105,14 +257,172 @@ class Request(Document):
     date_fulfilled = DateField()
     status = IntField(validation=_validate_request_status, default=STATUS_REQUESTED, required=True)
     messages = EmbeddedDocumentListField(Message)
+    # messages not read yet by each participant, see `messaging.unread_counts`
+    student_unread = IntField(min_value=0, default=0, required=True)
+    instructor_unread = IntField(min_value=0, default=0, required=True)
+    letter = ReferenceField(Letter, reverse_delete_rule=DENY)
+    search_keys = ListField(StringField())
+    version = IntField(default=0, required=True)
+
+    meta = {
+        "queryset_class": VersionedQuerySet,
+        "shard_key": ("tenant", "id"),
+        "indexes": [
+            {"fields": ["$school_applied", "$program_applied"]},
+            ("tenant", "search_keys"),
+            # requests of an instructor, for queries made outside any tenant scope
+            "instructor",
+            # the instructor inbox: pending requests by deadline, and their counts per course, from the index alone
+            ("tenant", "instructor", "status", "deadline", "date_created", "course"),
+            ("tenant", "messages.sender_id"),
+            ("tenant", "student", "student_unread"),
+            ("tenant", "instructor", "instructor_unread"),
+        ],
+    }
 
     def clean(self):
+        self.search_keys = make_search_keys(self.school_applied, self.program_applied)
         if (self.date_fulfilled is None) and (self.status == STATUS_FULFILLED):
             raise ValidationError('Request fulfilled but not specified when')
         if (self.date_fulfilled is not None) and (self.status != STATUS_FULFILLED):
             raise ValidationError('Request not fulfilled but date_fulfilled is set')
 
 
+class Event(Document):
+    # an entry of the append-only log of state changes made by actions; `subject` is the id of the document changed
+    tenant = StringField(max_length=50, default=current_tenant)
+    type = StringField(max_length=50, required=True)
+    subject = ObjectIdField(required=True)
+    time = DateTimeField(default=datetime.utcnow, required=True)
+    data = DictField()
+    # the position of the event in the log, and the time of the server that allocated it, see `eventlog`
+    seq = IntField()
+    date_logged = DateTimeField()
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "id"),
+        "indexes": [
+            ("tenant", "subject"),
+            ("tenant", "seq"),
+            "seq",
+        ],
+    }
+
+
+class Counter(Document):
+    # a sequence allocated by the server, e.g. the positions of events in the log; `time` is the server's time at
+    # the last allocation
+    name = StringField(max_length=50, primary_key=True)
+    value = IntField(default=0, required=True)
+    time = DateTimeField()
+
+
+class ProjectionCheckpoint(Document):
+    # how far a projection has consumed the event log, and its state at that point
+    name = StringField(max_length=50, primary_key=True)
+    last_seq = IntField()
+    state = DictField()
+    date_updated = DateTimeField(default=datetime.utcnow, required=True)
+
+
+class ProjectionEntry(Document):
+    # the value of one key of a keyed projection, whose state would outgrow a single checkpoint document
+    projection = StringField(max_length=50, required=True)
+    key = StringField(max_length=100, required=True)
+    value = DynamicField()
+
+    meta = {
+        "indexes": [
+            {"fields": ["projection", "key"], "unique": True},
+        ],
+    }
+
+
+# seconds a client may retry an action under the same idempotency key
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# seconds after which a call still holding its key is presumed dead, and a retry takes the key over
+IDEMPOTENCY_CLAIM_TIMEOUT = 60
+
+
+class IdempotencyKey(Document):
+    # a client-supplied key claimed by the first call of `action` by `principal`; `result` holds what that call
+    # returned, and `fingerprint` a hash of its arguments. `owner` identifies the call holding the claim, since
+    # `date_claimed`
+    tenant = StringField(max_length=50, default=current_tenant)
+    action = StringField(max_length=50, required=True)
+    principal = StringField(max_length=200, default='')
+    key = StringField(max_length=100, required=True)
+    done = BooleanField(default=False, required=True)
+    result = DictField()
+    fingerprint = StringField(max_length=64)
+    owner = StringField(max_length=32)
+    date_claimed = DateTimeField()
+    date_created = DateTimeField(default=datetime.utcnow, required=True)
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "action", "principal", "key"),
+        "indexes": [
+            {"fields": ["tenant", "action", "principal", "key"], "unique": True},
+            {"fields": ["date_created"], "expireAfterSeconds": IDEMPOTENCY_TTL},
+        ],
+    }
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class Job(Document):
+    # a long-running action queued for the workers of `jobs`. A running job is leased to one worker until
+    # `lease_expires`; `done` out of `total` is its progress and `checkpoint` the state it resumes from
+    tenant = StringField(max_length=50, default=current_tenant)
+    name = StringField(max_length=50, required=True)
+    args = DictField()
+    status = StringField(choices=JOB_STATUSES, default=JOB_QUEUED, required=True)
+    attempts = IntField(min_value=0, default=0, required=True)
+    max_attempts = IntField(min_value=1, default=3, required=True)
+    lease_owner = StringField(max_length=100)
+    lease_expires = DateTimeField()
+    cancel_requested = BooleanField(default=False, required=True)
+    done = IntField(min_value=0, default=0, required=True)
+    total = IntField(min_value=0)
+    # `done` when the current attempt started, which the ETA is measured from
+    resumed_done = IntField(min_value=0, default=0, required=True)
+    checkpoint = DictField()
+    result = DynamicField()
+    error = StringField()
+    date_created = DateTimeField(default=datetime.utcnow, required=True)
+    date_started = DateTimeField()
+    date_finished = DateTimeField()
+
+    meta = {
+        "queryset_class": TenantQuerySet,
+        "shard_key": ("tenant", "id"),
+        "indexes": [
+            # workers claim across tenants: queued jobs in order, then running jobs whose lease expired
+            ("status", "date_created"),
+            ("status", "lease_expires"),
+            ("tenant", "status", "date_created"),
+        ],
+    }
+
+    @property
+    def eta(self):
+        # the time left at the rate of progress of the current attempt, if it has made any
+        if self.status != JOB_RUNNING or not self.total or self.date_started is None:
+            return None
+        done = self.done - self.resumed_done
+        if done <= 0:
+            return None
+        return (datetime.utcnow() - self.date_started) / done * (self.total - self.done)
+
+
 Course.register_delete_rule(Instructor, 'courses', PULL)
 Course.register_delete_rule(Staff, 'accessible_courses', PULL)
-Request.register_delete_rule(Instructor, 'requests_received', PULL)
@@ -0,0 +1,147 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from collections import Counter
+from itertools import groupby
+from bson import ObjectId
+from models import Message, Request
+from messaging import resolve_senders, recipient_counters, message_event
+from pymongo import UpdateOne
+from versioning import bump
+from tenancy import tenant_scope
+from eventlog import record_each, EVENT_MESSAGE_SENT
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    # write-behind buffer for `send_msg`: messages are appended to a local SQLite file, which survives restarts, and
+    # flushed as one `$push $each` per request, and logged as events with one insert per tenant. Delivery is
+    # at-least-once: a crash between a flush's write to MongoDB and its local delete re-sends that flush
+
+    def __init__(self, path):
+        # `_lock` guards the SQLite file; `_flush_lock` serializes flushes, so that `append` never waits on MongoDB
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._running = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS message ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, tenant TEXT, request TEXT NOT NULL, '
+            'sender TEXT NOT NULL, sender_id TEXT, sender_role TEXT, content TEXT NOT NULL, time TEXT NOT NULL)'
+        )
+        # files written before messages carried their sender's id
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(message)')}
+        for column in ('sender_id', 'sender_role'):
+            if column not in columns:
+                self._db.execute(f'ALTER TABLE message ADD COLUMN {column} TEXT')
+        self._db.execute('CREATE INDEX IF NOT EXISTS message_request ON message (request)')
+        self._db.commit()
+
+    def append(self, request, msg):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO message (tenant, request, sender, sender_id, sender_role, content, time) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (request.tenant, str(request.id), msg.sender, str(msg.sender_id) if msg.sender_id else None,
+                 msg.sender_role, msg.content, msg.time.isoformat(timespec='microseconds')),
+            )
+            self._db.commit()
+
+    def pending(self, request):
+        # messages of `request` not flushed yet, ordered by `Message.time`
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT sender, sender_id, sender_role, content, time FROM message WHERE request = ? '
+                'ORDER BY time, seq',
+                (str(request.id),)
+            ).fetchall()
+        return resolve_senders([Message(**_message(*row)) for row in rows])
+
+    def messages(self, request):
+        # all messages of `request`, flushed or not, so that a sender always reads their own writes; reading under
+        # the flush lock keeps a concurrent flush from moving messages between the two reads
+        with self._flush_lock:
+            raw = Request.objects(id=request.id).only('messages').as_pymongo().first() or {}
+            pending = self.pending(request)
+        flushed = resolve_senders([Message._from_son(msg) for msg in raw.get('messages', [])])
+        return sorted(flushed + pending, key=lambda msg: msg.time)
+
+    def flush(self):
+        # write all buffered messages with one `$push $each` per request; returns the number of messages flushed.
+        # The rows are read under the lock and deleted once written, so that `append` does not wait on MongoDB.
+        # Messages are appended in the order they are flushed, readers sort them by `Message.time`. Flushes run
+        # outside any tenant scope, so each row carries its own tenant
+        with self._flush_lock:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT seq, tenant, request, sender, sender_id, sender_role, content, time FROM message '
+                    'ORDER BY request, time, seq'
+                ).fetchall()
+            if not rows:
+                return 0
+            updates = []
+            events = {}
+            for (tenant, request_id), group in groupby(rows, key=lambda row: row[1:3]):
+                msgs = [Message(**_message(*row[3:])) for row in group]
+                events.setdefault(tenant, []).extend((ObjectId(request_id), message_event(msg)) for msg in msgs)
+                # each message is unread by its recipients
+                unread = Counter(counter for msg in msgs for counter in recipient_counters(msg))
+                updates.append(UpdateOne(
+                    {'_id': ObjectId(request_id), 'tenant': tenant},
+                    bump(Request, {
+                        '$push': {'messages': {'$each': [msg.to_mongo() for msg in msgs]}},
+                        '$inc': dict(unread),
+                    }),
+                ))
+            Request._get_collection().bulk_write(updates, ordered=False)
+            # the events of the flushed messages, one insert per tenant
+            for tenant, entries in events.items():
+                with tenant_scope(tenant):
+                    record_each(EVENT_MESSAGE_SENT, entries)
+            with self._lock:
+                self._db.executemany('DELETE FROM message WHERE seq = ?', [(row[0],) for row in rows])
+                self._db.commit()
+            return len(rows)
+
+    def start(self, interval=1.0):
+        # flush every `interval` seconds in a background thread, until `stop`
+        self._running = True
+        self._schedule(interval)
+
+    def stop(self, flush=True):
+        self._running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if flush:
+            self.flush()
+
+    def close(self):
+        self.stop()
+        self._db.close()
+
+    def _schedule(self, interval):
+        def run():
+            # a failed flush, e.g. during a failover, leaves its messages buffered for the next one
+            if not self._running:
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing the message buffer failed")
+            finally:
+                self._schedule(interval)
+
+        if self._running:
+            self._timer = threading.Timer(interval, run)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+def _message(sender, sender_id, sender_role, content, time):
+    # the `Message` fields of a buffered row
+    return {'sender': sender, 'sender_id': ObjectId(sender_id) if sender_id else None, 'sender_role': sender_role,
+            'content': content, 'time': datetime.fromisoformat(time)}
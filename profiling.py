@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import wraps
+
+# opt-in profiling of actions: while enabled, a background thread samples the stacks of threads running a `@profiled`
+# function every `interval` seconds, and each call records its wall time and the memory it allocated (tracemalloc).
+# Samples are wall-clock, so time spent waiting on MongoDB shows up under pymongo's socket frames. Nested actions are
+# accounted to the outermost one. tracemalloc's peak is process-wide, so memory is only recorded for calls that ran
+# alone: a call overlapping another profiled call in a different thread counts towards `calls` and `seconds` only.
+# Set RCM_PROFILE=1 to enable at import
+PROFILE_ENV = 'RCM_PROFILE'
+
+_lock = threading.Lock()
+_enabled = False
+_interval = 0.001
+_sampler = None
+_active = {}  # thread id -> (action, frame of its wrapper)
+_overlapped = set()  # thread ids of the active calls that overlapped another, their memory is not recorded
+_stats = {}  # action -> {'calls', 'seconds', 'peak_memory', 'allocated'}
+_stacks = Counter()  # collapsed stack -> samples
+
+
+def enable(interval=0.001):
+    global _enabled, _interval, _sampler
+    with _lock:
+        if _enabled:
+            return
+        _enabled = True
+        _interval = interval
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _sampler = threading.Thread(target=_sample, name='rcm-profiler', daemon=True)
+    _sampler.start()
+
+
+def disable():
+    global _enabled, _sampler
+    with _lock:
+        _enabled = False
+    if _sampler is not None:
+        _sampler.join()
+        _sampler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _stacks.clear()
+
+
+def profiled(func):
+    # record calls of `func` under its name while profiling is enabled; a plain call otherwise
+    action = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        thread_id = threading.get_ident()
+        if not _enabled or thread_id in _active:
+            return func(*args, **kwargs)
+        tracing = tracemalloc.is_tracing()
+        with _lock:
+            if _active:
+                _overlapped.update(_active)
+                _overlapped.add(thread_id)
+            elif tracing:
+                tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0] if tracing else 0
+            _active[thread_id] = (action, sys._getframe())
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            with _lock:
+                del _active[thread_id]
+                measured = tracing and thread_id not in _overlapped
+                _overlapped.discard(thread_id)
+                current, peak = tracemalloc.get_traced_memory() if measured else (0, 0)
+                stats = _stats.setdefault(action, {'calls': 0, 'seconds': 0.0, 'peak_memory': 0, 'allocated': 0})
+                stats['calls'] += 1
+                stats['seconds'] += seconds
+                if measured:
+                    stats['peak_memory'] = max(stats['peak_memory'], peak - before)
+                    stats['allocated'] += current - before
+
+    return wrapper
+
+
+def action_stats():
+    # per action: number of calls, total wall seconds, the largest peak of traced memory above its starting point
+    # during one call, and net bytes still allocated after its calls, the last two over the calls that ran alone
+    with _lock:
+        return {action: dict(stats) for action, stats in _stats.items()}
+
+
+def collapsed_stacks():
+    # samples in the collapsed-stack format read by flamegraph.pl and speedscope, one `frame;frame;... count` a line
+    with _lock:
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(_stacks.items()))
+
+
+def _sample():
+    while _enabled:
+        time.sleep(_interval)
+        frames = sys._current_frames()
+        with _lock:
+            for thread_id, (action, root) in list(_active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    _stacks[_collapse(action, frame, root)] += 1
+
+
+def _collapse(action, frame, root):
+    names = []
+    while frame is not None and frame is not root:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    names.append(action)
+    return ';'.join(reversed(names))
+
+
+if os.environ.get(PROFILE_ENV):
+    enable()
@@ -0,0 +1,158 @@
+from collections import defaultdict
+from datetime import datetime
+from bson import ObjectId
+from models import Student, Instructor, Staff
+from models import Course, CourseEnrollment, CourseMentorship, RequestForCourse
+from mongoengine import DoesNotExist, NotUniqueError
+from pymongo import UpdateOne
+from tenancy import tenant_filter
+from versioning import bump
+from eventlog import record_each
+from eventlog import EVENT_COURSE_ROLLED_OVER, EVENT_MENTOR_ASSIGNED, EVENT_ACCESS_GRANTED, EVENT_QUOTA_SET
+
+
+def rollover_courses(renames, start_date, carry_enrollment=False, carry_quotas=False, dry_run=False):
+    # clone every course of `renames`, a {course: new code} mapping, to start on `start_date`, with the professor,
+    # coordinator, mentors and staff access of the original. With `carry_enrollment` its students are enrolled
+    # again, and with `carry_quotas` each letter quota is granted again at its original size (remaining plus sent),
+    # enrolling its student. Returns the plan, which is all that happens when `dry_run`. Every write is an upsert
+    # or conditional, so re-running a rollover that failed part-way completes it
+    plan = plan_rollover(renames, start_date, carry_enrollment=carry_enrollment, carry_quotas=carry_quotas)
+    if dry_run:
+        return plan
+    if plan['conflicts']:
+        raise NotUniqueError(f"Course codes already in use: {', '.join(plan['conflicts'])}")
+    _execute(plan)
+    _record(plan)
+    return plan
+
+
+def plan_rollover(renames, start_date, carry_enrollment=False, carry_quotas=False):
+    # what `rollover_courses` writes, computed with one query per collection: the new `courses`, the (course, id)
+    # pairs of `mentorships` and `enrollments`, the (student, course, recommender, quota) of `quotas`, the new
+    # course ids added per instructor and per staff, the course each new one is cloned from as `sources`, and the new
+    # codes already in use as `conflicts`. A course with the new code, cloned from the same course to start on
+    # `start_date`, was made by an earlier run and is reused
+    codes = {getattr(course, 'id', course): code for course, code in renames.items()}
+    sources = {
+        raw['_id']: raw
+        for raw in Course.objects(id__in=list(codes)).only('code', 'course_name', 'professor', 'coordinator')
+        .as_pymongo()
+    }
+    missing = [str(_id) for _id in codes if _id not in sources]
+    if missing:
+        raise DoesNotExist(f"Courses {', '.join(missing)} don't exist")
+    new_codes = list(codes.values())
+    starts = Course._fields['start_date'].to_mongo(start_date)
+    taken = {}
+    cloned = {}
+    for raw in Course.objects(code__in=new_codes).only('code', 'start_date', 'cloned_from').as_pymongo():
+        source = raw.get('cloned_from')
+        if source in codes and codes[source] == raw['code'] and raw['start_date'] == starts:
+            cloned[source] = raw['_id']
+        else:
+            taken[raw['code']] = raw['_id']
+    conflicts = sorted(set(taken) | {code for code in new_codes if new_codes.count(code) > 1})
+
+    clones = {}
+    instructors = defaultdict(list)
+    staff = defaultdict(list)
+    for old_id, raw in sources.items():
+        clone = Course(id=cloned.get(old_id) or ObjectId(), code=codes[old_id], course_name=raw.get('course_name'),
+                       start_date=start_date, professor=raw['professor'], coordinator=raw.get('coordinator'),
+                       cloned_from=old_id)
+        clone.validate()
+        clones[old_id] = clone
+        instructors[raw['professor']].append(clone.id)
+        if raw.get('coordinator') is not None:
+            staff[raw['coordinator']].append(clone.id)
+
+    mentorships = []
+    for raw in CourseMentorship.objects(course__in=list(sources)).only('course', 'mentor').as_pymongo():
+        course_id = clones[raw['course']].id
+        mentorships.append((course_id, raw['mentor']))
+        instructors[raw['mentor']].append(course_id)
+    for raw in Staff.objects(accessible_courses__in=list(sources)).only('accessible_courses').as_pymongo():
+        staff[raw['_id']].extend(clones[_id].id for _id in raw['accessible_courses'] if _id in clones)
+
+    enrollments = set()
+    if carry_enrollment:
+        for raw in CourseEnrollment.objects(course__in=list(sources)).only('course', 'student').as_pymongo():
+            enrollments.add((clones[raw['course']].id, raw['student']))
+    quotas = []
+    if carry_quotas:
+        for raw in Student.objects(req_for_courses__course__in=list(sources)).only('req_for_courses').as_pymongo():
+            for r4c in raw['req_for_courses']:
+                if r4c['course'] in clones:
+                    course_id = clones[r4c['course']].id
+                    quota = r4c['requests_quota'] + len(r4c.get('requests_sent', []))
+                    quotas.append((raw['_id'], course_id, r4c['recommender'], quota))
+                    enrollments.add((course_id, raw['_id']))
+
+    return {
+        'courses': list(clones.values()),
+        'sources': {clone.id: old_id for old_id, clone in clones.items()},
+        'mentorships': mentorships,
+        'enrollments': sorted(enrollments),
+        'quotas': quotas,
+        'instructors': {_id: sorted(set(ids)) for _id, ids in instructors.items()},
+        'staff': {_id: sorted(set(ids)) for _id, ids in staff.items()},
+        'conflicts': conflicts,
+    }
+
+
+def _record(plan):
+    # log what `_execute` wrote as the actions writing the same would
+    record_each(EVENT_COURSE_ROLLED_OVER, [
+        (course.id, {'source': plan['sources'][course.id], 'code': course.code,
+                     'start_date': course.to_mongo()['start_date']})
+        for course in plan['courses']
+    ])
+    record_each(EVENT_MENTOR_ASSIGNED, [
+        (course_id, {'mentor': mentor_id}) for course_id, mentor_id in plan['mentorships']
+    ])
+    record_each(EVENT_ACCESS_GRANTED, [
+        (staff_id, {'course': course_id}) for staff_id, course_ids in plan['staff'].items() for course_id in course_ids
+    ])
+    record_each(EVENT_QUOTA_SET, [
+        (student_id, {'course': course_id, 'recommender': recommender_id, 'quota': quota})
+        for student_id, course_id, recommender_id, quota in plan['quotas']
+    ])
+
+
+def _execute(plan):
+    # one bulk write per collection, each written so that a re-run after a failure adds no duplicates
+    if not plan['courses']:
+        return
+    now = datetime.utcnow()
+    Course._get_collection().bulk_write([
+        UpdateOne({**tenant_filter(), 'code': course.code, 'cloned_from': plan['sources'][course.id]},
+                  {'$setOnInsert': course.to_mongo()}, upsert=True)
+        for course in plan['courses']
+    ], ordered=False)
+    for link, field, pairs in [(CourseMentorship, 'mentor', plan['mentorships']),
+                               (CourseEnrollment, 'student', plan['enrollments'])]:
+        if pairs:
+            link._get_collection().bulk_write([
+                UpdateOne({**tenant_filter(), 'course': course_id, field: _id}, {'$setOnInsert': {'date_created': now}},
+                          upsert=True)
+                for course_id, _id in pairs
+            ], ordered=False)
+    for user, field, additions in [(Instructor, 'courses', plan['instructors']),
+                                   (Staff, 'accessible_courses', plan['staff'])]:
+        if additions:
+            user._get_collection().bulk_write([
+                UpdateOne({'_id': _id, **tenant_filter()}, {'$addToSet': {field: {'$each': course_ids}}})
+                for _id, course_ids in additions.items()
+            ], ordered=False)
+    # one conditional push per quota, so that a quota the student already has in a new course leaves the others
+    if plan['quotas']:
+        Student._get_collection().bulk_write([
+            UpdateOne(
+                {'_id': student_id, **tenant_filter(),
+                 'req_for_courses': {'$not': {'$elemMatch': {'course': course_id, 'recommender': recommender_id}}}},
+                bump(Student, {'$push': {'req_for_courses': RequestForCourse(
+                    course=course_id, recommender=recommender_id, requests_quota=quota).to_mongo()}}),
+            )
+            for student_id, course_id, recommender_id, quota in plan['quotas']
+        ], ordered=False)
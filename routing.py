@@ -0,0 +1,53 @@
+from mongoengine import register_connection, disconnect
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_db
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+# read-only entry points (reports, exports, searches, `view_requests`) name the alias they would rather read from;
+# writes always go through the default, primary alias
+ALIAS_PRIMARY = DEFAULT_CONNECTION_NAME
+ALIAS_SECONDARY = 'secondary'
+ALIAS_ANALYTICS = 'analytics'
+
+# the smallest staleness bound MongoDB accepts, in seconds
+MIN_MAX_STALENESS = 90
+
+_routes = set()
+
+
+def connect_routes(db, host='mongodb://localhost:27017', max_staleness=MIN_MAX_STALENESS, analytics_tags=None,
+                   **kwargs):
+    # register the primary alias plus secondary-preferred aliases whose reads lag the primary by at most
+    # `max_staleness` seconds; analytics reads prefer members tagged with `analytics_tags`, e.g. {'use': 'analytics'}.
+    # Only settings are registered: each client is created by the first query through its alias, so a worker that
+    # never reads from analytics never opens connections to it
+    tag_sets = [analytics_tags, {}] if analytics_tags else None
+    routes = {
+        ALIAS_PRIMARY: Primary(),
+        ALIAS_SECONDARY: SecondaryPreferred(max_staleness=max_staleness),
+        ALIAS_ANALYTICS: SecondaryPreferred(tag_sets=tag_sets, max_staleness=max_staleness),
+    }
+    for alias, read_preference in routes.items():
+        disconnect(alias)
+        register_connection(alias, db, host=host, read_preference=read_preference, **kwargs)
+        _routes.add(alias)
+
+
+def disconnect_routes():
+    for alias in list(_routes):
+        disconnect(alias)
+        _routes.discard(alias)
+
+
+def routed(queryset, alias):
+    # evaluate `queryset` through `alias` when it has been registered by `connect_routes`, and through the default
+    # connection otherwise
+    if alias in _routes and alias != ALIAS_PRIMARY:
+        return queryset.using(alias)
+    return queryset
+
+
+def routed_db(alias):
+    # the database to read raw collections from through `alias`, as `routed` does for querysets
+    if alias in _routes:
+        return get_db(alias)
+    return get_db(ALIAS_PRIMARY)
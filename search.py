@@ -0,0 +1,67 @@
+import re
+from models import Student, Instructor, Staff
+from models import Course, Request
+from models import CourseEnrollment
+from models import normalize_search_terms
+from routing import routed, ALIAS_SECONDARY
+from tenancy import tenant_filter
+
+SEARCH_PREFIX = 'prefix'
+SEARCH_TEXT = 'text'
+
+
+def search_users(staff, role, query, mode=SEARCH_PREFIX, page=1, per_page=20, alias=ALIAS_SECONDARY):
+    # search users of `role` by name or email; `staff` without full access only sees students of their courses
+    if role not in [Student, Instructor, Staff]:
+        raise RuntimeError(f"Unknown roll: {role}")
+    queryset = role.objects
+    course_ids = accessible_course_ids(staff)
+    if role is Student and course_ids is not None:
+        enrollments = {'course': {'$in': course_ids}, **tenant_filter()}
+        student_ids = CourseEnrollment._get_collection().distinct('student', enrollments)
+        queryset = queryset.filter(id__in=student_ids)
+    return _search(queryset, query, mode, page, per_page, order_by=('last_name', 'first_name'), alias=alias)
+
+
+def search_courses(staff, query, mode=SEARCH_PREFIX, page=1, per_page=20, alias=ALIAS_SECONDARY):
+    # search courses by `code` or `course_name` among the courses accessible to `staff`
+    queryset = Course.objects
+    course_ids = accessible_course_ids(staff)
+    if course_ids is not None:
+        queryset = queryset.filter(id__in=course_ids)
+    return _search(queryset, query, mode, page, per_page, order_by=('code',), alias=alias)
+
+
+def search_requests(staff, query, mode=SEARCH_PREFIX, page=1, per_page=20, alias=ALIAS_SECONDARY):
+    # search requests by `school_applied` or `program_applied` among the courses accessible to `staff`
+    queryset = Request.objects
+    course_ids = accessible_course_ids(staff)
+    if course_ids is not None:
+        queryset = queryset.filter(course__in=course_ids)
+    return _search(queryset, query, mode, page, per_page, order_by=('deadline', 'date_created'), alias=alias)
+
+
+def accessible_course_ids(staff):
+    # ids of the courses `staff` may access, or None for unrestricted access; always read from the primary
+    if staff.full_access:
+        return None
+    raw = Staff.objects(id=staff.id).only('accessible_courses').as_pymongo().first()
+    return raw.get('accessible_courses', []) if raw else []
+
+
+def _search(queryset, query, mode, page, per_page, order_by, alias):
+    if page < 1 or per_page < 1:
+        raise ValueError(f"Illegal page={page} or per_page={per_page}")
+    if mode == SEARCH_TEXT:
+        # ranked by relevance through the text index
+        queryset = queryset.search_text(query).order_by('$text_score')
+    elif mode == SEARCH_PREFIX:
+        # every query term must prefix one of the normalized `search_keys`; anchored regexes are index range scans
+        terms = normalize_search_terms(query)
+        if not terms:
+            return []
+        prefixes = [re.compile('^' + re.escape(term)) for term in terms]
+        queryset = queryset.filter(__raw__={'search_keys': {'$all': prefixes}}).order_by(*order_by)
+    else:
+        raise RuntimeError(f"Unknown search mode: {mode}")
+    return list(routed(queryset, alias).skip((page - 1) * per_page).limit(per_page))
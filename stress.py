@@ -0,0 +1,152 @@
+import argparse
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+from mongoengine import register_connection, disconnect, DoesNotExist
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from models import Student, Instructor, Course, Request
+from models import STATUS_FULFILLED
+from actions import signup, new_course, set_letter_quota, make_request, withdraw_request
+from tenancy import current_tenant, tenant_scope
+
+# contend on the letter quota of one student for one course and recommender: every worker process makes, withdraws
+# and resets at random, then the quota is checked for oversubscription. Run `python stress.py --db <scratch db>`
+
+MAKE = 'make'
+WITHDRAW = 'withdraw'
+RESET = 'reset'
+
+DEFAULT_MIX = {MAKE: 0.6, WITHDRAW: 0.3, RESET: 0.1}
+
+
+def stress_quota(student, instructor, course, db, host='mongodb://localhost:27017', workers=(1, 2, 4, 8),
+                 operations=200, quota=10, mix=None, seed=0):
+    # one round per worker count in `workers`, each worker running `operations` random operations drawn from `mix`,
+    # a {operation: weight} mapping. Returns one report per round: its throughput, outcome counts, conflict rate
+    # (operations losing a race: a request refused for lack of quota, a withdrawal of a request already withdrawn)
+    # and the violations found by `check_quota`
+    mix = mix or DEFAULT_MIX
+    ids = (student.id, instructor.id, course.id)
+    reports = []
+    for count in workers:
+        _prepare(student, instructor, course, quota)
+        # spawned rather than forked: a forked process would share the client of this one
+        with ProcessPoolExecutor(max_workers=count, mp_context=get_context('spawn')) as pool:
+            started = time.perf_counter()
+            counters = list(pool.map(_work, [
+                (ids, db, host, current_tenant(), operations, quota, mix, seed * 1000 + i) for i in range(count)
+            ]))
+            elapsed = time.perf_counter() - started
+        outcomes = sum(counters, Counter())
+        total = count * operations
+        reports.append({
+            'workers': count,
+            'operations': total,
+            'seconds': elapsed,
+            'throughput': total / elapsed,
+            'outcomes': dict(outcomes),
+            'conflict_rate': (outcomes['refused'] + outcomes['lost']) / total,
+            'violations': check_quota(student, instructor, course, quota if not outcomes[RESET] else None),
+        })
+    return reports
+
+
+def check_quota(student, instructor, course, quota=None):
+    # the invariants of a letter quota: the remaining quota is never negative, each request sent is registered once,
+    # and exactly the pending requests are registered. With `quota`, the quota granted before the run, remaining and
+    # sent also add up to it
+    raw = Student.objects(id=student.id).only('req_for_courses').as_pymongo().get()
+    r4c, = [r4c for r4c in raw['req_for_courses']
+            if (r4c['course'], r4c['recommender']) == (course.id, instructor.id)]
+    sent = r4c.get('requests_sent', [])
+    stored = [raw['_id'] for raw in Request.objects(student=student, instructor=instructor, course=course,
+                                                    status__ne=STATUS_FULFILLED).only('id').as_pymongo()]
+    violations = []
+    if r4c['requests_quota'] < 0:
+        violations.append(f"remaining quota is {r4c['requests_quota']}")
+    if len(set(sent)) != len(sent):
+        violations.append(f"{len(sent) - len(set(sent))} requests are registered more than once")
+    if set(sent) != set(stored):
+        violations.append(f"{len(set(sent) ^ set(stored))} requests are registered but missing, or the reverse")
+    if quota is not None and r4c['requests_quota'] + len(sent) != quota:
+        violations.append(f"{r4c['requests_quota']} remaining and {len(sent)} sent out of a quota of {quota}")
+    return violations
+
+
+def _prepare(student, instructor, course, quota):
+    # withdraw what a previous round left and grant `quota` afresh
+    for raw in Request.objects(student=student, instructor=instructor, course=course,
+                               status__ne=STATUS_FULFILLED).only('id').as_pymongo():
+        withdraw_request(student, Request(id=raw['_id']))
+    set_letter_quota(student=student, recommender=instructor, course=course, quota=quota, reset=True)
+
+
+def _work(args):
+    (student_id, instructor_id, course_id), db, host, tenant, operations, quota, mix, seed = args
+    disconnect()
+    register_connection(DEFAULT_CONNECTION_NAME, db, host=host)
+    rng = random.Random(seed)
+    outcomes = Counter()
+    with tenant_scope(tenant):
+        student = Student.objects.get(id=student_id)
+        instructor = Instructor.objects.get(id=instructor_id)
+        course = Course.objects.get(id=course_id)
+        for operation in rng.choices(list(mix), weights=list(mix.values()), k=operations):
+            outcomes[operation] += 1
+            outcomes[_run(operation, student, instructor, course, quota, rng)] += 1
+    return outcomes
+
+
+def _run(operation, student, instructor, course, quota, rng):
+    # the outcome of one operation: `ok`, `refused` by the quota, `lost` to a concurrent withdrawal, or `idle`
+    try:
+        if operation == MAKE:
+            make_request(student=student, instructor=instructor, course=course, school_applied='Stress',
+                         program_applied='Test', deadline=date.today())
+        elif operation == WITHDRAW:
+            raw = Student.objects(id=student.id).only('req_for_courses').as_pymongo().get()
+            sent = [_id for r4c in raw['req_for_courses'] if r4c['course'] == course.id
+                    for _id in r4c.get('requests_sent', [])]
+            if not sent:
+                return 'idle'
+            withdraw_request(student, Request(id=rng.choice(sent)))
+        elif operation == RESET:
+            set_letter_quota(student=student, recommender=instructor, course=course, quota=quota, reset=True)
+        else:
+            raise RuntimeError(f"Unknown operation: {operation}")
+    except DoesNotExist:
+        return 'refused' if operation == MAKE else 'lost'
+    return 'ok'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the letter quota of one student with concurrent actions")
+    parser.add_argument('--db', required=True, help="database to write the fixtures to, e.g. a scratch database")
+    parser.add_argument('--host', default='mongodb://localhost:27017')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--operations', type=int, default=200)
+    parser.add_argument('--quota', type=int, default=10)
+    args = parser.parse_args()
+
+    register_connection(DEFAULT_CONNECTION_NAME, args.db, host=args.host)
+    suffix = f'{time.time_ns()}@stress.test'
+    student = signup(Student, email=f'student{suffix}', password='pwd', first_name='Stress', last_name='Student',
+                     gender='F')
+    instructor = signup(Instructor, email=f'instructor{suffix}', password='pwd', first_name='Stress',
+                        last_name='Instructor')
+    course = new_course(code=f'S{time.time_ns() % 10 ** 12}', start_date=date.today(), course_name='Stress',
+                        professor=instructor)
+    set_letter_quota(student=student, recommender=instructor, course=course, quota=args.quota)
+
+    print(f"{'workers':>7} {'ops':>6} {'ops/s':>8} {'conflicts':>9}  violations")
+    for report in stress_quota(student, instructor, course, args.db, host=args.host, workers=args.workers,
+                               operations=args.operations, quota=args.quota):
+        print(f"{report['workers']:>7} {report['operations']:>6} {report['throughput']:>8.1f} "
+              f"{report['conflict_rate']:>9.1%}  {'; '.join(report['violations']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
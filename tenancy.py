@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from mongoengine import Q
+from mongoengine.queryset import QuerySet
+
+# many departments (tenants) share one cluster: every top-level document carries a `tenant` key, which leads its
+# shard key, and while a tenant is in scope every query is confined to it and every new document is created in it.
+# A collection with a unique index is sharded on that index, as MongoDB only enforces a unique index that starts
+# with the shard key; the others on (tenant, _id), so that a large tenant still splits into chunks across shards.
+# Outside any scope, documents belong to no tenant and queries are not confined, as in a single-tenant deployment
+
+_tenant = ContextVar('tenant', default=None)
+
+
+def current_tenant():
+    return _tenant.get()
+
+
+@contextmanager
+def tenant_scope(tenant):
+    # run the enclosed actions on behalf of `tenant`
+    token = _tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _tenant.reset(token)
+
+
+def tenant_filter():
+    # the shard-key prefix equality to add to raw queries, so that they are routed to the tenant's shards only
+    tenant = _tenant.get()
+    return {'tenant': tenant} if tenant is not None else {}
+
+
+class TenantQuerySet(QuerySet):
+    # a `QuerySet` confined to the tenant in scope when it is created
+
+    def __init__(self, document, collection):
+        super().__init__(document, collection)
+        tenant = _tenant.get()
+        if tenant is not None:
+            self._query_obj = Q(tenant=tenant)
@@ -3,17 +3,18 @@ import random
 import pytest
 from datetime import date, datetime, timedelta
 from passlib.hash import pbkdf2_sha256
-from mongoengine import connect
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
 from mongoengine import ValidationError, NotUniqueError, DoesNotExist
 from models import STATUS_EMAILED, STATUS_REQUESTED, STATUS_UNFULFILLED, STATUS_FULFILLED
 from err import ActionError
 
-# connect and initialize database
-db = connect('rcm-test-db')
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
 
 
-def clean_up(db=db):
-    db.drop_database('rcm-test-db')
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
 
 
 def random_user_info(length=5):
@@ -31,6 +32,25 @@ def reload(*documents):
         doc.reload()
 
 
+def assert_summaries_consistent(*users):
+    # every summary held by `users` must match its source `Request`, and vice versa
+    from models import Request, Student
+    for user in users:
+        user.reload()
+        field = 'student' if isinstance(user, Student) else 'instructor'
+        requests = {req.id: req for req in Request.objects(**{field: user})}
+        assert len(user.request_summaries) == len(requests)
+        for summary in user.request_summaries:
+            req = requests[summary.request.id]
+            assert summary.course_code == req.course.code
+            assert summary.school_applied == req.school_applied
+            assert summary.program_applied == req.program_applied
+            assert summary.deadline == req.deadline
+            assert summary.status == req.status
+            assert summary.student_name == req.student.first_name + ' ' + req.student.last_name
+            assert summary.instructor_name == req.instructor.first_name + ' ' + req.instructor.last_name
+
+
 def signup_random_user(role, length=5):
     from actions import signup
     eml, pwd, fn, ln, gnd = random_user_info(length=length)
@@ -210,6 +230,13 @@ def test_set_letter_quota():
     for course in Course.objects:
         assert len(course.students) == 1
 
+    # the student is returned as saved
+    updated = set_letter_quota(student=Student(id=std.id), recommender=prof2, course=pl102, quota=60, reset=True)
+    assert updated.req_for_courses.filter(course=pl102, recommender=prof2).get().requests_quota == 60
+    # a missing student is reported as such, not as a quota assigned already
+    with pytest.raises(DoesNotExist):
+        set_letter_quota(student=Student(id=prof1.id), recommender=prof1, course=cs101, quota=1)
+
     clean_up()
 
 
@@ -406,10 +433,63 @@ def test_revoke_access():
     clean_up()
 
 
+def test_batch_staffing():
+    from actions import new_course
+    from actions import set_course_coordinators, assign_course_mentors, withdraw_course_mentors
+    from actions import grant_accesses, revoke_accesses
+    from models import Instructor, Staff, CourseMentorship
+
+    clean_up()
+
+    prof = signup_random_user(Instructor, length=5)
+    mentors = [signup_random_user(Instructor, length=6 + i) for i in range(3)]
+    staff = [signup_random_user(Staff, length=5 + i) for i in range(3)]
+    courses = [new_course(code=f'CS10{i}', start_date=date.today(), course_name='CS', professor=prof) for i in range(3)]
+
+    # every mentor to every course; repeated pairs are no-ops
+    pairs = [(course, mentor) for course in courses for mentor in mentors]
+    assert assign_course_mentors(pairs + pairs[:2]) == [course for course, _ in pairs + pairs[:2]]
+    assert CourseMentorship.objects.count() == 9
+    for mentor in mentors:
+        reload(mentor)
+        assert len(mentor.courses) == 3
+
+    results = withdraw_course_mentors([(courses[0], mentors[0]), (courses[1], mentors[0])])
+    assert results == courses[:2]
+    reload(mentors[0])
+    assert mentors[0].courses == [courses[2]]
+    assert mentors[0] not in courses[0].mentors
+
+    results = set_course_coordinators([(course, member) for course, member in zip(courses, staff)])
+    assert results == courses
+    results = set_course_coordinators([(courses[0], staff[1]), (courses[1], staff[0])])
+    assert results == courses[:2]
+    reload(*courses, *staff)
+    assert [course.coordinator for course in courses] == [staff[1], staff[0], staff[2]]
+    assert staff[0].accessible_courses == [courses[1]]
+    assert staff[1].accessible_courses == [courses[0]]
+
+    # a course given twice is rejected, and keeps its coordinator
+    results = set_course_coordinators([(courses[2], staff[0]), (courses[0], staff[1]), (courses[2], staff[1])])
+    assert results[1] == courses[0]
+    assert isinstance(results[0], ActionError) and isinstance(results[2], ActionError)
+    reload(*courses, *staff)
+    assert [course.coordinator for course in courses] == [staff[1], staff[0], staff[2]]
+    assert courses[2] not in staff[0].accessible_courses
+
+    assert grant_accesses([(member, courses[2]) for member in staff]) == staff
+    revoke_accesses([(staff[0], courses[2]), (staff[0], courses[1])])
+    reload(*staff)
+    assert staff[0].accessible_courses == []
+    assert courses[2] in staff[1].accessible_courses
+
+    clean_up()
+
+
 def test_make_request():
     from actions import signup, new_course, set_letter_quota
     from actions import make_request
-    from models import Instructor, Student
+    from models import Instructor, Student, Request
 
     clean_up()
 
@@ -476,6 +556,8 @@ def test_make_request():
             program_applied='CS2',
             deadline=today,
         )
+    # and the rejected request is never inserted
+    assert Request.objects.count() == 2
 
     # raises error because no quota assigned
     with pytest.raises(DoesNotExist):
@@ -490,6 +572,19 @@ def test_make_request():
 
     # assign 1 quota for (pl102, prof)
     set_letter_quota(student=std, recommender=prof, course=pl102, quota=1)
+    # an invalid request is rejected before any quota is reserved
+    with pytest.raises(ValidationError):
+        make_request(
+            student=std,
+            instructor=prof,
+            course=pl102,
+            school_applied='Yale' * 20,
+            program_applied='Politics',
+            deadline=today,
+        )
+    reload(std)
+    assert std.req_for_courses.filter(course=pl102).get().requests_quota == 1
+    assert Request.objects.count() == 2
     req = make_request(
         student=std,
         instructor=prof,
@@ -514,6 +609,100 @@ def test_make_request():
     clean_up()
 
 
+def test_make_requests():
+    from actions import new_course, set_letter_quota
+    from actions import make_requests
+    from models import Instructor, Student, Request
+
+    clean_up()
+
+    prof = signup_random_user(Instructor, length=5)
+    std = signup_random_user(Student, length=5)
+    today = date.today()
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=4)
+
+    # a batch of 3 requests, one of which is invalid
+    results = make_requests(std, prof, cs101, [
+        ('UC', 'CS', today),
+        ('UC' * 50, 'CS', today),
+        ('Yale', 'Politics', today),
+    ])
+    assert len(results) == 3
+    assert isinstance(results[1], ValidationError)
+    reload(std, prof)
+    r4c = std.req_for_courses.filter(course=cs101).get()
+    assert r4c.requests_quota == 2
+    for req in (results[0], results[2]):
+        req.reload()
+        assert req.student == std
+        assert req.instructor == prof
+        assert req in r4c.requests_sent
+        assert req in prof.requests_received
+    assert results[0].school_applied == 'UC'
+    assert results[2].school_applied == 'Yale'
+    assert Request.objects.count() == 2
+
+    # a batch exceeding the remaining quota is rejected as a whole
+    results = make_requests(std, prof, cs101, [('MIT', 'CS', today)] * 3)
+    assert all(isinstance(result, DoesNotExist) for result in results)
+    reload(std, prof)
+    assert std.req_for_courses.filter(course=cs101).get().requests_quota == 2
+    assert Request.objects.count() == 2
+    assert len(prof.requests_received) == 2
+
+    # a batch using up exactly the remaining quota
+    results = make_requests(std, prof, cs101, [('MIT', 'CS', today), ('CMU', 'CS', today)])
+    assert all(isinstance(result, Request) for result in results)
+    reload(std, prof)
+    assert std.req_for_courses.filter(course=cs101).get().requests_quota == 0
+    assert len(std.req_for_courses.filter(course=cs101).get().requests_sent) == 4
+    assert len(prof.requests_received) == 4
+
+    clean_up()
+
+
+def test_request_summaries():
+    from actions import new_course, set_letter_quota, make_request, make_requests
+    from actions import withdraw_request, fulfill_request, unfulfill_request
+    from models import Instructor, Student
+
+    clean_up()
+
+    prof1 = signup_random_user(Instructor, length=5)
+    prof2 = signup_random_user(Instructor, length=6)
+    std1 = signup_random_user(Student, length=5)
+    std2 = signup_random_user(Student, length=6)
+    today = date.today()
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof1)
+    pl102 = new_course(code='PL102', start_date=today, course_name='Politics', professor=prof2)
+    set_letter_quota(student=std1, recommender=prof1, course=cs101, quota=3)
+    set_letter_quota(student=std1, recommender=prof2, course=pl102, quota=1)
+    set_letter_quota(student=std2, recommender=prof1, course=cs101, quota=2)
+
+    req1 = make_request(student=std1, instructor=prof1, course=cs101, school_applied='UC', program_applied='CS',
+                        deadline=today)
+    req2 = make_request(student=std1, instructor=prof2, course=pl102, school_applied='Yale',
+                        program_applied='Politics', deadline=today)
+    req3, req4 = make_requests(std2, prof1, cs101, [('MIT', 'CS', today), ('CMU', 'CS', today)])
+    assert_summaries_consistent(std1, std2, prof1, prof2)
+
+    fulfill_request(instructor=prof1, request=req1)
+    fulfill_request(instructor=prof1, request=req3)
+    assert_summaries_consistent(std1, std2, prof1, prof2)
+
+    unfulfill_request(instructor=prof1, request=req3.reload())
+    assert_summaries_consistent(std1, std2, prof1, prof2)
+
+    reload(std2, prof1)
+    withdraw_request(student=std2, request=req4)
+    assert_summaries_consistent(std1, std2, prof1, prof2)
+    assert len(std2.request_summaries) == 1
+    assert len(prof1.request_summaries) == 2
+
+    clean_up()
+
+
 def test_withdraw_request():
     from actions import signup, new_course, set_letter_quota, make_request
     from actions import withdraw_request
@@ -583,6 +772,7 @@ def test_send_msg():
     from actions import signup, new_course, set_letter_quota, make_request
     from actions import send_msg
     from models import Instructor, Student, Request
+    from messaging import resolve_senders
 
     clean_up()
 
@@ -596,13 +786,18 @@ def test_send_msg():
     send_msg(sender=std, content='Hello, Prof.', request=req)
     req.reload()
     msg = req.messages.get()
-    assert msg.sender == std.first_name + ' ' + std.last_name
+    # the sender's name is resolved when read
+    assert (msg.sender, msg.sender_id, msg.sender_role) == ('', std.id, 'Student')
+    assert resolve_senders([msg])[0].sender == std.first_name + ' ' + std.last_name
     assert msg.content == 'Hello, Prof.'
+    assert (req.student_unread, req.instructor_unread) == (0, 1)
 
     send_msg(sender="Anonymous", content='Hello, there.', request=req)
     req.reload()
     msg = req.messages.filter(sender='Anonymous').get()
     assert msg.content == 'Hello, there.'
+    assert msg.sender_id is None
+    assert (req.student_unread, req.instructor_unread) == (1, 2)
 
     clean_up()
 
@@ -676,3 +871,40 @@ def test_unfulfill_request():
     # unfulfill an unfulfilled request
     with pytest.raises(ActionError):
         unfulfill_request(instructor=prof1, request=req)
+
+
+def test_view_requests():
+    from actions import new_course, set_letter_quota, make_requests, grant_access
+    from actions import view_requests
+    from models import Instructor, Student, Staff
+
+    clean_up()
+
+    prof = signup_random_user(Instructor, length=5)
+    std1 = signup_random_user(Student, length=5)
+    std2 = signup_random_user(Student, length=6)
+    staff = signup_random_user(Staff, length=5)
+    admin = signup_random_user(Staff, length=6)
+    admin.update(set__full_access=True)
+    admin.reload()
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    pl102 = new_course(code='PL102', start_date=today, course_name='Politics', professor=prof)
+    set_letter_quota(student=std1, recommender=prof, course=cs101, quota=2)
+    set_letter_quota(student=std2, recommender=prof, course=pl102, quota=1)
+    uc, mit = make_requests(std1, prof, cs101, [('UC', 'CS', tomorrow), ('MIT', 'CS', today)])
+    yale, = make_requests(std2, prof, pl102, [('Yale', 'Politics', today)])
+
+    # ordered by deadline
+    assert list(view_requests(admin)) == [mit, yale, uc]
+    assert list(view_requests(admin, by='student', vals=[std2])) == [yale]
+    assert list(view_requests(admin, by='school_applied', vals=['UC', 'Yale'])) == [yale, uc]
+    # restricted to accessible courses
+    assert list(view_requests(staff)) == []
+    grant_access(staff, cs101)
+    staff.reload()
+    assert list(view_requests(staff)) == [mit, uc]
+    assert list(view_requests(staff, by='student', vals=[std2])) == []
+
+    clean_up()
@@ -0,0 +1,82 @@
+import io
+import json
+import pytest
+from datetime import date, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import DoesNotExist
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_archive_requests():
+    from actions import signup, new_course, set_letter_quota, make_requests, fulfill_request, unfulfill_request
+    from actions import view_requests
+    from archive import archive_requests, get_request, get_requests
+    from export import export_requests
+    from models import Student, Instructor, Staff, Request
+
+    clean_up()
+
+    today = date.today()
+    last_year = today - timedelta(days=365)
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5)
+    old_fulfilled, old_unfulfilled, old_pending, new_fulfilled = make_requests(std, prof, cs101, [
+        ('UC', 'CS', last_year),
+        ('MIT', 'EE', last_year),
+        ('CMU', 'ML', last_year),
+        ('Yale', 'Law', today),
+    ])
+    prof.reload()
+    fulfill_request(prof, old_fulfilled)
+    fulfill_request(prof, old_unfulfilled)
+    unfulfill_request(prof, old_unfulfilled.reload())
+    fulfill_request(prof, new_fulfilled)
+
+    # only past-deadline, fulfilled/unfulfilled requests are archived
+    assert archive_requests(cutoff=today - timedelta(days=30), batch_size=1) == 2
+    assert set(Request.objects) == {old_pending, new_fulfilled}
+    std.reload()
+    prof.reload()
+    assert set(std.req_for_courses.get().requests_sent) == {old_pending, new_fulfilled}
+    assert set(prof.requests_received) == {old_pending, new_fulfilled}
+    assert {summary.request for summary in std.request_summaries} == {old_pending, new_fulfilled}
+    assert {summary.request for summary in prof.request_summaries} == {old_pending, new_fulfilled}
+    # archiving again is a no-op
+    assert archive_requests(cutoff=today - timedelta(days=30)) == 0
+
+    # read-through lookups
+    assert get_request(old_fulfilled.id).school_applied == 'UC'
+    assert get_request(old_pending.id).school_applied == 'CMU'
+    ids = [new_fulfilled.id, old_unfulfilled.id, old_fulfilled.id]
+    assert [req.school_applied for req in get_requests(ids)] == ['Yale', 'MIT', 'UC']
+    with pytest.raises(DoesNotExist):
+        get_request(std.id)
+    admin = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    admin.update(full_access=True)
+    admin.reload()
+    assert set(view_requests(admin)) == {old_pending, new_fulfilled}
+    requests = view_requests(admin, include_archive=True)
+    assert len(requests) == 4
+    assert set(requests) == {old_fulfilled, old_unfulfilled, old_pending, new_fulfilled}
+    assert requests[-1] == new_fulfilled
+    assert [req.school_applied for req in view_requests(admin, by='school_applied', vals=['MIT'],
+                                                        include_archive=True)] == ['MIT']
+    fp = io.StringIO()
+    assert export_requests(fp) == 2
+    fp = io.StringIO()
+    assert export_requests(fp, include_archive=True, batch_size=3) == 4
+    assert {json.loads(line)['school_applied'] for line in fp.getvalue().splitlines()} == {'UC', 'MIT', 'CMU', 'Yale'}
+
+    # the archive is read without switching the collection of `Request`
+    assert Request._get_collection().name == 'request'
+
+    clean_up()
@@ -0,0 +1,74 @@
+import pytest
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import OperationError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_bulk_delete():
+    from actions import signup, new_course, set_letter_quota, make_request, assign_course_mentor
+    from actions import set_course_coordinator, grant_access
+    from deletion import bulk_delete
+    from models import Student, Instructor, Staff, Course, CourseEnrollment, CourseMentorship, Request
+
+    clean_up()
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    mentor = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    coordinator = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    cohort = [
+        signup(Student, email=f'std{i}@uni.edu', password='pwd', first_name='Std', last_name=str(i), gender='F')
+        for i in range(5)
+    ]
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    cs102 = new_course(code='CS102', start_date=today, course_name='Data Structures', professor=prof)
+    assign_course_mentor(cs101, mentor)
+    set_course_coordinator(cs101, coordinator)
+    grant_access(coordinator, cs102)
+    for std in cohort:
+        set_letter_quota(student=std, recommender=prof, course=cs101, quota=1)
+    req = make_request(student=cohort[0], instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                       deadline=today)
+
+    # a student with a request can't be deleted; nothing is deleted in that case
+    plan = bulk_delete(Student, cohort, dry_run=True)
+    assert plan['deny'] == [(Request, 'student', 1)]
+    assert plan['cascade'][0]['document'] is CourseEnrollment
+    assert len(plan['cascade'][0]['ids']) == 5
+    with pytest.raises(OperationError):
+        bulk_delete(Student, cohort)
+    assert Student.objects.count() == 5
+    assert len(cs101.students) == 5
+
+    # the rest of the cohort; their enrollments are cascaded
+    bulk_delete(Student, cohort[1:])
+    assert list(Student.objects) == [cohort[0]]
+    assert list(cs101.students) == [cohort[0]]
+
+    # a professor can't be deleted, a mentor can
+    with pytest.raises(OperationError):
+        bulk_delete(Instructor, [prof, mentor])
+    bulk_delete(Instructor, [mentor])
+    assert CourseMentorship.objects.count() == 0
+
+    # deleting a coordinator nullifies `Course.coordinator`
+    bulk_delete(Staff, [coordinator])
+    cs101.reload()
+    assert cs101.coordinator is None
+
+    # deleting a course pulls it from `Instructor.courses`
+    bulk_delete(Request, [req])
+    bulk_delete(Course, [cs101, cs102])
+    prof.reload()
+    assert prof.courses == []
+    assert CourseEnrollment.objects.count() == 0
+
+    clean_up()
@@ -0,0 +1,144 @@
+from datetime import date, datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_history():
+    from actions import signup, new_course, set_letter_quota, make_requests, withdraw_request, send_msg
+    from actions import fulfill_request, unfulfill_request, grant_access
+    from models import Student, Instructor, Staff
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    staff = signup(Staff, email='admin@uni.edu', password='pwd', first_name='Ad', last_name='Min')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    cs102 = new_course(code='CS102', start_date=today, course_name='Data Structures', professor=prof)
+    grant_access(staff, cs101)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5)
+    set_letter_quota(student=std, recommender=prof, course=cs102, quota=5)
+    reqs = make_requests(student=std, instructor=prof, course=cs101,
+                         applications=[(f'School {i}', 'CS', today) for i in range(4)])
+    reqs += make_requests(student=std, instructor=prof, course=cs102, applications=[('MIT', 'CS', today)])
+    send_msg(sender=std, content='Hello, Prof.', request=reqs[0])
+    fulfill_request(prof, reqs[0])
+    fulfill_request(prof, reqs[1])
+    unfulfill_request(prof, reqs[1])
+    withdraw_request(std, reqs[2])
+    return prof, std, cs101, cs102, reqs
+
+
+def test_event_log():
+    from models import Event
+    from models import STATUS_REQUESTED, STATUS_FULFILLED, STATUS_UNFULFILLED
+    from eventlog import EVENT_SIGNUP, EVENT_REQUEST_MADE, EVENT_REQUEST_WITHDRAWN, EVENT_MESSAGE_SENT
+
+    clean_up()
+
+    prof, std, cs101, cs102, reqs = setup_history()
+    assert Event.objects(type=EVENT_SIGNUP).count() == 3
+    assert Event.objects(type=EVENT_REQUEST_MADE).count() == 5
+    made = Event.objects(type=EVENT_REQUEST_MADE, subject=reqs[0].id).get()
+    assert made.data == {'student': std.id, 'instructor': prof.id, 'course': cs101.id, 'status': STATUS_REQUESTED}
+    assert Event.objects(type=EVENT_REQUEST_WITHDRAWN).get().subject == reqs[2].id
+    sent = Event.objects(type=EVENT_MESSAGE_SENT).get().data
+    assert (sent['sender_id'], sent['sender_role']) == (std.id, 'Student')
+    # no password hash in the log
+    assert 'password' not in Event.objects(type=EVENT_SIGNUP).first().data
+    statuses = [event.data['status'] for event in Event.objects(subject=reqs[1].id).order_by('id')]
+    assert statuses == [STATUS_REQUESTED, STATUS_FULFILLED, STATUS_UNFULFILLED]
+
+    clean_up()
+
+
+def test_projections():
+    from actions import send_msg
+    from bson import ObjectId
+    from models import Event, ProjectionCheckpoint, ProjectionEntry
+    from models import STATUS_REQUESTED, STATUS_EMAILED, STATUS_FULFILLED, STATUS_UNFULFILLED
+    from eventlog import run_projection, rebuild_projection, REQUEST_STATS, REQUEST_STATUSES, _allocate
+    from transitions import transition_many, EVENT_EMAIL
+
+    clean_up()
+
+    prof, std, cs101, cs102, reqs = setup_history()
+    until = datetime.utcnow() + timedelta(seconds=1)
+
+    stats = run_projection(REQUEST_STATS, batch_size=3, until=until)
+    assert stats['events']['request_made'] == 5
+    assert stats['events']['signup'] == 3
+    assert stats['requests_by_course'] == {str(cs101.id): 4, str(cs102.id): 1}
+    checkpoint = ProjectionCheckpoint.objects(name='request_stats').get()
+    assert checkpoint.state == stats
+
+    # resumes from the checkpoint
+    send_msg(sender=prof, content='Hi, John.', request=reqs[0])
+    stats = run_projection(REQUEST_STATS, batch_size=3, until=datetime.utcnow() + timedelta(seconds=1))
+    assert stats['events']['message_sent'] == 2
+    assert stats['events']['request_made'] == 5
+
+    # positions and times are allocated by the server: an event from a host whose clock is behind is still consumed
+    seq, logged = _allocate(1)
+    Event(id=ObjectId.from_datetime(datetime.utcnow() - timedelta(hours=1)), type='signup', subject=std.id, seq=seq,
+          date_logged=logged).save(force_insert=True)
+    stats = run_projection(REQUEST_STATS, until=datetime.utcnow() + timedelta(seconds=1))
+    assert stats['events']['signup'] == 4
+
+    # replaying the whole log in parallel gives the same read model
+    later = datetime.utcnow() + timedelta(seconds=1)
+    assert rebuild_projection(REQUEST_STATS, batch_size=2, workers=2, until=later) == stats
+
+    statuses = run_projection(REQUEST_STATUSES, batch_size=2, workers=3, until=until)
+    assert statuses == {
+        str(reqs[0].id): STATUS_FULFILLED,
+        str(reqs[1].id): STATUS_UNFULFILLED,
+        str(reqs[2].id): None,
+        str(reqs[3].id): STATUS_REQUESTED,
+        str(reqs[4].id): STATUS_REQUESTED,
+    }
+    # one entry per request rather than a state in the checkpoint
+    assert ProjectionCheckpoint.objects(name='request_statuses').get().state == {}
+    assert ProjectionEntry.objects(projection='request_statuses').count() == 5
+
+    # requests moved in bulk are logged one by one
+    assert transition_many(EVENT_EMAIL, course=cs101) == 1
+    statuses = run_projection(REQUEST_STATUSES, until=datetime.utcnow() + timedelta(seconds=1))
+    assert statuses[str(reqs[3].id)] == STATUS_EMAILED
+    assert statuses[str(reqs[4].id)] == STATUS_REQUESTED
+
+    clean_up()
+
+
+def test_logged_actions():
+    from actions import assign_course_mentors, withdraw_course_mentor, set_course_coordinator, signup
+    from models import Event, Instructor, Staff
+    from eventlog import EVENT_MENTOR_ASSIGNED, EVENT_MENTOR_WITHDRAWN, EVENT_ACCESS_GRANTED, EVENT_ACCESS_REVOKED
+
+    clean_up()
+
+    prof, std, cs101, cs102, reqs = setup_history()
+    mentor = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    assign_course_mentors([(cs101, mentor), (cs102, mentor)])
+    withdraw_course_mentor(cs102, mentor)
+    assert {(e.subject, e.data['mentor']) for e in Event.objects(type=EVENT_MENTOR_ASSIGNED)} == {
+        (cs101.id, mentor.id), (cs102.id, mentor.id)}
+    assert Event.objects(type=EVENT_MENTOR_WITHDRAWN).get().subject == cs102.id
+
+    # a coordinator is granted access to the course, their predecessor loses it
+    grace = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    alan = signup(Staff, email='alan@staff.edu', password='pwd', first_name='Alan', last_name='Kay')
+    set_course_coordinator(cs101, grace)
+    set_course_coordinator(cs101, alan)
+    granted = Event.objects(type=EVENT_ACCESS_GRANTED, subject__in=[grace.id, alan.id]).order_by('id')
+    assert [e.subject for e in granted] == [grace.id, alan.id]
+    revoked = Event.objects(type=EVENT_ACCESS_REVOKED).get()
+    assert (revoked.subject, revoked.data) == (grace.id, {'course': cs101.id})
+
+    clean_up()
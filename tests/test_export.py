@@ -0,0 +1,96 @@
+import io
+import csv
+import json
+import pytest
+from datetime import date, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def populate():
+    from actions import signup, new_course, set_letter_quota, make_requests, send_msg
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5)
+    reqs = make_requests(std, prof, cs101, [('UC', 'CS', today), ('MIT', 'EE', today), ('CMU', 'ML', today)])
+    make_requests(std, prof, cs101, [('Yale', 'Law', today)], date_created=today - timedelta(days=365))
+    send_msg(sender=std, content='Hello, Prof.', request=reqs[0])
+    send_msg(sender=prof, content='Hello, John.', request=reqs[0])
+    return today, reqs
+
+
+def test_export_ndjson():
+    from export import export_requests
+
+    clean_up()
+
+    today, reqs = populate()
+
+    fp = io.StringIO()
+    # a batch size smaller than the number of requests
+    assert export_requests(fp, since=today - timedelta(days=30), batch_size=2) == 3
+    rows = [json.loads(line) for line in fp.getvalue().splitlines()]
+    assert [row['id'] for row in rows] == [str(req.id) for req in reqs]
+    assert rows[0]['student_email'] == 'john@uni.edu'
+    assert rows[0]['student_name'] == 'John Doe'
+    assert rows[0]['instructor_name'] == 'Ada Lovelace'
+    assert rows[0]['course_code'] == 'CS101'
+    assert rows[0]['deadline'] == today.isoformat()
+    assert [msg['content'] for msg in rows[0]['messages']] == ['Hello, Prof.', 'Hello, John.']
+    assert [msg['sender'] for msg in rows[0]['messages']] == ['John Doe', 'Ada Lovelace']
+    assert rows[1]['messages'] == []
+
+    # the whole history
+    fp = io.StringIO()
+    assert export_requests(fp) == 4
+
+    clean_up()
+
+
+def test_export_csv():
+    from export import export_requests, EXPORT_CSV
+
+    clean_up()
+
+    today, reqs = populate()
+
+    fp = io.StringIO()
+    assert export_requests(fp, fmt=EXPORT_CSV, until=today - timedelta(days=30)) == 1
+    rows = list(csv.DictReader(io.StringIO(fp.getvalue())))
+    assert len(rows) == 1
+    assert rows[0]['school_applied'] == 'Yale'
+    assert json.loads(rows[0]['messages']) == []
+
+    with pytest.raises(RuntimeError):
+        export_requests(fp, fmt='xml')
+
+    clean_up()
+
+
+def test_export_parquet():
+    parquet = pytest.importorskip('pyarrow.parquet')
+    from export import export_requests, EXPORT_PARQUET
+
+    clean_up()
+
+    today, reqs = populate()
+
+    fp = io.BytesIO()
+    assert export_requests(fp, fmt=EXPORT_PARQUET, batch_size=2) == 4
+    fp.seek(0)
+    rows = parquet.read_table(fp).to_pylist()
+    assert len(rows) == 4
+    assert rows[0]['course_code'] == 'CS101'
+
+    clean_up()
@@ -0,0 +1,134 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import DoesNotExist
+from err import ActionError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_idempotent_retries():
+    from actions import signup, new_course, set_letter_quota, make_request, send_msg
+    from models import Student, Instructor, Request, Event, IdempotencyKey
+
+    clean_up()
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+                 idempotency_key='signup-1')
+    # a replayed sign-up returns the original user instead of failing on the existing email
+    replayed = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+                      idempotency_key='signup-1')
+    assert isinstance(replayed, Student)
+    assert replayed.id == std.id
+    assert replayed.password == std.password
+    # the user is stored by reference, without its password hash
+    assert IdempotencyKey.objects(key='signup-1').get().result == {'document': 'Student', 'id': std.id}
+    # a replay with other arguments is refused
+    with pytest.raises(ActionError):
+        signup(Student, email='john@uni.edu', password='pwd', first_name='Jack', last_name='Doe', gender='M',
+               idempotency_key='signup-1')
+    with pytest.raises(ActionError):
+        signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+               idempotency_key='signup-2')
+
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=2)
+
+    def request(key):
+        return make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                            deadline=today, idempotency_key=key)
+
+    req = request('request-1')
+    assert request('request-1').id == req.id
+    assert Request.objects.count() == 1
+    std.reload()
+    assert std.req_for_courses[0].requests_quota == 1
+
+    # failed calls release their key
+    request('request-2')
+    with pytest.raises(DoesNotExist):
+        request('request-3')
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=1, reset=True)
+    assert request('request-3').id != req.id
+    assert Request.objects.count() == 3
+
+    msg = send_msg(sender=std, content='Hello, Prof.', request=req, idempotency_key='msg-1')
+    replayed = send_msg(sender=std, content='Hello, Prof.', request=req, idempotency_key='msg-1')
+    assert (replayed.sender, replayed.content, replayed.time) == (msg.sender, msg.content, msg.time)
+    req.reload()
+    assert len(req.messages) == 1
+    assert Event.objects(type='message_sent').count() == 1
+
+    # keys are scoped to their caller: another sender's message under the same key is sent
+    reply = send_msg(sender=prof, content='Hi, John.', request=req, idempotency_key='msg-1')
+    assert reply.sender_id == prof.id
+    req.reload()
+    assert len(req.messages) == 2
+
+    clean_up()
+
+
+def test_abandoned_claims():
+    from actions import signup
+    from models import Student, IdempotencyKey
+    from models import IDEMPOTENCY_CLAIM_TIMEOUT
+
+    clean_up()
+
+    # a call that died holding its key blocks retries until the claim times out, then a retry takes it over
+    now = datetime.utcnow()
+    claim = IdempotencyKey(action='signup', principal='john@uni.edu', key='signup-1', owner='dead', date_claimed=now)
+    claim.save()
+    with pytest.raises(ActionError):
+        signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+               idempotency_key='signup-1')
+    claim.update(set__date_claimed=now - timedelta(seconds=IDEMPOTENCY_CLAIM_TIMEOUT + 1))
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+                 idempotency_key='signup-1')
+    claim.reload()
+    assert claim.done
+    assert claim.owner != 'dead'
+    assert signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M',
+                  idempotency_key='signup-1').id == std.id
+
+    clean_up()
+
+
+def test_concurrent_replays():
+    from actions import signup, new_course, set_letter_quota, make_request
+    from models import Student, Instructor, Request
+
+    clean_up()
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=10)
+
+    def request(_):
+        try:
+            return make_request(student=std, instructor=prof, course=cs101, school_applied='UC',
+                                program_applied='CS', deadline=today, idempotency_key='request-1')
+        except ActionError:
+            # the first call is still running
+            return None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(request, range(32)))
+
+    assert Request.objects.count() == 1
+    assert {result.id for result in results if result is not None} == {Request.objects.get().id}
+    std.reload()
+    assert std.req_for_courses[0].requests_quota == 9
+
+    clean_up()
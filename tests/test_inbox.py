@@ -0,0 +1,65 @@
+import pytest
+from datetime import date, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_instructor_inbox():
+    from actions import signup, new_course, set_letter_quota, make_requests, fulfill_request
+    from models import Student, Instructor
+    from models import STATUS_REQUESTED
+    from inbox import instructor_inbox, INBOX_FIELDS
+
+    clean_up()
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    other = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    cs102 = new_course(code='CS102', start_date=today, course_name='Data Structures', professor=prof)
+    for course in [cs101, cs102]:
+        set_letter_quota(student=std, recommender=prof, course=course, quota=10)
+    set_letter_quota(student=std, recommender=other, course=cs101, quota=10)
+
+    # deadlines in reverse creation order, with ties broken by `date_created`
+    reqs = []
+    for i in range(6):
+        reqs += make_requests(student=std, instructor=prof, course=cs101, applications=[
+            (f'School {i}', 'CS', today + timedelta(days=(5 - i) // 2)),
+        ], date_created=date(2020, 1, 1) + timedelta(days=i))
+    reqs += make_requests(student=std, instructor=prof, course=cs102, applications=[
+        ('Late', 'CS', today + timedelta(days=30)),
+    ])
+    make_requests(student=std, instructor=other, course=cs101, applications=[
+        ('Elsewhere', 'CS', today),
+    ])
+    fulfill_request(instructor=prof, request=reqs[5])
+
+    page, total, counts = instructor_inbox(prof, per_page=3)
+    assert total == 6
+    assert counts == {cs101.id: 5, cs102.id: 1}
+    assert [raw['school_applied'] for raw in page] == ['School 4', 'School 2', 'School 3']
+    assert set(page[0]) == {'_id'} | set(INBOX_FIELDS)
+    assert page[0]['status'] == STATUS_REQUESTED
+
+    page, total, _ = instructor_inbox(prof, page=2, per_page=3)
+    assert [raw['school_applied'] for raw in page] == ['School 0', 'School 1', 'Late']
+    assert instructor_inbox(prof, page=3, per_page=3)[0] == []
+
+    page, total, counts = instructor_inbox(prof, course=cs102)
+    assert total == 1
+    assert [raw['school_applied'] for raw in page] == ['Late']
+    assert counts == {cs101.id: 5, cs102.id: 1}
+
+    with pytest.raises(ValueError):
+        instructor_inbox(prof, page=0)
+
+    clean_up()
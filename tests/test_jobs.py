@@ -0,0 +1,170 @@
+import base64
+import pytest
+from datetime import date, datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_course():
+    from actions import signup, new_course
+    from models import Instructor, Staff
+
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    staff = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    cs101 = new_course(code='CS101', start_date=date.today(), course_name='Intro to CS', professor=prof)
+    return prof, staff, cs101
+
+
+def test_action_jobs():
+    from actions import new_course
+    from models import Course, Job, JOB_QUEUED, JOB_DONE, JOB_FAILED
+    from jobs import enqueue, enqueue_action, work
+
+    clean_up()
+
+    prof, staff, cs101 = setup_course()
+    job = enqueue_action('new_course', code='CS102', start_date=date.today(), course_name='Data Structures',
+                         professor=prof)
+    assert job.status == JOB_QUEUED
+    assert work(drain=True) == 1
+    job.reload()
+    assert job.status == JOB_DONE
+    assert (job.done, job.total, job.attempts) == (1, 1, 1)
+    assert job.result['_id'] == Course.objects.get(code='CS102').id
+
+    with pytest.raises(RuntimeError):
+        enqueue_action('_link')
+    with pytest.raises(RuntimeError):
+        enqueue('nonsense')
+
+    # a failed job is queued again until it runs out of attempts
+    job = enqueue_action(new_course, max_attempts=2, code='CS101', start_date=date.today(), course_name='Again',
+                         professor=prof)
+    assert work(drain=True) == 2
+    job.reload()
+    assert job.status == JOB_FAILED
+    assert job.attempts == 2
+    assert job.error.startswith('NotUniqueError')
+    assert Job.objects(status=JOB_QUEUED).count() == 0
+
+    # a result that cannot be stored fails the job
+    job = enqueue_action('view_requests', staff=staff)
+    assert work(drain=True) == 1
+    job.reload()
+    assert job.status == JOB_FAILED
+    assert job.error.startswith('InvalidDocument')
+
+    clean_up()
+
+
+def test_checkpoints_and_leases():
+    from actions import signup, signin
+    from models import Student, CourseEnrollment, Job, JOB_RUNNING, JOB_DONE, JOB_CANCELLED
+    from jobs import enqueue, claim_job, run_job, cancel_job, work
+
+    clean_up()
+
+    prof, staff, cs101 = setup_course()
+    rows = [dict(email=f'student{i}@uni.edu', password='pwd', first_name='Student', last_name=str(i), gender='F')
+            for i in range(5)]
+    signup(Student, **rows[0])
+    job = enqueue('roster_import', course=cs101, rows=rows, batch_size=2)
+    # passwords are hashed before they are stored with the job
+    assert 'pwd' not in {row['password'] for row in job.reload().args['rows']}
+    assert work(drain=True) == 1
+    job.reload()
+    assert job.status == JOB_DONE
+    assert (job.done, job.total, job.checkpoint) == (5, 5, {'next': 5})
+    assert CourseEnrollment.objects(course=cs101).count() == 5
+    assert Student.objects.count() == 5
+    assert signin(Student, 'student4@uni.edu', 'pwd').last_name == '4'
+
+    # a worker dying with the job leased: the job is claimed again once the lease expires, and resumes from its
+    # checkpoint, here after the first two students
+    students = sorted(Student.objects, key=lambda student: student.id)
+    job = enqueue('course_quotas', course=cs101, recommender=prof, quota=2, batch_size=2)
+    Job.objects(id=job.id).update_one(set__checkpoint={'after': students[1].id, 'done': 2})
+    assert claim_job('dead-worker', lease=-1).id == job.id
+    assert claim_job('worker', lease=60) is not None
+    assert claim_job('another-worker') is None
+    job.reload()
+    assert (job.status, job.lease_owner, job.attempts) == (JOB_RUNNING, 'worker', 2)
+    run_job(job, 'worker')
+    job.reload()
+    assert (job.status, job.done, job.total) == (JOB_DONE, 5, 5)
+    quotas = [len(student.reload().req_for_courses) for student in students]
+    assert quotas == [0, 0, 1, 1, 1]
+
+    # cancellation, of a queued job and of a running one at its next progress report
+    queued = enqueue('course_quotas', course=cs101, recommender=prof, quota=3, batch_size=1)
+    assert cancel_job(queued)
+    assert queued.reload().status == JOB_CANCELLED
+    enqueue('course_quotas', course=cs101, recommender=prof, quota=3, batch_size=1)
+    running = claim_job('worker')
+    assert cancel_job(running)
+    run_job(running, 'worker')
+    running.reload()
+    assert running.status == JOB_CANCELLED
+    assert running.done == 1
+    assert not cancel_job(running)
+
+    clean_up()
+
+
+def test_eta():
+    from models import Job, JOB_RUNNING
+
+    now = datetime.utcnow()
+    job = Job(name='export', status=JOB_RUNNING, done=30, resumed_done=10, total=50,
+              date_started=now - timedelta(seconds=20))
+    # 20 done in 20 seconds, 20 left
+    assert timedelta(seconds=19) < job.eta < timedelta(seconds=21)
+    assert Job(name='export', status=JOB_RUNNING, done=10, resumed_done=10, total=50, date_started=now).eta is None
+
+
+def test_worker_processes(tmp_path):
+    from actions import set_letter_quota, make_requests
+    from models import Student, Job, JOB_DONE
+    from jobs import enqueue, run_workers
+    from app import app
+
+    clean_up()
+
+    prof, staff, cs101 = setup_course()
+    rows = [dict(email=f'student{i}@uni.edu', password='pwd', first_name='Student', last_name=str(i), gender='M')
+            for i in range(4)]
+    enqueue('roster_import', course=cs101, rows=rows[:2])
+    enqueue('roster_import', course=cs101, rows=rows[2:])
+    assert run_workers('rcm-test-db', workers=2, drain=True) == 2
+    assert Student.objects.count() == 4
+
+    std = Student.objects.first()
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=3)
+    make_requests(std, prof, cs101, [('UC', 'CS', date.today()), ('MIT', 'EE', date.today())])
+    path = tmp_path / 'requests.ndjson'
+    job = enqueue('export', path=str(path), batch_size=1)
+    assert run_workers('rcm-test-db', workers=2, drain=True) == 1
+    job.reload()
+    assert (job.status, job.done, job.total, job.result) == (JOB_DONE, 2, 2, 2)
+    assert len(path.read_text().splitlines()) == 2
+
+    client = app.test_client()
+    auth = {'Authorization': 'Basic ' + base64.b64encode(b'grace@hopper.com:pwd').decode()}
+    assert client.get(f'/jobs/{job.id}', headers=auth).status_code == 403
+    staff.update(set__full_access=True)
+    response = client.get(f'/jobs/{job.id}', headers=auth)
+    assert response.status_code == 200
+    assert response.json['status'] == JOB_DONE
+    assert response.json['done'] == 2
+    assert client.delete(f'/jobs/{job.id}', headers=auth).status_code == 409
+    assert client.get('/jobs/nonsense', headers=auth).status_code == 404
+    assert Job.objects.count() == 3
+
+    clean_up()
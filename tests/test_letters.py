@@ -0,0 +1,162 @@
+import io
+import os
+import base64
+import hashlib
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import DoesNotExist, ValidationError
+from err import ActionError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_requests():
+    from actions import signup, new_course, set_letter_quota, make_request
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    other = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=2)
+    req1 = make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                        deadline=today)
+    req2 = make_request(student=std, instructor=prof, course=cs101, school_applied='MIT', program_applied='CS',
+                        deadline=today)
+    return prof, other, std, req1, req2
+
+
+def test_fulfill_with_letter():
+    from actions import fulfill_request, unfulfill_request
+    from models import Letter, Request
+    from models import STATUS_FULFILLED
+    from letters import open_letter, iter_letter, upload_letter, discard_letter, MAX_LETTER_SIZE
+
+    clean_up()
+
+    prof, other, std, req1, req2 = setup_requests()
+    content = os.urandom(1024 * 1024 + 17)
+
+    # only the instructor of the request may fulfill it
+    with pytest.raises(DoesNotExist):
+        fulfill_request(other, req1, letter=io.BytesIO(content))
+    assert Letter.objects.count() == 0
+
+    fulfill_request(prof, req1, letter=io.BytesIO(content))
+    req1.reload()
+    assert req1.status == STATUS_FULFILLED
+    assert req1.letter.sha256 == hashlib.sha256(content).hexdigest()
+    assert req1.letter.length == len(content)
+
+    # the same content is stored once
+    fulfill_request(prof, req2, letter=io.BytesIO(content))
+    req2.reload()
+    assert req2.letter == req1.letter
+    assert Letter.objects.count() == 1
+    assert get_connection()['rcm-test-db']['letters.files'].count_documents({}) == 1
+    assert req1.letter.refs == 2
+
+    # fulfilled already: the upload is rolled back
+    with pytest.raises(ActionError):
+        fulfill_request(prof, req1, letter=io.BytesIO(b'another letter'))
+    assert Letter.objects.count() == 1
+
+    # downloads by the student and the instructor only
+    for user in [std, prof]:
+        letter, stream = open_letter(user, req1)
+        assert b''.join(iter_letter(stream)) == content
+    with pytest.raises(ActionError):
+        open_letter(other, req1)
+
+    with pytest.raises(ValidationError):
+        upload_letter(io.BytesIO(b'0' * (MAX_LETTER_SIZE + 1)))
+    assert get_connection()['rcm-test-db']['letters.files'].count_documents({}) == 1
+
+    # an upload shares the letter until it releases its reference
+    letter = upload_letter(io.BytesIO(content))
+    assert letter.id == req1.letter.id
+    assert letter.refs == 3
+    assert not discard_letter(letter)
+
+    # revoking the fulfillments releases the letter, deleted with the last one
+    unfulfill_request(prof, req1)
+    assert Letter.objects.get().refs == 1
+    assert Request.objects.get(id=req1.id).letter is None
+    unfulfill_request(prof, req2)
+    assert Letter.objects.count() == 0
+    assert get_connection()['rcm-test-db']['letters.files'].count_documents({}) == 0
+
+    clean_up()
+
+
+def test_concurrent_uploads():
+    from models import Letter
+    from letters import upload_letter
+
+    clean_up()
+
+    size = 10 * 1024 * 1024
+    distinct = [os.urandom(size) for _ in range(4)]
+    same = os.urandom(size)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        letters = list(pool.map(lambda content: upload_letter(io.BytesIO(content)), distinct + [same] * 4))
+
+    assert len({letter.id for letter in letters[:4]}) == 4
+    assert len({letter.id for letter in letters[4:]}) == 1
+    assert Letter.objects.count() == 5
+    assert get_connection()['rcm-test-db']['letters.files'].count_documents({}) == 5
+
+    clean_up()
+
+
+def test_letter_endpoints():
+    from app import app
+    from archive import archive_requests
+
+    clean_up()
+
+    prof, other, std, req1, req2 = setup_requests()
+    client = app.test_client()
+
+    def auth(email):
+        return {'Authorization': 'Basic ' + base64.b64encode(f'{email}:pwd'.encode()).decode()}
+
+    content = os.urandom(300 * 1024)
+    url = f'/requests/{req1.id}/letter'
+    assert client.put(url, data=content, headers=auth('john@uni.edu')).status_code == 401
+    assert client.put(url, data=content, headers=auth('alan@turing.com')).status_code == 404
+    response = client.put(url, data=content, content_type='application/pdf', headers=auth('ada@lovelace.com'))
+    assert response.status_code == 204
+    assert client.put(url, data=content, headers=auth('ada@lovelace.com')).status_code == 409
+
+    response = client.get(url, headers=auth('john@uni.edu'))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.is_streamed
+    assert response.data == content
+    revalidated = client.get(url, headers={**auth('john@uni.edu'), 'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get(url, headers=auth('alan@turing.com')).status_code == 403
+    assert client.get(f'/requests/{req2.id}/letter', headers=auth('john@uni.edu')).status_code == 404
+    assert client.get('/requests/nonsense/letter', headers=auth('john@uni.edu')).status_code == 404
+
+    # archived requests and their letters are still served
+    assert archive_requests(cutoff=date.today() + timedelta(days=1)) == 1
+    response = client.get(url, headers=auth('john@uni.edu'))
+    assert response.status_code == 200
+    assert response.data == content
+    assert client.get(url, headers=auth('alan@turing.com')).status_code == 403
+    response = client.get(f'/requests/{req1.id}', headers=auth('ada@lovelace.com'))
+    assert response.status_code == 200
+    assert response.json['school_applied'] == 'UC'
+
+    clean_up()
@@ -0,0 +1,97 @@
+import pytest
+from datetime import date, datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import DoesNotExist
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_requests():
+    from actions import signup, new_course, set_letter_quota, make_requests
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=3)
+    reqs = make_requests(std, prof, cs101, [('UC', 'CS', today), ('MIT', 'EE', today), ('CMU', 'ML', today)])
+    return prof, std, reqs
+
+
+def test_senders(tmp_path):
+    from actions import send_msg
+    from models import Student, Request
+    from messaging import messages_sent_by, resolve_senders, clear_sender_cache
+    from msgbuffer import MessageBuffer
+
+    clean_up()
+    clear_sender_cache()
+
+    prof, std, reqs = setup_requests()
+    t0 = datetime.utcnow()
+    send_msg(sender=std, content='Hello, Prof.', request=reqs[0], time=t0)
+    send_msg(sender=prof, content='Hi, John.', request=reqs[0], time=t0 + timedelta(seconds=1))
+    send_msg(sender=std, content='Any news?', request=reqs[1], time=t0 + timedelta(seconds=2))
+    buffer = MessageBuffer(str(tmp_path / 'messages.db'))
+    send_msg(sender=std, content='Still there?', request=reqs[2], time=t0 + timedelta(seconds=3), buffer=buffer)
+    assert [msg.sender for msg in buffer.pending(reqs[2])] == ['John Doe']
+    buffer.close()
+
+    sent = messages_sent_by(std)
+    assert [msg.content for _, msg in sent] == ['Still there?', 'Any news?', 'Hello, Prof.']
+    assert [request_id for request_id, _ in sent] == [reqs[2].id, reqs[1].id, reqs[0].id]
+    assert {msg.sender for _, msg in sent} == {'John Doe'}
+    assert [msg.content for _, msg in messages_sent_by(prof)] == ['Hi, John.']
+
+    # a renamed user shows under their new name once the cached one is dropped
+    Student.objects(id=std.id).update_one(set__first_name='Johnny')
+    raw = Request.objects(id=reqs[0].id).as_pymongo().get()['messages']
+    assert [msg['sender'] for msg in resolve_senders(raw)] == ['John Doe', 'Ada Lovelace']
+    clear_sender_cache()
+    assert [msg['sender'] for msg in resolve_senders(raw)] == ['Johnny Doe', 'Ada Lovelace']
+
+    clean_up()
+
+
+def test_unread_counts(tmp_path):
+    from actions import send_msg, mark_read
+    from models import Staff, Request
+    from messaging import unread_counts
+    from msgbuffer import MessageBuffer
+    from versioning import current_version
+
+    clean_up()
+
+    prof, std, reqs = setup_requests()
+    send_msg(sender=std, content='Hello, Prof.', request=reqs[0])
+    send_msg(sender=std, content='Are you there?', request=reqs[0])
+    send_msg(sender=std, content='Any news?', request=reqs[1])
+    send_msg(sender=prof, content='Hi, John.', request=reqs[0])
+    buffer = MessageBuffer(str(tmp_path / 'messages.db'))
+    send_msg(sender='Registrar', content='Deadline moved.', request=reqs[2], buffer=buffer)
+    assert buffer.flush() == 1
+    buffer.close()
+
+    assert unread_counts(prof) == (3, 4)
+    assert unread_counts(std) == (2, 2)
+
+    mark_read(prof, reqs[0])
+    assert unread_counts(prof) == (2, 2)
+    # reading again writes nothing
+    version = current_version(Request, reqs[0].id)
+    mark_read(prof, reqs[0])
+    assert current_version(Request, reqs[0].id) == version
+
+    with pytest.raises(DoesNotExist):
+        mark_read(std, Request(id=prof.id))
+    with pytest.raises(RuntimeError):
+        unread_counts(Staff())
+
+    clean_up()
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_migrate_link_collections():
+    from migrations import migrate_link_collections
+    from models import Student, Instructor, Course
+
+    clean_up()
+
+    prof = Instructor(first_name='Joe', last_name='Biden', email='joe@biden.com', password='pwd').save()
+    mentor = Instructor(first_name='Kamala', last_name='Harris', email='kamala@harris.com', password='pwd').save()
+    john = Student(first_name='John', last_name='Doe', email='john@doe.com', password='pwd', gender='M').save()
+    jane = Student(first_name='Jane', last_name='Doe', email='jane@doe.com', password='pwd', gender='F').save()
+    # documents in their pre-migration shape
+    Course._get_collection().insert_one({
+        'code': 'PL999', 'start_date': datetime(2020, 1, 1), 'professor': prof.id,
+        'mentors': [mentor.id], 'students': [john.id, jane.id],
+    })
+    Instructor._get_collection().update_one({'_id': prof.id}, {'$set': {'requests_received': []}})
+
+    assert migrate_link_collections(batch_size=1) == 1
+    course = Course.objects(code='PL999').get()
+    assert list(course.mentors) == [mentor]
+    assert set(course.students) == {john, jane}
+    assert 'requests_received' not in Instructor._get_collection().find_one({'_id': prof.id})
+    # re-running is a no-op
+    assert migrate_link_collections() == 0
+    assert len(course.students) == 2
+
+    clean_up()
+
+
+def test_migrate_event_sequence():
+    from bson import ObjectId
+    from migrations import migrate_event_sequence
+    from models import Event, ProjectionCheckpoint
+    from eventlog import record, run_projection, REQUEST_STATS
+
+    clean_up()
+
+    # events logged before they carried a position, and one logged since
+    subject = ObjectId()
+    Event._get_collection().insert_many([
+        {'_id': ObjectId.from_datetime(datetime(2020, 1, day)), 'type': 'signup', 'subject': subject,
+         'time': datetime(2020, 1, day), 'data': {}}
+        for day in (1, 2, 3)
+    ])
+    ProjectionCheckpoint(name='request_stats', state={'events': {'signup': 3}}).save()
+    record('signup', subject)
+
+    assert migrate_event_sequence(batch_size=2) == 3
+    assert [event.seq for event in Event.objects.order_by('id')] == [-3, -2, -1, 1]
+    assert Event.objects.order_by('id').first().date_logged == datetime(2020, 1, 1)
+    assert ProjectionCheckpoint.objects.count() == 0
+    # re-running is a no-op
+    assert migrate_event_sequence() == 0
+    assert run_projection(REQUEST_STATS, until=datetime.utcnow() + timedelta(seconds=1))['events'] == {'signup': 4}
+
+    clean_up()
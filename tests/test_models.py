@@ -1,20 +1,23 @@
 import pytest
 from datetime import date, datetime
-from mongoengine import connect
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
 from mongoengine import NotUniqueError
 from mongoengine import ValidationError
 
-# connect and initialize database
-db = connect('rcm-test-db')
-db.drop_database('rcm-test-db')
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
 
 
-def clean_up(db=db):
-    db.drop_database('rcm-test-db')
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
 
 
 def test_generic_user():
     from models import GenericUser
+
+    clean_up()
+
     GenericUser(first_name='John', last_name='Doe', email='john@doe.com', password='pwd').save()
     GenericUser(first_name='Jane', last_name='Doe', email='jane@doe.com', password='pwd', gender='F').save()
     GenericUser(first_name='James', last_name='Bond', email='james@bond.com', password='pwd', gender='M').save()
@@ -58,8 +61,7 @@ def test_instructor():
     from models import Instructor
     Instructor(first_name='Joe', last_name='Biden', email='joe@biden.com', password='pwd', gender='M',
                courses=[]).save()
-    Instructor(first_name='Kamala', last_name='Harris', email='kamala@harris.com', password='pwd', gender='F',
-               requests_received=[]).save()
+    Instructor(first_name='Kamala', last_name='Harris', email='kamala@harris.com', password='pwd', gender='F').save()
     Instructor(first_name='Nancy', last_name='Pelosi', email='nancy@pelosi.com', password='pwd').save()
     # TODO add a nonempty `request_received` test case
     pass
@@ -87,6 +89,7 @@ def test_staff():
 
 def test_course():
     from models import Course, Instructor, Staff, Student
+    from models import CourseMentorship, CourseEnrollment
     today = date.today()
 
     # instructors
@@ -111,13 +114,29 @@ def test_course():
     # w/o mentors, coordinator, and students
     Course(code='PL101', course_name='Introduction to Politics', professor=joe).save()
     # w/ single mentor; w/o coordinator and students
-    Course(code='PL102', course_name='Intermediate Politics', professor=joe, mentors=[kamala]).save()
+    pl102 = Course(code='PL102', course_name='Intermediate Politics', professor=joe).save()
+    CourseMentorship(course=pl102, mentor=kamala).save()
+    assert list(pl102.mentors) == [kamala]
+    assert len(pl102.students) == 0
     # w/ mentors and coordinator; w/o students
-    Course(code='CS101', course_name='Introduction to Computer Science',
-           professor=tony, mentors=[pepper, morgan], coordinator=james).save()
+    cs101 = Course(code='CS101', course_name='Introduction to Computer Science',
+                   professor=tony, coordinator=james).save()
+    CourseMentorship(course=cs101, mentor=pepper).save()
+    CourseMentorship(course=cs101, mentor=morgan).save()
     # w/ mentors, coordinator, and students
-    Course(code='CS103', course_name='Advanced Computer Science',
-           professor=tony, mentors=[pepper, morgan], coordinator=eve, students=[john, jane]).save()
+    cs103 = Course(code='CS103', course_name='Advanced Computer Science', professor=tony, coordinator=eve).save()
+    CourseMentorship(course=cs103, mentor=pepper).save()
+    CourseMentorship(course=cs103, mentor=morgan).save()
+    CourseEnrollment(course=cs103, student=john).save()
+    CourseEnrollment(course=cs103, student=jane).save()
+    assert set(cs103.mentors) == {pepper, morgan}
+    assert set(cs103.students) == {john, jane}
+
+    # duplicate links
+    with pytest.raises(NotUniqueError):
+        CourseMentorship(course=cs103, mentor=pepper).save()
+    with pytest.raises(NotUniqueError):
+        CourseEnrollment(course=cs103, student=john).save()
 
     # w/o professor
     with pytest.raises(ValidationError):
@@ -126,6 +145,13 @@ def test_course():
     with pytest.raises(NotUniqueError):
         Course(code='CS103', course_name='Computational Science', professor=tony).save()
 
+    # links are removed with the student or the course
+    john.delete()
+    assert set(cs103.students) == {jane}
+    cs103.delete()
+    assert CourseEnrollment.objects.count() == 0
+    assert CourseMentorship.objects(mentor=pepper).count() == 1
+
     clean_up()
 
 
@@ -221,6 +247,7 @@ def test_request():
 def test_message():
     from models import Message
     from models import Student, Instructor
+    from messaging import resolve_senders
 
     # datetime
     now = datetime.utcnow
@@ -228,14 +255,15 @@ def test_message():
     joe = Instructor(first_name='Joe', last_name='Biden', email='joe@biden.com', password='pwd').save()
     john = Student(first_name='John', last_name='Doe', email='john@doe.com', password='pwd', gender='M').save()
 
-    # from student
+    # from student: stored by id and role, the name is looked up when read
     msg = Message(sender=john, content="Hello, Joe!", time=now())
     msg.validate()
-    assert msg.sender == 'John Doe'
+    assert (msg.sender, msg.sender_id, msg.sender_role) == ('', john.id, 'Student')
     # from instructor
-    msg = Message(sender=joe, content="Hello, John!", time=now())
-    msg.validate()
-    assert msg.sender == 'Joe Biden'
+    reply = Message(sender=joe, content="Hello, John!", time=now())
+    reply.validate()
+    assert (reply.sender, reply.sender_id, reply.sender_role) == ('', joe.id, 'Instructor')
+    assert [m.sender for m in resolve_senders([msg, reply])] == ['John Doe', 'Joe Biden']
     # custom sender_name
     msg = Message(sender='US President', content="Hello, John!", time=now())
     msg.validate()
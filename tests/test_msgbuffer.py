@@ -0,0 +1,120 @@
+import time
+import pytest
+from datetime import date, datetime, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import ValidationError
+from pymongo.errors import AutoReconnect
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_request():
+    from actions import signup, new_course, set_letter_quota, make_request
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=2)
+    req1 = make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                        deadline=today)
+    req2 = make_request(student=std, instructor=prof, course=cs101, school_applied='MIT', program_applied='CS',
+                        deadline=today)
+    return prof, std, req1, req2
+
+
+def test_buffered_send_msg(tmp_path):
+    from actions import send_msg
+    from models import Event
+    from eventlog import EVENT_MESSAGE_SENT
+    from msgbuffer import MessageBuffer
+
+    clean_up()
+
+    prof, std, req1, req2 = setup_request()
+    buffer = MessageBuffer(str(tmp_path / 'messages.db'))
+    t0 = datetime.utcnow().replace(microsecond=0)
+
+    send_msg(sender=std, content='Hello, Prof.', request=req1, time=t0, buffer=buffer)
+    send_msg(sender=prof, content='Hi, John.', request=req1, time=t0 + timedelta(seconds=2), buffer=buffer)
+    # arrives late but was sent earlier
+    send_msg(sender=std, content='Are you there?', request=req1, time=t0 + timedelta(seconds=1), buffer=buffer)
+    send_msg(sender='Anonymous', content='Hello, there.', request=req2, time=t0, buffer=buffer)
+    with pytest.raises(ValidationError):
+        send_msg(sender=std, content='a' * 501, request=req1, buffer=buffer)
+
+    # nothing written yet, but senders read their own writes
+    req1.reload()
+    assert len(req1.messages) == 0
+    contents = ['Hello, Prof.', 'Are you there?', 'Hi, John.']
+    assert [msg.content for msg in buffer.messages(req1)] == contents
+    assert buffer.pending(req1)[0].sender == 'John Doe'
+
+    # messages are logged when flushed
+    assert Event.objects(type=EVENT_MESSAGE_SENT).count() == 0
+    assert buffer.flush() == 4
+    assert buffer.flush() == 0
+    assert Event.objects(type=EVENT_MESSAGE_SENT, subject=req1.id).count() == 3
+    assert Event.objects(type=EVENT_MESSAGE_SENT, subject=req2.id).get().data['sender'] == 'Anonymous'
+    req1.reload()
+    req2.reload()
+    assert [msg.content for msg in req1.messages] == contents
+    assert [msg.content for msg in req2.messages] == ['Hello, there.']
+    assert [msg.content for msg in buffer.messages(req1)] == contents
+
+    # messages are stored in the order they are written, and read in the order they were sent
+    send_msg(sender=std, content='One more thing.', request=req1, time=t0 + timedelta(seconds=3), buffer=buffer)
+    send_msg(sender=prof, content='Welcome.', request=req1, time=t0 + timedelta(seconds=4))
+    buffer.flush()
+    req1.reload()
+    assert [msg.content for msg in req1.messages] == contents + ['Welcome.', 'One more thing.']
+    assert [msg.content for msg in buffer.messages(req1)] == contents + ['One more thing.', 'Welcome.']
+
+    buffer.close()
+    clean_up()
+
+
+def test_buffer_durability_and_periodic_flush(tmp_path):
+    from actions import send_msg
+    from msgbuffer import MessageBuffer
+
+    clean_up()
+
+    prof, std, req1, req2 = setup_request()
+    path = str(tmp_path / 'messages.db')
+
+    # queued messages survive a restart of the buffer
+    buffer = MessageBuffer(path)
+    send_msg(sender=std, content='Hello, Prof.', request=req1, buffer=buffer)
+    buffer._db.close()
+    buffer = MessageBuffer(path)
+    assert len(buffer.pending(req1)) == 1
+
+    # a failing flush is retried by the next one
+    flush = buffer.flush
+    failures = []
+
+    def failing_flush():
+        if not failures:
+            failures.append(True)
+            raise AutoReconnect('primary stepped down')
+        return flush()
+
+    buffer.flush = failing_flush
+    buffer.start(interval=0.05)
+    send_msg(sender=std, content='Hello, again.', request=req1, buffer=buffer)
+    time.sleep(0.5)
+    assert failures == [True]
+    assert buffer.pending(req1) == []
+    req1.reload()
+    assert [msg.content for msg in req1.messages] == ['Hello, Prof.', 'Hello, again.']
+
+    buffer.close()
+    clean_up()
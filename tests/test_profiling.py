@@ -0,0 +1,106 @@
+import base64
+import threading
+import time
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_profiled():
+    import profiling
+    from profiling import profiled
+
+    @profiled
+    def inner():
+        time.sleep(0.02)
+        return [0] * 100000
+
+    @profiled
+    def outer():
+        return len(inner())
+
+    # a plain call while disabled
+    assert outer() == 100000
+    assert profiling.action_stats() == {}
+
+    profiling.enable(interval=0.001)
+    try:
+        profiling.reset()
+        assert outer() == 100000
+        outer()
+        stats = profiling.action_stats()
+        # nested actions are accounted to the outermost one
+        assert list(stats) == ['outer']
+        assert stats['outer']['calls'] == 2
+        assert stats['outer']['seconds'] >= 0.04
+        assert stats['outer']['peak_memory'] >= 800000
+        stacks = profiling.collapsed_stacks().splitlines()
+        assert stacks
+        assert all(line.startswith('outer;outer (test_profiling.py:') for line in stacks)
+        assert any(';inner (test_profiling.py:' in line for line in stacks)
+        assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in stacks)
+
+        # overlapping calls in two threads: the process-wide peak can't be split between them, memory isn't recorded
+        profiling.reset()
+        barrier = threading.Barrier(2)
+
+        @profiled
+        def overlapping():
+            barrier.wait()
+            result = [0] * 100000
+            barrier.wait()
+            return result
+
+        threads = [threading.Thread(target=overlapping) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = profiling.action_stats()['overlapping']
+        assert (stats['calls'], stats['peak_memory'], stats['allocated']) == (2, 0, 0)
+    finally:
+        profiling.disable()
+        profiling.reset()
+
+
+def test_profile_endpoints():
+    import profiling
+    from actions import signup
+    from models import Staff
+    from app import app
+
+    clean_up()
+
+    client = app.test_client()
+    staff = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    auth = {'Authorization': 'Basic ' + base64.b64encode(b'grace@hopper.com:pwd').decode()}
+    # staff with full access only
+    assert client.get('/debug/profile').status_code == 401
+    assert client.get('/debug/profile/stats', headers=auth).status_code == 403
+    staff.update(set__full_access=True)
+    assert client.get('/debug/profile', headers=auth).status_code == 404
+
+    profiling.enable()
+    try:
+        # public actions are profiled
+        assert signup.__wrapped__
+        profiling.reset()
+        try:
+            signup(object, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe')
+        except RuntimeError:
+            pass
+        assert client.get('/debug/profile/stats', headers=auth).get_json()['signup']['calls'] == 1
+        response = client.get('/debug/profile', headers=auth)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+    finally:
+        profiling.disable()
+        profiling.reset()
+
+    clean_up()
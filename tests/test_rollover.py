@@ -0,0 +1,111 @@
+import pytest
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import NotUniqueError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_rollover_courses():
+    from actions import signup, new_course, set_letter_quota, make_request, assign_course_mentor
+    from actions import set_course_coordinator, grant_access
+    from models import Student, Instructor, Staff, Course, CourseMentorship
+    from rollover import rollover_courses
+
+    clean_up()
+
+    fall, spring = date(2020, 9, 1), date(2021, 1, 15)
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    mentor = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    coordinator = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    staff = signup(Staff, email='admin@uni.edu', password='pwd', first_name='Ad', last_name='Min')
+    john = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    jane = signup(Student, email='jane@uni.edu', password='pwd', first_name='Jane', last_name='Doe', gender='F')
+    cs101 = new_course(code='CS101-F20', start_date=fall, course_name='Intro to CS', professor=prof)
+    cs102 = new_course(code='CS102-F20', start_date=fall, course_name='Data Structures', professor=prof)
+    new_course(code='CS103-S21', start_date=spring, course_name='Algorithms', professor=prof)
+    assign_course_mentor(cs101, mentor)
+    set_course_coordinator(cs101, coordinator)
+    grant_access(staff, cs102)
+    set_letter_quota(student=john, recommender=prof, course=cs101, quota=3)
+    set_letter_quota(student=john, recommender=mentor, course=cs101, quota=1)
+    set_letter_quota(student=jane, recommender=prof, course=cs102, quota=2)
+    make_request(student=john, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                 deadline=fall)
+
+    renames = {cs101: 'CS101-S21', cs102: 'CS102-S21'}
+
+    # nothing is written on a dry run
+    plan = rollover_courses(renames, spring, carry_quotas=True, dry_run=True)
+    assert Course.objects.count() == 3
+    assert sorted(course.code for course in plan['courses']) == ['CS101-S21', 'CS102-S21']
+    assert len(plan['mentorships']) == 1
+    assert sorted(plan['quotas'], key=lambda q: q[3])[-1][3] == 3
+    assert len(plan['quotas']) == 3
+    assert plan['conflicts'] == []
+
+    # codes in use are refused before any write
+    with pytest.raises(NotUniqueError):
+        rollover_courses({cs101: 'CS103-S21'}, spring)
+    assert rollover_courses({cs101: 'X', cs102: 'X'}, spring, dry_run=True)['conflicts'] == ['X']
+    assert Course.objects.count() == 3
+
+    rollover_courses(renames, spring, carry_enrollment=True, carry_quotas=True)
+    new101 = Course.objects.get(code='CS101-S21')
+    new102 = Course.objects.get(code='CS102-S21')
+    assert new101.start_date == spring
+    assert new101.course_name == 'Intro to CS'
+    assert new101.professor == prof
+    assert new101.coordinator == coordinator
+    assert new101.cloned_from == cs101
+    assert list(new101.mentors) == [mentor]
+    assert sorted(s.email for s in new101.students) == ['john@uni.edu']
+    assert sorted(s.email for s in new102.students) == ['jane@uni.edu']
+
+    prof.reload()
+    mentor.reload()
+    coordinator.reload()
+    staff.reload()
+    assert new101 in prof.courses and new102 in prof.courses
+    assert new101 in mentor.courses and new102 not in mentor.courses
+    assert new101 in coordinator.accessible_courses
+    assert new102 in staff.accessible_courses and new101 not in staff.accessible_courses
+
+    # quotas are granted again at their original size
+    john.reload()
+    quotas = {(r4c.course.code, r4c.recommender.email): r4c for r4c in john.req_for_courses}
+    assert quotas['CS101-S21', 'ada@lovelace.com'].requests_quota == 3
+    assert quotas['CS101-S21', 'ada@lovelace.com'].requests_sent == []
+    assert quotas['CS101-S21', 'alan@turing.com'].requests_quota == 1
+    assert quotas['CS101-F20', 'ada@lovelace.com'].requests_quota == 2
+
+    # a rollover interrupted after its courses completes when run again, reusing them
+    CourseMentorship.objects(course=new101).delete()
+    Student.objects(id=jane.id).update_one(pull__req_for_courses__course=new102)
+    # of john's quotas in the new course, only the one from his mentor is missing
+    Student._get_collection().update_one(
+        {'_id': john.id}, {'$pull': {'req_for_courses': {'course': new101.id, 'recommender': mentor.id}}}
+    )
+    plan = rollover_courses(renames, spring, carry_enrollment=True, carry_quotas=True)
+    assert plan['conflicts'] == []
+    assert {course.id for course in plan['courses']} == {new101.id, new102.id}
+    assert Course.objects.count() == 5
+    assert list(new101.mentors) == [mentor]
+    jane.reload()
+    assert [r4c.course for r4c in jane.req_for_courses] == [cs102, new102]
+    john.reload()
+    assert len(john.req_for_courses) == 4
+    recommenders = {r4c.recommender.email for r4c in john.req_for_courses if r4c.course == new101}
+    assert recommenders == {'ada@lovelace.com', 'alan@turing.com'}
+
+    # a course that was not cloned from the original is a conflict, even when starting on the same date
+    new_course(code='CS104-S21', start_date=spring, course_name='Compilers', professor=prof)
+    assert rollover_courses({cs101: 'CS104-S21'}, spring, dry_run=True)['conflicts'] == ['CS104-S21']
+
+    clean_up()
@@ -0,0 +1,89 @@
+import os
+import time
+import pytest
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+# a local replica set, e.g. started with `mongod --replSet rs0` and `rs.initiate()`
+REPLICA_SET_URI = os.environ.get('RCM_REPLICA_SET_URI', 'mongodb://localhost:27017/?replicaSet=rs0')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def eventually(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+@pytest.fixture
+def replica_set():
+    from routing import connect_routes, disconnect_routes
+
+    try:
+        MongoClient(REPLICA_SET_URI, serverSelectionTimeoutMS=2000).admin.command('ping')
+    except ServerSelectionTimeoutError:
+        pytest.skip(f'no replica set at {REPLICA_SET_URI}')
+    connect_routes('rcm-test-db', host=REPLICA_SET_URI)
+    yield
+    disconnect_routes()
+    # restore the connection the other tests share
+    register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def test_routed_without_routes():
+    from routing import routed, ALIAS_SECONDARY, ALIAS_ANALYTICS
+    from models import Request
+
+    queryset = Request.objects(status=1000)
+    assert routed(queryset, ALIAS_SECONDARY) is queryset
+    assert routed(queryset, ALIAS_ANALYTICS) is queryset
+
+
+def test_routed_reads(replica_set):
+    from actions import signup, new_course, set_letter_quota, make_request, view_requests
+    from routing import routed, ALIAS_PRIMARY, ALIAS_SECONDARY, ALIAS_ANALYTICS, MIN_MAX_STALENESS
+    from search import search_requests
+    from export import iter_request_batches
+    from models import Instructor, Student, Staff, Request
+
+    clean_up()
+
+    queryset = Request.objects
+    assert routed(queryset, ALIAS_PRIMARY) is queryset
+    for alias in (ALIAS_SECONDARY, ALIAS_ANALYTICS):
+        read_preference = routed(queryset, alias)._collection.read_preference
+        assert isinstance(read_preference, SecondaryPreferred)
+        assert read_preference.max_staleness == MIN_MAX_STALENESS
+    assert isinstance(queryset._collection.read_preference, Primary)
+
+    # writes go to the primary; read-only entry points read the same data back through the routes
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    admin = signup(Staff, email='admin@uni.edu', password='pwd', first_name='Ad', last_name='Min')
+    admin.update(set__full_access=True)
+    admin.reload()
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=1)
+    req = make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                       deadline=today)
+    assert list(view_requests(admin, alias=ALIAS_PRIMARY)) == [req]
+    # secondaries catch up within the staleness bound
+    assert eventually(lambda: list(view_requests(admin)) == [req])
+    assert eventually(lambda: search_requests(admin, 'uc') == [req])
+    assert eventually(lambda: sum(len(batch) for batch in iter_request_batches()) == 1)
+
+    clean_up()
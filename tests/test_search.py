@@ -0,0 +1,91 @@
+import pytest
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_search_users():
+    from actions import signup, new_course, set_letter_quota
+    from search import search_users, SEARCH_TEXT
+    from models import Student, Instructor, Staff
+
+    clean_up()
+
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    john = signup(Student, email='john.doe@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    jose = signup(Student, email='jose@uni.edu', password='pwd', first_name='José', last_name='Doherty', gender='M')
+    jane = signup(Student, email='jane@uni.edu', password='pwd', first_name='Jane', last_name='Smith', gender='F')
+    admin = signup(Staff, email='admin@uni.edu', password='pwd', first_name='Ad', last_name='Min')
+    admin.update(set__full_access=True)
+    admin.reload()
+    staff = signup(Staff, email='staff@uni.edu', password='pwd', first_name='St', last_name='Aff')
+
+    # name and email prefixes, case- and accent-insensitive
+    assert search_users(admin, Student, 'do') == [john, jose]
+    assert search_users(admin, Student, 'JOS') == [jose]
+    assert search_users(admin, Student, 'john.d') == [john]
+    assert search_users(admin, Student, 'jane smi') == [jane]
+    assert search_users(admin, Instructor, 'love') == [prof]
+    assert search_users(admin, Student, '') == []
+    # pagination
+    assert search_users(admin, Student, 'uni', page=1, per_page=2) == [john, jose]
+    assert search_users(admin, Student, 'uni', page=2, per_page=2) == [jane]
+    # ranked full-text search
+    assert search_users(admin, Student, 'Doherty', mode=SEARCH_TEXT) == [jose]
+
+    # staff w/o full access only sees students of accessible courses
+    assert search_users(staff, Student, 'do') == []
+    cs101 = new_course(code='CS101', start_date=date.today(), course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=john, recommender=prof, course=cs101, quota=1)
+    staff.update(add_to_set__accessible_courses=cs101)
+    staff.reload()
+    assert search_users(staff, Student, 'do') == [john]
+
+    with pytest.raises(RuntimeError):
+        search_users(admin, Student, 'do', mode='regex')
+
+    clean_up()
+
+
+def test_search_courses_and_requests():
+    from actions import signup, new_course, set_letter_quota, make_requests, grant_access
+    from search import search_courses, search_requests
+    from models import Student, Instructor, Staff
+
+    clean_up()
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    staff = signup(Staff, email='staff@uni.edu', password='pwd', first_name='St', last_name='Aff')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to Computer Science', professor=prof)
+    cs102 = new_course(code='CS102', start_date=today, course_name='Data Structures', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=2)
+    set_letter_quota(student=std, recommender=prof, course=cs102, quota=1)
+    mit, uc = make_requests(std, prof, cs101, [('MIT', 'Computer Science', today), ('UC', 'Statistics', today)])
+    cmu, = make_requests(std, prof, cs102, [('CMU', 'Computer Engineering', today)])
+
+    # nothing is accessible yet
+    assert search_courses(staff, 'cs') == []
+    assert search_requests(staff, 'computer') == []
+
+    grant_access(staff, cs101)
+    staff.reload()
+    assert search_courses(staff, 'cs') == [cs101]
+    assert search_courses(staff, 'comp sci') == [cs101]
+    assert search_requests(staff, 'computer') == [mit]
+    assert search_requests(staff, 'stat') == [uc]
+
+    grant_access(staff, cs102)
+    staff.reload()
+    assert search_courses(staff, 'cs') == [cs101, cs102]
+    assert set(search_requests(staff, 'computer')) == {mit, cmu}
+
+    clean_up()
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cumulative import time budgets, in microseconds, about 1.75 times the time measured (app 285000, actions 190000),
+# so that a regression shows; most of it is pymongo and mongoengine
+IMPORT_BUDGETS_US = {
+    'app': 500000,
+    'actions': 350000,
+}
+
+# modules a worker should not load until they are used
+LAZY_MODULES = ['passlib', 'pyarrow']
+
+
+def import_times(module):
+    # cumulative import time of every module loaded by `import module` in a fresh interpreter, from `-X importtime`
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_budgets(record_property):
+    for module, budget in IMPORT_BUDGETS_US.items():
+        times = import_times(module)
+        # tracked alongside the test results, e.g. in the junit xml
+        record_property(f'import_{module}_us', times[module])
+        assert times[module] <= budget
+        assert not [name for name in times if name.split('.')[0] in LAZY_MODULES]
+
+
+def test_deferred_connection():
+    # registering the routes must not create any client
+    code = (
+        'from mongoengine.connection import _connections\n'
+        'from routing import connect_routes\n'
+        'import actions\n'
+        "connect_routes('rcm-test-db', host='mongodb://localhost:1', serverSelectionTimeoutMS=100)\n"
+        'assert not _connections, _connections\n'
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
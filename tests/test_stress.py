@@ -0,0 +1,40 @@
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def test_stress_quota():
+    from actions import signup, new_course, set_letter_quota
+    from models import Student, Instructor
+    from stress import stress_quota, check_quota, MAKE, WITHDRAW
+
+    clean_up()
+
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=date.today(), course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5)
+
+    # without resets, remaining and sent add up to the quota granted
+    reports = stress_quota(std, prof, cs101, 'rcm-test-db', workers=(1, 4), operations=30, quota=5,
+                           mix={MAKE: 0.7, WITHDRAW: 0.3})
+    assert [report['workers'] for report in reports] == [1, 4]
+    for report in reports:
+        assert report['violations'] == []
+        assert report['operations'] == report['outcomes'][MAKE] + report['outcomes'].get(WITHDRAW, 0)
+        assert 0 <= report['conflict_rate'] <= 1
+    # four workers making requests more often than withdrawing them exhaust a quota of 5
+    assert reports[1]['outcomes']['refused'] > 0
+
+    reports = stress_quota(std, prof, cs101, 'rcm-test-db', workers=(4,), operations=30, quota=5)
+    assert reports[0]['violations'] == []
+    assert check_quota(std, prof, cs101) == []
+
+    clean_up()
@@ -0,0 +1,81 @@
+import pytest
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import NotUniqueError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_tenant(tenant):
+    from actions import signup, new_course, set_letter_quota, make_request
+    from models import Student, Instructor
+    from tenancy import tenant_scope
+
+    today = date.today()
+    with tenant_scope(tenant):
+        prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+        std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+        cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+        set_letter_quota(student=std, recommender=prof, course=cs101, quota=1)
+        req = make_request(student=std, instructor=prof, course=cs101, school_applied=tenant, program_applied='CS',
+                           deadline=today)
+    return prof, std, cs101, req
+
+
+def test_tenant_isolation():
+    from actions import signup, view_requests
+    from models import Student, Instructor, Staff, Course, CourseEnrollment, Request
+    from tenancy import tenant_scope, current_tenant
+
+    clean_up()
+
+    # the same emails and course codes in two tenants
+    prof_a, std_a, cs101_a, req_a = setup_tenant('physics')
+    prof_b, std_b, cs101_b, req_b = setup_tenant('math')
+    assert current_tenant() is None
+    assert (prof_a.tenant, std_a.tenant, cs101_a.tenant, req_a.tenant) == ('physics',) * 4
+    assert CourseEnrollment.objects(course=cs101_b).get().tenant == 'math'
+
+    # but unique within a tenant
+    with tenant_scope('math'):
+        with pytest.raises(NotUniqueError):
+            Course(code='CS101', start_date=date.today(), course_name='Again', professor=prof_b).save()
+
+    # scoped queries only see their tenant
+    with tenant_scope('physics'):
+        admin = signup(Staff, email='admin@uni.edu', password='pwd', first_name='Ad', last_name='Min')
+        admin.update(full_access=True)
+        admin.reload()
+        assert Student.objects.count() == 1
+        assert Instructor.objects.get(email='ada@lovelace.com') == prof_a
+        assert Course.objects.get(code='CS101') == cs101_a
+        assert [req.school_applied for req in view_requests(admin)] == ['physics']
+        assert list(prof_a.requests_received) == [req_a]
+        assert list(cs101_a.students) == [std_a]
+        assert Request.objects(id=req_b.id).first() is None
+
+    # unscoped queries see every tenant
+    assert Student.objects(email='john@uni.edu').count() == 2
+    assert Request.objects.count() == 2
+
+    clean_up()
+
+
+def test_unique_indexes_lead_with_shard_key():
+    from mongoengine import Document
+    import models
+
+    # MongoDB only enforces a unique index on a sharded collection when the index starts with the shard key
+    for document in vars(models).values():
+        if not isinstance(document, type) or not issubclass(document, Document) or document._meta.get('abstract'):
+            continue
+        shard_key = ['_id' if field == 'id' else field for field in document._meta.get('shard_key', ())]
+        for spec in document._meta['index_specs']:
+            if spec.get('unique') and shard_key:
+                assert [field for field, _ in spec['fields']][:len(shard_key)] == shard_key, document.__name__
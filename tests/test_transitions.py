@@ -0,0 +1,108 @@
+import pytest
+from datetime import date, timedelta
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine import DoesNotExist
+from models import STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED, STATUS_FULFILLED
+from err import ActionError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_requests(n):
+    from actions import signup, new_course, set_letter_quota, make_requests
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    cs102 = new_course(code='CS102', start_date=today, course_name='Data Structures', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=n)
+    set_letter_quota(student=std, recommender=prof, course=cs102, quota=1)
+    reqs = make_requests(std, prof, cs101, [(f'School{i}', 'CS', today) for i in range(n)])
+    other, = make_requests(std, prof, cs102, [('MIT', 'CS', today)])
+    return prof, std, cs101, reqs, other
+
+
+def test_transition():
+    from transitions import transition, _sync_summaries, EVENT_EMAIL, EVENT_FULFILL, EVENT_UNFULFILL
+    from models import Instructor
+
+    clean_up()
+
+    prof, std, cs101, (req,), _ = setup_requests(1)
+    stranger = Instructor(first_name='Alan', last_name='Turing', email='alan@turing.com', password='pwd').save()
+
+    transition(req, EVENT_EMAIL, instructor=prof).reload()
+    assert req.status == STATUS_EMAILED
+    # emailing twice is illegal, and so is revoking a fulfillment not granted
+    with pytest.raises(ActionError):
+        transition(req, EVENT_EMAIL, instructor=prof)
+    with pytest.raises(ActionError):
+        transition(req, EVENT_UNFULFILL, instructor=prof)
+    # only the instructor of the request may transition it
+    with pytest.raises(DoesNotExist):
+        transition(req, EVENT_FULFILL, instructor=stranger)
+
+    tomorrow = date.today() + timedelta(days=1)
+    transition(req, EVENT_FULFILL, instructor=prof, when=tomorrow).reload()
+    assert req.status == STATUS_FULFILLED
+    assert req.date_fulfilled == tomorrow
+    std.reload()
+    assert std.request_summaries.get().status == STATUS_FULFILLED
+
+    transition(req, EVENT_UNFULFILL).reload()
+    assert req.status == STATUS_UNFULFILLED
+    assert req.date_fulfilled is None
+    # a summary only moves forward: syncing the status of an earlier version, as a transition that lost a race
+    # would, leaves it as is
+    _sync_summaries({req.id: (STATUS_FULFILLED, req.version - 1)})
+    std.reload()
+    assert (std.request_summaries.get().status, std.request_summaries.get().version) == (STATUS_UNFULFILLED,
+                                                                                         req.version)
+    with pytest.raises(ActionError):
+        transition(req, EVENT_EMAIL)
+    with pytest.raises(RuntimeError):
+        transition(req, 'archive')
+
+    clean_up()
+
+
+def test_transition_many():
+    from transitions import transition, transition_many, EVENT_EMAIL, EVENT_FULFILL
+    from models import Request
+
+    clean_up()
+
+    prof, std, cs101, reqs, other = setup_requests(5)
+    transition(reqs[0], EVENT_FULFILL)
+
+    # every request of the course that can be emailed, in one update
+    assert transition_many(EVENT_EMAIL, course=cs101) == 4
+    statuses = {req.id: req.status for req in Request.objects}
+    assert statuses[reqs[0].id] == STATUS_FULFILLED
+    assert [statuses[req.id] for req in reqs[1:]] == [STATUS_EMAILED] * 4
+    assert statuses[other.id] == STATUS_REQUESTED
+    std.reload()
+    prof.reload()
+    for user in (std, prof):
+        assert {summary.request.id: summary.status for summary in user.request_summaries} == statuses
+
+    assert transition_many(EVENT_FULFILL, course=cs101) == 4
+    assert Request.objects(course=cs101, status=STATUS_FULFILLED, date_fulfilled=date.today()).count() == 5
+    assert transition_many(EVENT_FULFILL, course=cs101) == 0
+
+    clean_up()
+
+
+def test_sync_no_summaries():
+    from transitions import _sync_summaries
+
+    # every matched request was withdrawn between the read and the update
+    _sync_summaries({})
@@ -0,0 +1,84 @@
+import pytest
+from datetime import datetime
+from bson import ObjectId
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from pymongo.errors import WriteError
+from models import STATUS_REQUESTED, STATUS_FULFILLED
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def raw_request(**fields):
+    now = datetime.utcnow()
+    raw = dict(student=ObjectId(), instructor=ObjectId(), course=ObjectId(), school_applied='Harvard',
+               program_applied='Politics', deadline=now, date_created=now, date_updated=now, status=STATUS_REQUESTED,
+               messages=[dict(sender='John Doe', content='Hello, Joe!', time=now)])
+    raw.update(fields)
+    return {key: value for key, value in raw.items() if value is not None}
+
+
+def test_validate_many():
+    from validation import validate_many
+    from models import Request, Student
+
+    raws = [
+        raw_request(),
+        raw_request(school_applied='Harvard' * 10),
+        raw_request(status=1234),
+        raw_request(status=STATUS_FULFILLED),
+        raw_request(status=STATUS_FULFILLED, date_fulfilled=datetime.utcnow()),
+        raw_request(date_fulfilled=datetime.utcnow()),
+        raw_request(deadline=None),
+        raw_request(student='john'),
+        raw_request(messages=[dict(sender='John Doe', content='a' * 501, time=datetime.utcnow())]),
+    ]
+    errors = validate_many(Request, raws)
+    assert sorted(errors) == [1, 2, 3, 5, 6, 7, 8]
+    assert list(errors[1]) == ['school_applied']
+    assert list(errors[2]) == ['status']
+    assert list(errors[6]) == ['deadline']
+    assert list(errors[8]) == ['messages']
+
+    errors = validate_many(Student, [
+        dict(email='john@doe.com', password='pwd', first_name='John', last_name='Doe', gender='M'),
+        dict(email='john@', password='pwd', first_name='John', last_name='Doe', gender='N'),
+        dict(email='john@doe.com', password='pwd', first_name='John', last_name='Doe', req_for_courses=[
+            dict(course=ObjectId(), recommender=ObjectId(), requests_quota=-1),
+        ]),
+    ])
+    assert sorted(errors) == [1, 2]
+    assert sorted(errors[1]) == ['email', 'gender']
+    assert sorted(errors[2]) == ['gender', 'req_for_courses']
+
+
+def test_apply_json_schema():
+    from validation import apply_json_schema
+    from models import Request
+
+    clean_up()
+
+    apply_json_schema(Request)
+    collection = Request._get_collection()
+    collection.insert_one(raw_request())
+    collection.insert_one(raw_request(status=STATUS_FULFILLED, date_fulfilled=datetime.utcnow()))
+    for raw in [
+        raw_request(school_applied='Harvard' * 10),
+        raw_request(status=1234),
+        raw_request(status=STATUS_FULFILLED),
+        raw_request(date_fulfilled=datetime.utcnow()),
+        raw_request(deadline=None),
+    ]:
+        with pytest.raises(WriteError):
+            collection.insert_one(raw)
+    assert collection.count_documents({}) == 2
+
+    # re-applying to an existing collection
+    apply_json_schema(Request)
+
+    clean_up()
@@ -0,0 +1,156 @@
+import base64
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from mongoengine import register_connection
+from mongoengine.connection import get_connection, DEFAULT_CONNECTION_NAME
+from mongoengine.errors import SaveConditionError
+
+# register the database; the client is only created by the first query
+register_connection(DEFAULT_CONNECTION_NAME, 'rcm-test-db')
+
+
+def clean_up():
+    get_connection().drop_database('rcm-test-db')
+
+
+def setup_request():
+    from actions import signup, new_course, set_letter_quota, make_request
+    from models import Student, Instructor
+
+    today = date.today()
+    prof = signup(Instructor, email='ada@lovelace.com', password='pwd', first_name='Ada', last_name='Lovelace')
+    std = signup(Student, email='john@uni.edu', password='pwd', first_name='John', last_name='Doe', gender='M')
+    cs101 = new_course(code='CS101', start_date=today, course_name='Intro to CS', professor=prof)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5)
+    req = make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                       deadline=today)
+    return prof, std, cs101, req
+
+
+def test_versions():
+    from actions import set_course_coordinator, signup, send_msg, fulfill_request, set_letter_quota
+    from actions import assign_course_mentor, withdraw_course_mentor
+    from models import Staff, Student, Instructor, Course, Request
+    from versioning import current_version, has_changed, update_if_version
+
+    clean_up()
+
+    prof, std, cs101, req = setup_request()
+    assert req.version == 0
+    assert cs101.version == 0
+    # the quota, then its reservation by the request
+    assert current_version(Student, std.id) == 2
+
+    # the enrollment of the student
+    assert current_version(Course, cs101.id) == 1
+    coordinator = signup(Staff, email='grace@hopper.com', password='pwd', first_name='Grace', last_name='Hopper')
+    set_course_coordinator(cs101, coordinator)
+    assert has_changed(cs101)
+    assert current_version(Course, cs101.id) == 2
+    # so do its mentors, and enrolling the student again changes nothing
+    mentor = signup(Instructor, email='alan@turing.com', password='pwd', first_name='Alan', last_name='Turing')
+    assign_course_mentor(cs101, mentor)
+    assert current_version(Course, cs101.id) == 3
+    withdraw_course_mentor(cs101, mentor)
+    assert current_version(Course, cs101.id) == 4
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=5, reset=True)
+    assert current_version(Course, cs101.id) == 4
+
+    send_msg(sender=std, content='Hello, Prof.', request=req)
+    fulfill_request(prof, req)
+    assert current_version(Request, req.id) == 2
+    req.reload()
+    assert not has_changed(req)
+
+    # compare-and-swap
+    update_if_version(req, 2, set__school_applied='MIT')
+    with pytest.raises(SaveConditionError):
+        update_if_version(req, 2, set__school_applied='CMU')
+    assert Request.objects.get(id=req.id).school_applied == 'MIT'
+    # a raw update gets its increment without it being added to the caller's dict
+    raw = {'$set': {'program_applied': 'EE'}, '$inc': {'student_unread': 1}}
+    Request.objects(id=req.id).update_one(__raw__=raw)
+    assert raw == {'$set': {'program_applied': 'EE'}, '$inc': {'student_unread': 1}}
+    assert current_version(Request, req.id) == 4
+
+    # documents written before versioning have no version, and match version 0
+    legacy = Request.objects.get(id=req.id)
+    Request._get_collection().update_one({'_id': req.id}, {'$unset': {'version': ''}})
+    legacy.reload()
+    assert legacy.version == 0
+    update_if_version(legacy, 0, set__school_applied='CMU')
+    assert current_version(Request, req.id) == 1
+
+    # actions saving a stale student re-read it rather than overwriting the writes made meanwhile
+    stale = Student.objects.get(id=std.id)
+    set_letter_quota(student=std, recommender=prof, course=cs101, quota=1, reset=True)
+    set_letter_quota(student=stale, recommender=prof, course=cs101, quota=3, reset=True)
+    std.reload()
+    assert std.req_for_courses[0].requests_quota == 3
+    assert len(std.req_for_courses[0].requests_sent) == 1
+
+    clean_up()
+
+
+def test_concurrent_quota_resets():
+    from actions import set_letter_quota, withdraw_request, make_request
+    from models import Student
+
+    clean_up()
+
+    prof, std, cs101, req = setup_request()
+    today = date.today()
+    reqs = [make_request(student=std, instructor=prof, course=cs101, school_applied='UC', program_applied='CS',
+                         deadline=today) for _ in range(3)]
+
+    def reset(quota):
+        set_letter_quota(student=Student.objects.get(id=std.id), recommender=prof, course=cs101, quota=quota,
+                         reset=True)
+
+    def withdraw(request):
+        withdraw_request(Student.objects.get(id=std.id), request)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(withdraw, reqs))
+        list(pool.map(reset, [7] * 8))
+
+    # no withdrawal is lost to a concurrent save
+    std.reload()
+    assert [r.id for r in std.req_for_courses[0].requests_sent] == [req.id]
+    assert std.req_for_courses[0].requests_quota == 7
+
+    clean_up()
+
+
+def test_request_endpoint():
+    from app import app
+    from actions import send_msg
+
+    clean_up()
+
+    prof, std, cs101, req = setup_request()
+    client = app.test_client()
+
+    def auth(email, **headers):
+        return {'Authorization': 'Basic ' + base64.b64encode(f'{email}:pwd'.encode()).decode(), **headers}
+
+    url = f'/requests/{req.id}'
+    response = client.get(url, headers=auth('john@uni.edu'))
+    assert response.status_code == 200
+    assert response.json['school_applied'] == 'UC'
+    assert 'search_keys' not in response.json
+    etag = response.headers['ETag']
+    assert etag == '"0"'
+    assert client.get(url, headers=auth('ada@lovelace.com', **{'If-None-Match': etag})).status_code == 304
+
+    send_msg(sender=std, content='Hello, Prof.', request=req)
+    response = client.get(url, headers=auth('ada@lovelace.com', **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"1"'
+    assert len(response.json['messages']) == 1
+
+    assert client.get(url).status_code == 401
+    assert client.get('/requests/nonsense', headers=auth('john@uni.edu')).status_code == 404
+
+    clean_up()
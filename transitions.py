@@ -0,0 +1,124 @@
+from collections import namedtuple
+from datetime import date
+from models import Student, Instructor, Letter, Request
+from models import STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED, STATUS_FULFILLED
+from mongoengine import DoesNotExist
+from pymongo import UpdateOne
+from tenancy import tenant_filter
+from versioning import bump
+from letters import discard_letter
+from eventlog import record_many
+from eventlog import EVENT_REQUEST_EMAILED, EVENT_REQUEST_FULFILLED, EVENT_REQUEST_UNFULFILLED
+from err import ActionError
+
+Transition = namedtuple('Transition', ['sources', 'target'])
+
+EVENT_EMAIL = 'email'
+EVENT_FULFILL = 'fulfill'
+EVENT_UNFULFILL = 'unfulfill'
+
+# the `Request` life cycle: REQUESTED -> EMAILED -> FULFILLED -> UNFULFILLED, where a request may also be fulfilled
+# before being emailed, and fulfillment may be revoked and granted again later
+TRANSITIONS = {
+    EVENT_EMAIL: Transition(frozenset([STATUS_REQUESTED]), STATUS_EMAILED),
+    EVENT_FULFILL: Transition(frozenset([STATUS_REQUESTED, STATUS_EMAILED, STATUS_UNFULFILLED]), STATUS_FULFILLED),
+    EVENT_UNFULFILL: Transition(frozenset([STATUS_FULFILLED]), STATUS_UNFULFILLED),
+}
+
+# the event logged for each request moved by `transition_many`; the actions log their single transitions
+LOGGED_EVENTS = {
+    EVENT_EMAIL: EVENT_REQUEST_EMAILED,
+    EVENT_FULFILL: EVENT_REQUEST_FULFILLED,
+    EVENT_UNFULFILL: EVENT_REQUEST_UNFULFILLED,
+}
+
+
+def transition(request, event, instructor=None, when=None, **fields):
+    # apply `event` to `request` with one conditional update on its current status (and on `instructor`, if given),
+    # which also sets `fields`. A request leaving the fulfilled status releases its letter
+    sources, target = _lookup(event)
+    scope = {'instructor': instructor} if instructor is not None else {}
+    update = dict(_update(target, when), **{f'set__{name}': value for name, value in fields.items()})
+    previous = Request.objects(id=request.id, status__in=list(sources), **scope).only('version', 'letter').modify(
+        **update)
+    if previous is None:
+        current = Request.objects(id=request.id, **scope).only('status').as_pymongo().first()
+        if current is None:
+            raise DoesNotExist(f'{request} has not been received by {instructor} or has been revoked')
+        raise ActionError(f'{request} cannot {event} from status {current["status"]}')
+    _sync_summaries({request.id: (target, previous.version + 1)})
+    letter = previous._data.get('letter')
+    if letter is not None and target != STATUS_FULFILLED:
+        discard_letter(Letter(id=letter.id))
+    return request
+
+
+def transition_many(event, when=None, **query):
+    # apply `event` to every request matching `query` (e.g. `course=course`) whose status allows it, with one
+    # `update_many`, except for the requests whose letter the event releases, which `transition` one at a time;
+    # returns the number of requests transitioned
+    sources, target = _lookup(event)
+    releases = target != STATUS_FULFILLED
+    ids = []
+    moved = []
+    for raw in Request.objects(status__in=list(sources), **query).only('letter').as_pymongo():
+        if releases and raw.get('letter') is not None:
+            try:
+                transition(Request(id=raw['_id']), event, when=when)
+                moved.append(raw['_id'])
+            except (DoesNotExist, ActionError):
+                pass
+        else:
+            ids.append(raw['_id'])
+    updated = len(moved)
+    if ids:
+        # a request given a letter meanwhile is left for a later call
+        guard = {'letter__exists': False} if releases else {}
+        updated += Request.objects(id__in=ids, status__in=list(sources), **guard).update(**_update(target, when))
+        # the statuses as they are now, since concurrent transitions may have moved some of `ids` meanwhile
+        statuses = {
+            raw['_id']: (raw['status'], raw.get('version', 0))
+            for raw in Request.objects(id__in=ids).only('status', 'version').as_pymongo()
+        }
+        _sync_summaries(statuses)
+        moved += [_id for _id, (status, _) in statuses.items() if status == target]
+    record_many(LOGGED_EVENTS[event], moved, status=target)
+    return updated
+
+
+def _lookup(event):
+    if event not in TRANSITIONS:
+        raise RuntimeError(f"Unknown event: {event}")
+    return TRANSITIONS[event]
+
+
+def _update(target, when):
+    # `date_fulfilled` is set exactly when the request is fulfilled, as required by `Request.clean`, and so is
+    # `letter`
+    update = {'set__status': target, 'set__date_updated': date.today()}
+    if target == STATUS_FULFILLED:
+        update['set__date_fulfilled'] = when or date.today()
+    else:
+        update['unset__date_fulfilled'] = True
+        update['unset__letter'] = True
+    return update
+
+
+def _sync_summaries(statuses):
+    # copy the new status of each request of `statuses`, a {request id: (status, version)} mapping, into the
+    # summaries held by students and instructors. A summary only moves to a later version of its request, so that of
+    # two concurrent transitions the later one wins whichever syncs last. Requests withdrawn meanwhile leave nothing
+    # to sync, and `bulk_write` refuses an empty batch
+    if not statuses:
+        return
+    for document in (Student, Instructor):
+        document._get_collection().bulk_write([
+            UpdateOne(
+                {"request_summaries": {"$elemMatch": {"request": _id, "version": {"$not": {"$gte": version}}}},
+                 **tenant_filter()},
+                bump(document, {"$set": {"request_summaries.$[summary].status": status,
+                                         "request_summaries.$[summary].version": version}}),
+                array_filters=[{"summary.request": _id}],
+            )
+            for _id, (status, version) in statuses.items()
+        ], ordered=False)
@@ -0,0 +1,243 @@
+import functools
+from datetime import datetime
+from bson import ObjectId
+from models import Request
+from models import REQUEST_STATUSES, STATUS_FULFILLED
+from mongoengine import ValidationError
+from mongoengine import StringField, EmailField, IntField, BooleanField, DateField, DateTimeField
+from mongoengine import ObjectIdField, ReferenceField, ListField, EmbeddedDocumentField
+
+
+# validate raw (BSON-shaped) documents without constructing mongoengine documents: the field rules of a document class
+# are compiled once into plain checks, which then run over any number of dicts, or are pushed to the server as an
+# equivalent `$jsonSchema` validator
+
+
+def validate_many(document, raws):
+    # validate every raw dict in `raws` against `document` in a single pass; returns {index: {field: message}} for
+    # the invalid ones
+    validate = compile_validator(document)
+    errors = {}
+    for i, raw in enumerate(raws):
+        error = validate(raw)
+        if error:
+            errors[i] = error
+    return errors
+
+
+@functools.lru_cache(maxsize=None)
+def compile_validator(document):
+    # compile `document`'s field rules and `clean` constraints into a function mapping a raw dict to its errors
+    fields = [
+        (field.db_field, _required(field), _compile_field(field))
+        for name, field in document._fields.items()
+        if name != 'id'
+    ]
+    document_checks = _DOCUMENT_CHECKS.get(document, [])
+
+    def validate(raw):
+        errors = {}
+        if not isinstance(raw, dict):
+            return {'': 'Not a document'}
+        for db_field, required, check in fields:
+            value = raw.get(db_field)
+            if value is None:
+                if required:
+                    errors[db_field] = 'Field is required'
+                continue
+            error = check(value)
+            if error:
+                errors[db_field] = error
+        if not errors:
+            for document_check in document_checks:
+                error = document_check(raw)
+                if error:
+                    errors[''] = error
+                    break
+        return errors
+
+    return validate
+
+
+def json_schema(document):
+    # the `$jsonSchema` equivalent of `compile_validator(document)`
+    schema = {
+        'bsonType': 'object',
+        'required': [field.db_field for name, field in document._fields.items() if _required(field) and name != 'id'],
+        'properties': {
+            field.db_field: _field_schema(document, name, field) for name, field in document._fields.items()
+        },
+    }
+    if not schema['required']:
+        del schema['required']
+    schema.update(_DOCUMENT_SCHEMAS.get(document, {}))
+    return schema
+
+
+def apply_json_schema(document, level='moderate'):
+    # make the server reject writes to `document`'s collection violating its schema; with the default 'moderate'
+    # level, documents already invalid can still be updated
+    db = document._get_db()
+    name = document._get_collection_name()
+    validator = {'$jsonSchema': json_schema(document)}
+    if name in db.list_collection_names(filter={'name': name}):
+        db.command('collMod', name, validator=validator, validationLevel=level)
+    else:
+        db.create_collection(name, validator=validator, validationLevel=level)
+
+
+def _required(field):
+    # a missing field with a default is filled in when the document is loaded, so only fields without one must be
+    # present in the raw document
+    return field.required and field.default is None
+
+
+def _compile_field(field):
+    checks = []
+    if isinstance(field, StringField):
+        checks.append(_type_check(str))
+        if field.max_length is not None:
+            n = field.max_length
+            checks.append(lambda v: f'String value is too long ({len(v)} > {n})' if len(v) > n else None)
+        if field.min_length is not None:
+            m = field.min_length
+            checks.append(lambda v: f'String value is too short ({len(v)} < {m})' if len(v) < m else None)
+        if field.regex is not None:
+            regex = field.regex
+            checks.append(lambda v: None if regex.match(v) else 'String value did not match validation regex')
+        if isinstance(field, EmailField):
+            checks.append(_field_validate(field))
+    elif isinstance(field, BooleanField):
+        checks.append(_type_check(bool))
+    elif isinstance(field, IntField):
+        checks.append(lambda v: None if isinstance(v, int) and not isinstance(v, bool) else f'{v!r} is not an int')
+        if field.min_value is not None:
+            lo = field.min_value
+            checks.append(lambda v: f'Integer value is too small ({v} < {lo})' if v < lo else None)
+        if field.max_value is not None:
+            hi = field.max_value
+            checks.append(lambda v: f'Integer value is too large ({v} > {hi})' if v > hi else None)
+    elif isinstance(field, (DateField, DateTimeField)):
+        checks.append(_type_check(datetime))
+    elif isinstance(field, (ObjectIdField, ReferenceField)):
+        checks.append(_type_check(ObjectId))
+    elif isinstance(field, EmbeddedDocumentField):
+        validate = compile_validator(field.document_type)
+        checks.append(lambda v: '; '.join(f'{k}: {e}' for k, e in validate(v).items()) or None)
+    elif isinstance(field, ListField):
+        item_check = _compile_field(field.field) if field.field is not None else None
+        checks.append(_type_check(list))
+        if item_check is not None:
+            checks.append(lambda v: next((f'[{i}] {e}' for i, e in enumerate(map(item_check, v)) if e), None))
+    else:
+        checks.append(_field_validate(field))
+    if field.choices:
+        choices = frozenset(choice[0] if isinstance(choice, (list, tuple)) else choice for choice in field.choices)
+        checks.append(lambda v: None if v in choices else f'Value must be one of {sorted(choices)}')
+    if field.validation is not None:
+        checks.append(_field_validation(field.validation))
+
+    def check(value):
+        for c in checks:
+            error = c(value)
+            if error:
+                return error
+        return None
+
+    return check
+
+
+def _type_check(types):
+    return lambda v: None if isinstance(v, types) else f'{v!r} is not of type {types.__name__}'
+
+
+def _field_validate(field):
+    # fall back to mongoengine's own per-value validation
+    def check(value):
+        try:
+            field.validate(field.to_python(value))
+        except ValidationError as e:
+            return e.message
+        return None
+
+    return check
+
+
+def _field_validation(validation):
+    def check(value):
+        try:
+            validation(value)
+        except ValidationError as e:
+            return e.message
+        return None
+
+    return check
+
+
+def _field_schema(document, name, field):
+    schema = _FIELD_SCHEMAS.get((document, name))
+    if schema is not None:
+        return schema
+    if isinstance(field, StringField):
+        schema = {'bsonType': 'string'}
+        if field.max_length is not None:
+            schema['maxLength'] = field.max_length
+        if field.min_length is not None:
+            schema['minLength'] = field.min_length
+        if field.regex is not None:
+            schema['pattern'] = '^(?:' + field.regex.pattern + ')'
+    elif isinstance(field, BooleanField):
+        schema = {'bsonType': 'bool'}
+    elif isinstance(field, IntField):
+        schema = {'bsonType': ['int', 'long']}
+        if field.min_value is not None:
+            schema['minimum'] = field.min_value
+        if field.max_value is not None:
+            schema['maximum'] = field.max_value
+    elif isinstance(field, (DateField, DateTimeField)):
+        schema = {'bsonType': 'date'}
+    elif isinstance(field, (ObjectIdField, ReferenceField)):
+        schema = {'bsonType': 'objectId'}
+    elif isinstance(field, EmbeddedDocumentField):
+        schema = json_schema(field.document_type)
+    elif isinstance(field, ListField):
+        schema = {'bsonType': 'array'}
+        if field.field is not None:
+            schema['items'] = _field_schema(None, None, field.field)
+    else:
+        schema = {}
+    if field.choices:
+        schema['enum'] = [choice[0] if isinstance(choice, (list, tuple)) else choice for choice in field.choices]
+    return schema
+
+
+def _check_request_fulfillment(raw):
+    # `Request.clean`
+    fulfilled = raw.get('status') == STATUS_FULFILLED
+    if fulfilled and raw.get('date_fulfilled') is None:
+        return 'Request fulfilled but not specified when'
+    if not fulfilled and raw.get('date_fulfilled') is not None:
+        return 'Request not fulfilled but date_fulfilled is set'
+    return None
+
+
+_DOCUMENT_CHECKS = {
+    Request: [_check_request_fulfillment],
+}
+
+_DOCUMENT_SCHEMAS = {
+    Request: {
+        'oneOf': [
+            {'properties': {'status': {'enum': [STATUS_FULFILLED]}}, 'required': ['date_fulfilled']},
+            {'properties': {'status': {'not': {'enum': [STATUS_FULFILLED]}}}, 'not': {'required': ['date_fulfilled']}},
+        ],
+    },
+}
+
+_FIELD_SCHEMAS = {
+    # `_validate_request_status`
+    (Request, 'status'): {
+        'bsonType': ['int', 'long'],
+        'enum': sorted(REQUEST_STATUSES),
+    },
+}
@@ -0,0 +1,92 @@
+from mongoengine import DoesNotExist
+from mongoengine.errors import SaveConditionError
+from tenancy import TenantQuerySet
+
+# `Student`, `Course` and `Request` carry a `version` incremented by every write through their querysets, and by
+# `bump` in bulk writes on their raw collections. Callers compare versions to learn cheaply whether a document has
+# changed, and make compare-and-swap updates with `update_if_version`/`save_versioned`
+
+
+class VersionedQuerySet(TenantQuerySet):
+    # a `TenantQuerySet` whose updates and modifications also increment `version`, unless they set it themselves
+
+    def update(self, upsert=False, multi=True, write_concern=None, read_concern=None, full_result=False,
+               array_filters=None, **update):
+        return super().update(upsert=upsert, multi=multi, write_concern=write_concern, read_concern=read_concern,
+                              full_result=full_result, array_filters=array_filters, **_increment(update))
+
+    def modify(self, upsert=False, full_response=False, remove=False, new=False, array_filters=None, **update):
+        return super().modify(upsert=upsert, full_response=full_response, remove=remove, new=new,
+                              array_filters=array_filters, **(update if remove else _increment(update)))
+
+
+def bump(document, update):
+    # add the `version` increment to the raw `update` of a `document` bypassing its queryset
+    if 'version' not in document._fields:
+        return update
+    return dict(update, **{'$inc': dict(update.get('$inc', {}), version=1)})
+
+
+def touch(document, ids):
+    # increment the version of the documents of `ids`, e.g. of the courses whose links changed
+    if ids:
+        document.objects(id__in=list(ids)).update(inc__version=1)
+
+
+def current_version(document, doc_id):
+    # the stored version of a document, read from the `_id` index and the document alone
+    raw = document.objects(id=doc_id).only('version').as_pymongo().first()
+    if raw is None:
+        raise DoesNotExist(f"{document.__name__} {doc_id} doesn't exist")
+    return raw.get('version', 0)
+
+
+def has_changed(doc):
+    # whether `doc` was written since it was loaded
+    return current_version(type(doc), doc.id) != doc.version
+
+
+def update_if_version(doc, version, **update):
+    # apply `update` to `doc` only if it is still at `version`
+    if not type(doc).objects(id=doc.id, **_at_version(version)).update_one(**update):
+        raise SaveConditionError(f"{doc} is no longer at version {version}")
+
+
+def save_versioned(doc, modify, retries=3):
+    # read-modify-write: reload `doc`, apply `modify(doc)` and save it unless another write happened in between, in
+    # which case start over; returns what `modify` returned
+    for _ in range(retries):
+        doc.reload()
+        result = modify(doc)
+        version = doc.version
+        doc.version = version + 1
+        try:
+            doc.save(save_condition=_at_version(version))
+            return result
+        except SaveConditionError:
+            continue
+    raise SaveConditionError(f"{doc} kept changing during {retries} attempts to save it")
+
+
+def _increment(update):
+    if '__raw__' in update:
+        # copied, the caller's operator dicts would otherwise receive the increment
+        update['__raw__'] = {op: dict(fields) for op, fields in update['__raw__'].items()}
+    if not _sets_version(update):
+        update['inc__version'] = 1
+    return update
+
+
+def _at_version(version):
+    # documents written before versioning have no `version`, and load as version 0
+    return {'version__in': [0, None]} if version == 0 else {'version': version}
+
+
+def _sets_version(update):
+    for key, value in update.items():
+        if key == '__raw__':
+            if any('version' in fields for fields in value.values()):
+                return True
+        elif key.split('__')[-1] == 'version':
+            return True
+    return False